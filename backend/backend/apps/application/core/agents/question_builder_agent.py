@@ -1,4 +1,3 @@
-import json
 import math
 
 from backend.apps.application.models import Application, ApplicationPrompt
@@ -52,7 +51,7 @@ class Agent:
             ),
             user_content=f"Please generate {question_count} different questions as requested.",
         )
-        tokens = get_llm_tokens(json.dumps(llm_messages))
+        tokens = get_llm_tokens(llm_messages)
         result = ChatCompletionService.create_completion(
             model=f"ollama:{ENV.QUESTION_BUILDER_MODEL}",
             messages=llm_messages,
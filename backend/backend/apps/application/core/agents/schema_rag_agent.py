@@ -1,60 +1,87 @@
-import json
-import math
+import hashlib
 
 from backend.apps.application.models import Application
-from backend.apps.application.utils import json_list_to_ddl
 from backend.apps.chat.core.utils import validate_json_string
 from backend.settings.env import ENV
 from backend.utils.llm import (
-    ChatCompletionService,
-    create_application_schema,
+    AsyncChatCompletionService,
+    create_application_ddl,
     get_llm_tokens,
+    get_schema_version,
 )
+from backend.utils.memory_cache import LRUCache
 
 from ..prompts.schema_rag_prompt import prompt as schema_rag_prompt
 
+# Agents of applications kept for reuse in each worker
+SCHEMA_RAG_AGENT_CACHE_SIZE = 64
+
 
 class Agent:
     """
     DB schema rag agent
     """
 
-    def __init__(self, application_id):
-        self.schema_ddl_str = ""
-        self.current_execution_count = 1
+    def __init__(self, application_id, prompt: str | None = None):
+        """
+        :param application_id: Application
+        :param prompt: Schema RAG prompt of the application, read from the database if None
+        """
         self.maximum_execution_count = 3
         self.application_id = application_id
-        self.schema_rag_prompt = Application.objects.get(
-            id=application_id
-        ).prompts.schema_rag_prompt
-        self.schema_rag_prompt = self.schema_rag_prompt or schema_rag_prompt
-        schema, self.schema_str = create_application_schema(application_id)
-        _, self.schema_ddl_str = json_list_to_ddl(schema)
-
-    def run(
+        if prompt is None:
+            prompt = Application.objects.get(id=application_id).prompts.schema_rag_prompt
+        self.schema_rag_prompt = prompt or schema_rag_prompt
+        _, self.schema_ddl_str = create_application_ddl(application_id)
+        # The system message only depends on the schema and prompt, build and count it once
+        self.system_content = self.schema_rag_prompt.format(
+            database_schema=self.schema_ddl_str,
+        )
+        self.system_tokens = get_llm_tokens(self.system_content)
+
+    async def run(
         self,
         question: str,
     ) -> str:
-        if self.current_execution_count > self.maximum_execution_count:
-            raise Exception("Maximum execution count reached")
-        llm_messages = ChatCompletionService.set_llm_messages(
-            system_content=self.schema_rag_prompt.format(
-                database_schema=self.schema_ddl_str,
-            ),
-            user_content=question,
-        )
-        tokens = get_llm_tokens(llm_messages)
-        result = ChatCompletionService.create_completion(
-            model=f"ollama:{ENV.SCHEMA_RAG_MODEL}",
-            messages=llm_messages,
-            options={
-                "num_ctx": tokens + 512,
-                "num_batch": 512,
-                "temperature": 0.3,
-            },
-        )
-        result, _ = validate_json_string(result)
-        if not result:
-            self.current_execution_count += 1
-            return self.run(question)
-        return result
+        # Retries are counted per call, the agent is shared by concurrent requests
+        for _ in range(self.maximum_execution_count):
+            llm_messages = AsyncChatCompletionService.set_llm_messages(
+                system_content=self.system_content,
+                user_content=question,
+            )
+            tokens = self.system_tokens + get_llm_tokens(question)
+            result = await AsyncChatCompletionService.create_completion(
+                model=f"ollama:{ENV.SCHEMA_RAG_MODEL}",
+                messages=llm_messages,
+                options={
+                    "num_ctx": tokens + 512,
+                    "num_batch": 512,
+                    "temperature": 0.3,
+                },
+            )
+            result, _ = validate_json_string(result)
+            if result:
+                return result
+        raise Exception("Maximum execution count reached")
+
+
+_agents = LRUCache(maxsize=SCHEMA_RAG_AGENT_CACHE_SIZE)
+
+
+def get_agent(application_id, prompt: str | None = None) -> Agent:
+    """
+    Get a schema rag agent reused across requests until the schema or prompt changes
+    :param application_id: Application
+    :param prompt: Schema RAG prompt of the application, the default prompt if empty
+    """
+    prompt = prompt or ""
+    key = (
+        str(application_id),
+        get_schema_version(application_id),
+        hashlib.sha1(prompt.encode("utf-8")).hexdigest(),
+    )
+    agent = _agents.get(key)
+    if agent is None:
+        agent = Agent(application_id, prompt=prompt)
+        _agents.set(key, agent)
+    return agent
@@ -1,82 +1,537 @@
+import contextlib
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import sqlalchemy
+from sqlalchemy.engine import Engine
+
+from backend.settings.env import ENV
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+
+def get_database_uri(database_configuration: dict) -> str:
+    db_user = database_configuration.get("db_user")
+    db_password = urllib.parse.quote(
+        str(database_configuration.get("db_password", "")), ""
+    )
+    db_host = database_configuration.get("db_host")
+    db_port = database_configuration.get("db_port")
+    db_name = database_configuration.get("db_name")
+    return f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+
+
+def get_read_endpoints(database_configuration: dict) -> list[tuple[dict, int]]:
+    """
+    Connections of the read replicas of a database with their weights. Replicas are
+    configured in read_replicas, each with db_host, db_port and weight; the other
+    connection settings default to the primary's.
+    :param database_configuration: Application database configuration
+    :return: [(replica configuration, weight)]
+    """
+    primary = {
+        key: value for key, value in database_configuration.items() if key != "read_replicas"
+    }
+    endpoints = []
+    for replica in database_configuration.get("read_replicas") or []:
+        configuration = {
+            **primary,
+            **{
+                key: value
+                for key, value in replica.items()
+                if key != "weight" and value not in (None, "")
+            },
+        }
+        weight = replica.get("weight")
+        weight = 1 if weight in (None, "") else max(0, int(weight))
+        endpoints.append((configuration, weight))
+    return endpoints
+
+
+class ReadEndpoint:
+    def __init__(self, name: str, engine: Engine, weight: int):
+        self.name = name
+        self.engine = engine
+        self.weight = weight
+        self.healthy = True
+        # Monotonic time of the last health check or failure
+        self.checked_at = float("-inf")
+
+
+class ReadRouter:
+    """
+    Routes read queries of a database across its read replicas by weight.
+    Replicas are health checked at most once per interval, by the first request after it
+    ends, and skipped while down. The primary takes its share of reads set by
+    primary_read_weight, 0 by default when there are replicas, and all reads when no
+    replica is up. Every session is READ ONLY, so queries can never write.
+    """
+
+    def __init__(self, database_configuration: dict, create_engine):
+        """
+        :param database_configuration: Application database configuration
+        :param create_engine: Creates a read only engine for a configuration
+        """
+        self._lock = threading.Lock()
+        self.health_check_interval = float(
+            database_configuration.get("replica_health_check_interval")
+            or ENV.REPLICA_HEALTH_CHECK_INTERVAL
+            or DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL
+        )
+        # Seconds a replica may lag behind the primary, not checked if None
+        max_replication_lag = database_configuration.get("max_replication_lag")
+        self.max_replication_lag = (
+            float(max_replication_lag) if max_replication_lag not in (None, "") else None
+        )
+        self.replicas = [
+            ReadEndpoint(
+                f"{configuration.get('db_host')}:{configuration.get('db_port')}",
+                create_engine(configuration),
+                weight,
+            )
+            for configuration, weight in get_read_endpoints(database_configuration)
+        ]
+        primary_weight = database_configuration.get("primary_read_weight")
+        if primary_weight in (None, ""):
+            primary_weight = 0 if self.replicas else 1
+        self.primary = ReadEndpoint(
+            "primary",
+            create_engine(
+                {
+                    key: value
+                    for key, value in database_configuration.items()
+                    if key != "read_replicas"
+                }
+            ),
+            max(0, int(primary_weight)),
+        )
+
+    @property
+    def engines(self) -> list[Engine]:
+        return [self.primary.engine, *(replica.engine for replica in self.replicas)]
+
+    @staticmethod
+    def _get_replication_lag(connection) -> float | None:
+        """
+        Seconds a replica is behind its source, None if unknown or replication stopped
+        """
+        for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+            try:
+                row = connection.exec_driver_sql(statement).mappings().first()
+            except Exception:
+                # SHOW REPLICA STATUS needs MySQL 8.0.22
+                continue
+            if row is None:
+                return None
+            lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            return float(lag) if lag is not None else None
+        return None
+
+    def _check(self, endpoint: ReadEndpoint) -> bool:
+        try:
+            with endpoint.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+                if self.max_replication_lag is None:
+                    return True
+                lag = self._get_replication_lag(connection)
+        except Exception as e:
+            logger.warning("Read replica %s is down: %s", endpoint.name, e)
+            return False
+        if lag is None or lag > self.max_replication_lag:
+            logger.warning("Read replica %s lags behind: %s seconds", endpoint.name, lag)
+            return False
+        return True
+
+    def _is_available(self, endpoint: ReadEndpoint) -> bool:
+        with self._lock:
+            check = time.monotonic() - endpoint.checked_at >= self.health_check_interval
+            if check:
+                # Other requests keep using the last status while this one checks
+                endpoint.checked_at = time.monotonic()
+        if check:
+            endpoint.healthy = self._check(endpoint)
+        return endpoint.healthy
+
+    def mark_down(self, endpoint: ReadEndpoint):
+        """
+        Skip an endpoint that failed until its next health check
+        """
+        if endpoint is self.primary:
+            return
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.checked_at = time.monotonic()
+
+    def choose(self, exclude: list[ReadEndpoint] | None = None) -> ReadEndpoint | None:
+        """
+        Pick a read endpoint by weight among the endpoints that are up
+        :param exclude: Endpoints that already failed for this query
+        :return: Endpoint, None if every endpoint was excluded
+        """
+        exclude = exclude or []
+        candidates = [
+            endpoint
+            for endpoint in [self.primary, *self.replicas]
+            if endpoint.weight > 0
+            and endpoint not in exclude
+            and (endpoint is self.primary or self._is_available(endpoint))
+        ]
+        if candidates:
+            return random.choices(
+                candidates, weights=[endpoint.weight for endpoint in candidates]
+            )[0]
+        # Fail over to the primary
+        return self.primary if self.primary not in exclude else None
+
+
+class EngineRegistry:
+    """
+    Process-wide registry of pooled engines for application databases.
+    Engines are keyed by the fingerprint of the database configuration, so
+    every request for the same database reuses the same connection pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: dict[str, Engine] = {}
+        self._read_routers: dict[str, ReadRouter] = {}
+        self._application_fingerprints: dict[str, str] = {}
+
+    @staticmethod
+    def fingerprint(database_configuration: dict) -> str:
+        text = json.dumps(
+            database_configuration or {},
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str,
+        )
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _create_engine(database_configuration: dict, read_only: bool = False) -> Engine:
+        engine = sqlalchemy.create_engine(
+            get_database_uri(database_configuration),
+            pool_size=int(ENV.APPLICATION_DATABASE_POOL_SIZE or 5),
+            max_overflow=int(ENV.APPLICATION_DATABASE_POOL_MAX_OVERFLOW or 5),
+            pool_timeout=int(ENV.APPLICATION_DATABASE_POOL_TIMEOUT or 30),
+            pool_recycle=int(ENV.APPLICATION_DATABASE_POOL_RECYCLE or 1800),
+            pool_pre_ping=True,
+        )
+        if read_only:
+
+            # On every checkout, a query could have made a pooled session READ WRITE
+            @sqlalchemy.event.listens_for(engine, "checkout")
+            def set_read_only(dbapi_connection, connection_record, connection_proxy):
+                cursor = dbapi_connection.cursor()
+                try:
+                    cursor.execute("SET SESSION TRANSACTION READ ONLY")
+                finally:
+                    cursor.close()
+
+        return engine
+
+    def get_engine(self, database_configuration: dict, application_id=None) -> Engine:
+        """
+        Get the pooled engine for a database configuration, creating it on first use.
+        If the application's configuration changed since the last call, the
+        engine of the old configuration is disposed.
+        :param database_configuration: Application database configuration
+        :param application_id: Owning application id, used for eviction
+        :return: Engine
+        """
+        key = self.fingerprint(database_configuration)
+        stale_engines = []
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._create_engine(database_configuration)
+                self._engines[key] = engine
+            if application_id is not None:
+                old_key = self._application_fingerprints.get(str(application_id))
+                self._application_fingerprints[str(application_id)] = key
+                if old_key and old_key != key:
+                    stale_engines = self._pop_unused(old_key)
+        for stale_engine in stale_engines:
+            stale_engine.dispose()
+        return engine
+
+    def get_read_router(self, database_configuration: dict, application_id=None) -> ReadRouter:
+        """
+        Get the read router of a database configuration, creating it on first use.
+        Its engines are disposed with the engine of the configuration.
+        :param database_configuration: Application database configuration
+        :param application_id: Owning application id, used for eviction
+        :return: ReadRouter
+        """
+        key = self.fingerprint(database_configuration)
+        self.get_engine(database_configuration, application_id=application_id)
+        with self._lock:
+            read_router = self._read_routers.get(key)
+            if read_router is None:
+                read_router = ReadRouter(
+                    database_configuration,
+                    lambda configuration: self._create_engine(
+                        configuration, read_only=True
+                    ),
+                )
+                self._read_routers[key] = read_router
+        return read_router
+
+    def _pop_unused(self, key: str) -> list[Engine]:
+        """
+        Remove the engines of a configuration that is no longer referenced by any application.
+        Must be called with the lock held.
+        """
+        if key in self._application_fingerprints.values():
+            return []
+        engines = []
+        engine = self._engines.pop(key, None)
+        if engine is not None:
+            engines.append(engine)
+        read_router = self._read_routers.pop(key, None)
+        if read_router is not None:
+            engines.extend(read_router.engines)
+        return engines
+
+    def evict(self, application_id, database_configuration: dict | None = None):
+        """
+        Dispose the engine of an application.
+        :param application_id: Application id
+        :param database_configuration: Current configuration, the engine is kept if it is unchanged
+        """
+        with self._lock:
+            key = self._application_fingerprints.get(str(application_id))
+            if not key:
+                return
+            if (
+                database_configuration is not None
+                and self.fingerprint(database_configuration) == key
+            ):
+                return
+            del self._application_fingerprints[str(application_id)]
+            engines = self._pop_unused(key)
+        for engine in engines:
+            engine.dispose()
+
+    def dispose_all(self):
+        with self._lock:
+            engines = list(self._engines.values())
+            for read_router in self._read_routers.values():
+                engines.extend(read_router.engines)
+            self._engines.clear()
+            self._read_routers.clear()
+            self._application_fingerprints.clear()
+        for engine in engines:
+            engine.dispose()
+
+
+engine_registry = EngineRegistry()
 
 
 class DatabaseExecutor:
-    def __init__(self, database_configuration: dict):
-        self.db_user = database_configuration.get("db_user")
-        self.db_password = urllib.parse.quote(database_configuration.get("db_password"), "")
-        self.db_host = database_configuration.get("db_host")
-        self.db_port = database_configuration.get("db_port")
+    def __init__(self, database_configuration: dict, application_id=None):
         self.db_name = database_configuration.get("db_name")
-        self.database_uri = (
-            f"mysql+mysqlconnector://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
+        self.engine = engine_registry.get_engine(
+            database_configuration, application_id=application_id
         )
-        print(self.database_uri)
-        self.engine = sqlalchemy.create_engine(self.database_uri)
 
     def execute(self, sql_query: str) -> pd.DataFrame:
         df = pd.read_sql_query(sql_query, self.engine)
         return df
 
-    def get_ddl(self):
+    def _fetch_all(self, query: str, session_sql: str = "", **params) -> list[dict]:
+        statement = sqlalchemy.text(query)
+        if "table_names" in params:
+            statement = statement.bindparams(
+                sqlalchemy.bindparam("table_names", expanding=True)
+            )
+        with self.engine.connect() as connection:
+            if session_sql:
+                connection.exec_driver_sql(session_sql)
+            return [dict(row) for row in connection.execute(statement, params).mappings()]
+
+    def _get_table_ddl(self, table_name: str) -> str:
+        with self.engine.connect() as connection:
+            row = connection.exec_driver_sql(
+                f"SHOW CREATE TABLE `{table_name.replace('`', '``')}`"
+            ).first()
+        return row[1]
+
+    def get_ddl(self, max_workers: int = 1):
         """
         Get DDL
+        :param max_workers: Number of concurrent SHOW CREATE TABLE queries, each uses a pooled connection
         :return:
         """
-        df = self.execute("SHOW TABLES")
-        ddl_list = []
-        for item in df.to_numpy():
-            table_name = item[0]
-            _df = self.execute(f"SHOW CREATE TABLE {table_name}")
-            table_ddl = _df.to_numpy()[0][1]
-            ddl_list.append(table_ddl)
-        return ddl_list
+        table_names = [
+            row["TABLE_NAME"]
+            for row in self._fetch_all(
+                """
+                SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_SCHEMA = :schema
+                ORDER BY TABLE_NAME
+                """,
+                schema=self.db_name,
+            )
+        ]
+        if max_workers <= 1:
+            return [self._get_table_ddl(table_name) for table_name in table_names]
+        # Never wait on connections beyond what the pool can hand out
+        max_workers = min(max_workers, self.engine.pool.size())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self._get_table_ddl, table_names))
 
-    def create_tables(self):
+    def get_table_checksums(self, table_names: list[str] | None = None) -> dict:
         """
-        Get DDL JSON
-        :return:
+        Get a checksum of the definition of every table in one query, so changed tables
+        are found without introspecting them. It covers the table comment and the name,
+        type, nullability, key, default, comment and foreign key target of every column.
+        :param table_names: Only these tables, all tables if None
+        :return: {table_name: checksum}
         """
-        df = self.execute(
+        if table_names is not None and not table_names:
+            return {}
+        params = {"schema": self.db_name}
+        table_filter = ""
+        if table_names is not None:
+            table_filter = "AND t.TABLE_NAME IN :table_names"
+            params["table_names"] = list(table_names)
+        rows = self._fetch_all(
             f"""
-                SELECT TABLE_NAME, TABLE_COMMENT
-                FROM INFORMATION_SCHEMA.TABLES
-                WHERE TABLE_SCHEMA = '{self.db_name}';
-"""
+            SELECT t.TABLE_NAME, MD5(CONCAT_WS('|', t.TABLE_COMMENT, GROUP_CONCAT(
+                CONCAT_WS(',', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY,
+                          IFNULL(c.COLUMN_DEFAULT, 'NULL'), c.COLUMN_COMMENT,
+                          k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME)
+                ORDER BY c.ORDINAL_POSITION, k.CONSTRAINT_NAME SEPARATOR ';'
+            ))) AS CHECKSUM
+            FROM INFORMATION_SCHEMA.TABLES t
+            LEFT JOIN INFORMATION_SCHEMA.COLUMNS c
+                ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+            LEFT JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
+                ON k.TABLE_SCHEMA = c.TABLE_SCHEMA AND k.TABLE_NAME = c.TABLE_NAME
+                AND k.COLUMN_NAME = c.COLUMN_NAME AND k.REFERENCED_TABLE_NAME IS NOT NULL
+            WHERE t.TABLE_SCHEMA = :schema {table_filter}
+            GROUP BY t.TABLE_NAME, t.TABLE_COMMENT
+            """,
+            # The default 1024 bytes would truncate the definition of wide tables
+            session_sql="SET SESSION group_concat_max_len = 16777216",
+            **params,
         )
-        tables = [
-            {
-                "table_name": row[0],
-                "comment": row[1],
-            }
-            for row in df.to_numpy()
-        ]
-        ddl_json = []
-        for item in tables:
-            table_name = item["table_name"]
-            query = f"""
-                        SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_DEFAULT, COLUMN_COMMENT
-                        FROM INFORMATION_SCHEMA.COLUMNS
-                        WHERE TABLE_SCHEMA = '{self.db_name}' AND TABLE_NAME = '{table_name}';
-                    """
-            df = self.execute(query)
-            table_ddl = {
-                "table_name": table_name,
-                "comment": item["comment"],
-                "columns": [
-                    {
-                        "name": row[0],
-                        "type": row[1],
-                        "nullable": row[2],
-                        "key": row[3],
-                        "default": row[4],
-                        "comment": row[5],
-                    }
-                    for row in df.to_numpy()
-                ],
+        return {row["TABLE_NAME"]: row["CHECKSUM"] for row in rows}
+
+    def get_table_update_times(self, table_names: list[str]) -> dict:
+        """
+        Get the time of the last data change of tables, None for tables not changed since the
+        server started
+        :param table_names: Tables
+        :return: {table_name: update_time}
+        """
+        if not table_names:
+            return {}
+        statement = sqlalchemy.text(
+            """
+            SELECT TABLE_NAME, UPDATE_TIME FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = :schema AND TABLE_NAME IN :table_names
+            """
+        ).bindparams(sqlalchemy.bindparam("table_names", expanding=True))
+        with self.engine.connect() as connection:
+            # MySQL 8 caches table statistics for a day by default, changes must show up
+            # at once; older servers and MariaDB don't cache them
+            with contextlib.suppress(Exception):
+                connection.exec_driver_sql(
+                    "SET SESSION information_schema_stats_expiry = 0"
+                )
+            rows = connection.execute(
+                statement, {"schema": self.db_name, "table_names": list(table_names)}
+            ).mappings()
+            return {row["TABLE_NAME"]: row["UPDATE_TIME"] for row in rows}
+
+    def create_tables(self, table_names: list[str] | None = None):
+        """
+        Get DDL JSON of the tables of the database from three INFORMATION_SCHEMA queries
+        :param table_names: Only these tables, all tables if None
+        :return: [{table_name, comment, columns, foreign_keys}]
+        """
+        if table_names is not None and not table_names:
+            return []
+        params = {"schema": self.db_name}
+        table_filter = ""
+        if table_names is not None:
+            table_filter = "AND TABLE_NAME IN :table_names"
+            params["table_names"] = list(table_names)
+        tables = self._fetch_all(
+            f"""
+            SELECT TABLE_NAME, TABLE_COMMENT
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = :schema {table_filter}
+            ORDER BY TABLE_NAME
+            """,
+            **params,
+        )
+        columns = self._fetch_all(
+            f"""
+            SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY,
+                   COLUMN_DEFAULT, COLUMN_COMMENT
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = :schema {table_filter}
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """,
+            **params,
+        )
+        foreign_keys = self._fetch_all(
+            f"""
+            SELECT TABLE_NAME, COLUMN_NAME, CONSTRAINT_NAME,
+                   REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+            FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = :schema AND REFERENCED_TABLE_NAME IS NOT NULL
+            {table_filter}
+            ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+            """,
+            **params,
+        )
+
+        ddl_json = {
+            row["TABLE_NAME"]: {
+                "table_name": row["TABLE_NAME"],
+                "comment": row["TABLE_COMMENT"],
+                "columns": [],
+                "foreign_keys": [],
             }
-            ddl_json.append(table_ddl)
-        return ddl_json
+            for row in tables
+        }
+        for row in columns:
+            table_ddl = ddl_json.get(row["TABLE_NAME"])
+            if table_ddl is None:
+                continue
+            table_ddl["columns"].append(
+                {
+                    "name": row["COLUMN_NAME"],
+                    "type": row["COLUMN_TYPE"],
+                    "nullable": row["IS_NULLABLE"],
+                    "key": row["COLUMN_KEY"],
+                    "default": row["COLUMN_DEFAULT"],
+                    "comment": row["COLUMN_COMMENT"],
+                }
+            )
+        for row in foreign_keys:
+            table_ddl = ddl_json.get(row["TABLE_NAME"])
+            if table_ddl is None:
+                continue
+            table_ddl["foreign_keys"].append(
+                {
+                    "name": row["CONSTRAINT_NAME"],
+                    "column": row["COLUMN_NAME"],
+                    "referenced_table": row["REFERENCED_TABLE_NAME"],
+                    "referenced_column": row["REFERENCED_COLUMN_NAME"],
+                }
+            )
+        return list(ddl_json.values())
@@ -0,0 +1,83 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from backend.settings.env import ENV
+
+DEFAULT_EMBEDDING_UPLOAD_CONCURRENCY = 4
+EMBEDDING_REQUEST_RETRIES = 3
+EMBEDDING_REQUEST_TIMEOUT = 60
+
+
+class EmbeddingServiceError(Exception):
+    pass
+
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_embedding_upload_concurrency() -> int:
+    return int(ENV.EMBEDDING_UPLOAD_CONCURRENCY or DEFAULT_EMBEDDING_UPLOAD_CONCURRENCY)
+
+
+def get_embedding_session() -> requests.Session:
+    """
+    Shared session of the embedding service, keeps connections alive across uploads
+    and retries failed connections and gateway errors with backoff
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=EMBEDDING_REQUEST_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                # Uploads overwrite the file of the same name, so POST can be retried
+                allowed_methods=None,
+            )
+            adapter = HTTPAdapter(
+                pool_maxsize=get_embedding_upload_concurrency(), max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _post(path: str, **kwargs) -> dict:
+    url = f"{ENV.EMBEDDING_SERVICE_ENDPOINT}{path}"
+    try:
+        response = get_embedding_session().post(
+            url, timeout=EMBEDDING_REQUEST_TIMEOUT, **kwargs
+        )
+    except requests.RequestException as e:
+        raise EmbeddingServiceError(f"Embedding service request failed: {e}") from e
+    if response.status_code != 200:
+        raise EmbeddingServiceError(
+            f"Embedding service request {path} failed with status {response.status_code}"
+        )
+    return response.json().get("data") or {}
+
+
+def upload_document(app_code: str, file_name: str, text: str) -> dict:
+    """
+    Upload a text document of an application to the embedding service
+    :return: file_name, file_path, content_type and file_size of the stored document
+    """
+    files = {"file": (file_name, text.encode("utf-8"), "text/plain")}
+    return _post("/upload", files=files, data={"app_code": app_code})
+
+
+def create_embed(app_code: str):
+    """
+    Rebuild the embedding of the uploaded documents of an application
+    """
+    _post("/create_embed", json={"app_code": app_code})
+
+
+def retrieval_embed(app_code: str, question: str) -> dict:
+    return _post("/retrieval_embed", json={"app_code": app_code, "question": question})
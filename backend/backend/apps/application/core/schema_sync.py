@@ -0,0 +1,203 @@
+from django.db import transaction
+from django.utils import timezone
+
+from backend.apps.application.core.database import DatabaseExecutor
+from backend.apps.application.models import ApplicationTable, ApplicationTableColumn
+from backend.utils.llm import batch_schema_version_bump
+
+COLUMN_FIELDS = ("key", "type", "default", "comment", "nullable")
+BULK_BATCH_SIZE = 500
+
+
+def _get_empty_summary() -> dict:
+    return {
+        "added_tables": [],
+        "altered_tables": [],
+        "removed_tables": [],
+        "added_columns": [],
+        "altered_columns": [],
+        "removed_columns": [],
+    }
+
+
+def sync_application_tables(
+    application, tables: list[dict], checksums: dict | None = None
+) -> dict:
+    """
+    Diff introspected tables against the stored tables of an application and write only the changes.
+    AI comments of existing tables and columns are kept, new ones start from the database comment.
+    :param application: Application
+    :param tables: DDL JSON from DatabaseExecutor.create_tables
+    :param checksums: Checksums of all tables in the database, tables missing from `tables`
+        are then unchanged rather than removed
+    :return: Names of added, altered and removed tables and columns, columns as "table.column"
+    """
+    summary = _get_empty_summary()
+    now = timezone.now()
+
+    existing_tables = {}
+    removed_table_ids = []
+    for table in ApplicationTable.objects.filter(application=application).order_by(
+        "created_at"
+    ):
+        if table.name in existing_tables:
+            removed_table_ids.append(table.id)
+        else:
+            existing_tables[table.name] = table
+
+    existing_columns: dict = {}
+    removed_column_ids = []
+    for column in ApplicationTableColumn.objects.filter(
+        table__application=application
+    ).order_by("created_at"):
+        table_columns = existing_columns.setdefault(column.table_id, {})
+        if column.name in table_columns:
+            removed_column_ids.append(column.id)
+        else:
+            table_columns[column.name] = column
+
+    new_tables, altered_tables = [], []
+    new_columns, altered_columns = [], []
+    for table_data in tables:
+        table_name = table_data["table_name"]
+        table = existing_tables.pop(table_name, None)
+        table_columns = {}
+        is_new = table is None
+        table_changed = False
+        checksum = checksums.get(table_name) if checksums is not None else None
+        foreign_keys = table_data.get("foreign_keys", [])
+        if is_new:
+            table = ApplicationTable(
+                application=application,
+                name=table_name,
+                comment=table_data["comment"],
+                ai_comment=table_data["comment"],
+                checksum=checksum,
+                foreign_keys=foreign_keys,
+            )
+            new_tables.append(table)
+            summary["added_tables"].append(table_name)
+        else:
+            table_columns = existing_columns.get(table.id, {})
+            if table.comment != table_data["comment"]:
+                table.comment = table_data["comment"]
+                table_changed = True
+            if table.foreign_keys != foreign_keys:
+                table.foreign_keys = foreign_keys
+                table_changed = True
+            if table_changed or (checksum and table.checksum != checksum):
+                table.checksum = checksum or table.checksum
+                table.updated_at = now
+                altered_tables.append(table)
+
+        for column_data in table_data.get("columns", []):
+            column_name = column_data["name"]
+            values = {field: column_data.get(field) for field in COLUMN_FIELDS}
+            column = table_columns.pop(column_name, None)
+            if column is None:
+                new_columns.append(
+                    ApplicationTableColumn(
+                        table=table,
+                        name=column_name,
+                        ai_comment=column_data.get("comment"),
+                        **values,
+                    )
+                )
+                summary["added_columns"].append(f"{table_name}.{column_name}")
+                table_changed = True
+            elif any(getattr(column, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(column, field, value)
+                column.updated_at = now
+                altered_columns.append(column)
+                summary["altered_columns"].append(f"{table_name}.{column_name}")
+                table_changed = True
+
+        # Columns left over are no longer in the database
+        for column_name, column in table_columns.items():
+            removed_column_ids.append(column.id)
+            summary["removed_columns"].append(f"{table_name}.{column_name}")
+            table_changed = True
+
+        if table_changed and not is_new:
+            summary["altered_tables"].append(table_name)
+
+    # Tables left over are no longer in the database, their columns cascade
+    for table_name, table in existing_tables.items():
+        if checksums is not None and table_name in checksums:
+            continue
+        removed_table_ids.append(table.id)
+        summary["removed_tables"].append(table_name)
+
+    if not any(summary.values()) and not (
+        altered_tables or removed_column_ids or removed_table_ids
+    ):
+        return summary
+
+    # The schema version is bumped after commit, so no worker caches the old schema under the new version
+    with batch_schema_version_bump(application.id), transaction.atomic():
+        ApplicationTable.objects.bulk_create(new_tables, batch_size=BULK_BATCH_SIZE)
+        ApplicationTable.objects.bulk_update(
+            altered_tables,
+            ["comment", "checksum", "foreign_keys", "updated_at"],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        ApplicationTableColumn.objects.bulk_create(
+            new_columns, batch_size=BULK_BATCH_SIZE
+        )
+        ApplicationTableColumn.objects.bulk_update(
+            altered_columns,
+            [*COLUMN_FIELDS, "updated_at"],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        if removed_column_ids:
+            ApplicationTableColumn.objects.filter(id__in=removed_column_ids).delete()
+        if removed_table_ids:
+            ApplicationTable.objects.filter(id__in=removed_table_ids).delete()
+    return summary
+
+
+def get_schema_changes(application, checksums: dict) -> dict:
+    """
+    Compare database table checksums with the checksums recorded by the last sync
+    :param application: Application
+    :param checksums: From DatabaseExecutor.get_table_checksums
+    :return: Names of added, altered and removed tables
+    """
+    stored = dict(
+        ApplicationTable.objects.filter(application=application).values_list(
+            "name", "checksum"
+        )
+    )
+    return {
+        "added_tables": [name for name in checksums if name not in stored],
+        "altered_tables": [
+            name
+            for name, checksum in checksums.items()
+            if name in stored and stored[name] != checksum
+        ],
+        "removed_tables": [name for name in stored if name not in checksums],
+    }
+
+
+def refresh_application_tables(application, full: bool = False) -> dict:
+    """
+    Sync the tables of an application with its database, introspecting only tables
+    whose checksum changed since the last sync
+    :param application: Application
+    :param full: Introspect and diff every table
+    :return: Change summary of sync_application_tables
+    """
+    database_executor = DatabaseExecutor(
+        application.database_configuration, application_id=application.id
+    )
+    checksums = database_executor.get_table_checksums()
+    if full:
+        table_names = None
+    else:
+        changes = get_schema_changes(application, checksums)
+        if not any(changes.values()):
+            return _get_empty_summary()
+        table_names = changes["added_tables"] + changes["altered_tables"]
+    tables = database_executor.create_tables(table_names=table_names)
+    return sync_application_tables(application, tables, checksums=checksums)
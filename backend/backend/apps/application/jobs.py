@@ -0,0 +1,344 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from backend.settings.env import ENV
+from backend.utils.jobs import Job, JobError
+from backend.utils.llm import (
+    bump_schema_version,
+    create_application_schema,
+    get_llm_tokens,
+)
+
+from .core import embedding
+from .core.agents.column_comment_agent import Agent
+from .core.agents.question_builder_agent import Agent as QuestionBuilderAgent
+from .core.schema_sync import refresh_application_tables
+from .models import (
+    Application,
+    ApplicationDatabaseDocument,
+    ApplicationPrompt,
+    ApplicationTable,
+    ApplicationTableColumn,
+    FineTuningModel,
+)
+from .serializers import ApplicationDatabaseDocumentSerializer, ApplicationTableSerializer
+from .utils import execute_remote_command
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AI_COMMENT_CONCURRENCY = 4
+# Finished tables saved per bulk update
+AI_COMMENT_SAVE_BATCH_SIZE = 20
+
+
+def create_database_tables(job: Job, application_id, full: bool = False) -> dict:
+    application = Application.objects.get(id=application_id)
+    job.set_progress(0, message="Syncing database tables")
+    summary = refresh_application_tables(application, full=full)
+    application_tables = ApplicationTable.objects.filter(application=application)
+    return {
+        "tables": ApplicationTableSerializer(application_tables, many=True).data,
+        "summary": summary,
+    }
+
+
+def _get_table_schema_str(table: ApplicationTable, columns) -> str:
+    table_dict = {
+        "table": table.name,
+        "comment": table.comment,
+        "columns": [],
+    }
+    for column in columns:
+        table_dict["columns"].append(
+            {
+                "name": column.name,
+                "key": column.key,
+                "type": column.type,
+                "default": column.default,
+                "comment": column.comment,
+                "nullable": column.nullable,
+            }
+        )
+    return json.dumps(table_dict)
+
+
+def _get_column_comment_prompt(application: Application) -> str | None:
+    prompts = ApplicationPrompt.objects.filter(application=application).first()
+    return prompts.column_comment_prompt if prompts else None
+
+
+def get_ai_comment(job: Job, table_id) -> dict:
+    table = ApplicationTable.objects.select_related("application").get(id=table_id)
+    app_description = table.application.description
+    tables = [
+        item.name
+        for item in table.application.tables.filter(is_deleted=False, is_enabled=True)
+    ]
+    table_str = _get_table_schema_str(table, table.columns.all())
+    job.set_progress(0, 1, f"Generating AI comment of {table.name}")
+    agent = Agent()
+    _prompt = table.application.prompts.column_comment_prompt
+    _result = agent.run(table_str, app_description, tables, _prompt)
+    if not _result:
+        raise JobError("Failed to generate AI comment")
+    return json.loads(_result)
+
+
+def _parse_ai_comment(result: str, table_name: str) -> dict:
+    data = json.loads(result)
+    # The prompt example is a list of tables, the model sometimes answers with a list
+    if isinstance(data, list):
+        data = next(
+            (item for item in data if item.get("table") == table_name),
+            data[0] if data else {},
+        )
+    return data
+
+
+def generate_ai_comments(
+    job: Job,
+    application_id,
+    only_uncommented: bool = True,
+    auto_replace: bool = True,
+) -> dict:
+    """
+    Generate AI comments of all enabled tables of an application with concurrent LLM requests.
+    Comments are saved as tables finish, so an interrupted run resumes with the remaining
+    tables when run again with only_uncommented.
+    :param only_uncommented: Skip tables whose table and columns all have an AI comment,
+        unless the table definition changed since the comments were generated
+    :param auto_replace: Also replace the final AI comments, not only the generated ones
+    :return: Number of generated, skipped and failed tables
+    """
+    application = Application.objects.get(id=application_id)
+    prompt = _get_column_comment_prompt(application)
+    tables = list(
+        application.tables.filter(is_deleted=False, is_enabled=True).prefetch_related(
+            Prefetch("columns", queryset=ApplicationTableColumn.objects.order_by("created_at"))
+        )
+    )
+    table_names = [table.name for table in tables]
+    targets = [
+        table
+        for table in tables
+        if not only_uncommented
+        or not table.original_ai_comment
+        or any(not column.original_ai_comment for column in table.columns.all())
+        or (table.checksum and table.ai_comment_checksum != table.checksum)
+    ]
+    max_workers = int(
+        (application.agent_configuration or {}).get("ai_comment_concurrency")
+        or ENV.AI_COMMENT_CONCURRENCY
+        or DEFAULT_AI_COMMENT_CONCURRENCY
+    )
+
+    def generate(table: ApplicationTable) -> dict:
+        table_str = _get_table_schema_str(table, table.columns.all())
+        result = Agent().run(table_str, application.description, table_names, prompt)
+        return _parse_ai_comment(result, table.name)
+
+    comment_fields = ["original_ai_comment", "updated_at"]
+    if auto_replace:
+        comment_fields.insert(0, "ai_comment")
+    table_fields = [*comment_fields, "ai_comment_checksum"]
+
+    def save(finished: list[tuple]):
+        now = timezone.now()
+        updated_tables, updated_columns = [], []
+        for table, data in finished:
+            # An empty generated comment keeps the previous one
+            comment = data.get("comment")
+            if comment:
+                table.original_ai_comment = comment
+                if auto_replace:
+                    table.ai_comment = comment
+            table.ai_comment_checksum = table.checksum
+            table.updated_at = now
+            updated_tables.append(table)
+            column_comments = {
+                item.get("name"): item.get("comment")
+                for item in data.get("columns") or []
+                if item.get("comment")
+            }
+            for column in table.columns.all():
+                if column.name not in column_comments:
+                    continue
+                column.original_ai_comment = column_comments[column.name]
+                if auto_replace:
+                    column.ai_comment = column_comments[column.name]
+                column.updated_at = now
+                updated_columns.append(column)
+        with transaction.atomic():
+            ApplicationTable.objects.bulk_update(updated_tables, table_fields)
+            ApplicationTableColumn.objects.bulk_update(
+                updated_columns, comment_fields, batch_size=500
+            )
+        bump_schema_version(application.id)
+
+    failed, finished, generated = [], [], 0
+    job.set_progress(0, len(targets), "Generating AI comments")
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(generate, table): table for table in targets}
+        for index, future in enumerate(as_completed(futures), 1):
+            table = futures[future]
+            try:
+                finished.append((table, future.result()))
+            except Exception as e:
+                logger.warning("Failed to generate AI comment of %s: %s", table.name, e)
+                failed.append(table.name)
+            if len(finished) >= AI_COMMENT_SAVE_BATCH_SIZE:
+                save(finished)
+                generated += len(finished)
+                finished = []
+            job.set_progress(index, len(targets), f"Generated AI comment of {table.name}")
+    finally:
+        # Keep what finished before a failure or cancellation
+        executor.shutdown(wait=False, cancel_futures=True)
+        if finished:
+            save(finished)
+            generated += len(finished)
+    return {
+        "generated": generated,
+        "skipped": len(tables) - len(targets),
+        "failed": failed,
+    }
+
+
+def _get_document_name(app_code: str, table_name: str) -> str:
+    return f"{app_code}_db_doc_{table_name}.txt"
+
+
+def create_embed(job: Job, application_id, app_code: str) -> list:
+    """
+    Upload the schema documents of an application to the embedding service and embed them.
+    Only documents whose content changed since the last upload are uploaded, concurrently.
+    Documents of removed tables are only dropped from the local records, the embedding
+    service has no API to delete them.
+    :return: All documents of the application
+    """
+    schema, _ = create_application_schema(application_id)
+    existing = {
+        document.document_name: document
+        for document in ApplicationDatabaseDocument.objects.filter(
+            application_id=application_id
+        )
+    }
+    contents = {}
+    for item in schema:
+        text = json.dumps(item, separators=(",", ":"), ensure_ascii=False)
+        contents[_get_document_name(app_code, item.get("table"))] = text
+    changed = {}
+    for name, text in contents.items():
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        document = existing.get(name)
+        if document is None or document.content_hash != content_hash:
+            changed[name] = (text, content_hash)
+    removed_ids = [
+        document.id for name, document in existing.items() if name not in contents
+    ]
+    if removed_ids:
+        ApplicationDatabaseDocument.objects.filter(id__in=removed_ids).delete()
+    if not changed:
+        job.set_progress(1, 1, "Embedding is up to date")
+        return ApplicationDatabaseDocumentSerializer(
+            [document for name, document in existing.items() if name in contents],
+            many=True,
+        ).data
+
+    total = len(changed) + 1
+    finished = 0
+    document_instances = []
+    job.set_progress(0, total, "Uploading documents")
+    executor = ThreadPoolExecutor(max_workers=embedding.get_embedding_upload_concurrency())
+    try:
+        futures = {
+            executor.submit(embedding.upload_document, app_code, name, text): name
+            for name, (text, _) in changed.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                res_data = future.result()
+            except embedding.EmbeddingServiceError as e:
+                raise JobError(f"Failed to create embedding: {e}") from e
+            text, content_hash = changed[name]
+            document_instances.append(
+                ApplicationDatabaseDocument(
+                    application_id=application_id,
+                    document_name=res_data.get("file_name") or name,
+                    document_path=res_data.get("file_path"),
+                    content_type=res_data.get("content_type"),
+                    document_size=res_data.get("file_size"),
+                    character_count=len(text),
+                    token_count=get_llm_tokens(text),
+                    content_hash=content_hash,
+                )
+            )
+            finished += 1
+            job.set_progress(finished, total, f"Uploaded {name}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    job.set_progress(finished, total, "Creating embedding")
+    try:
+        embedding.create_embed(app_code)
+    except embedding.EmbeddingServiceError as e:
+        raise JobError(f"Failed to create embedding: {e}") from e
+    # Documents are only recorded once embedded, so a failed run uploads them again
+    replaced_ids = [
+        document.id for name, document in existing.items() if name in changed
+    ]
+    with transaction.atomic():
+        ApplicationDatabaseDocument.objects.filter(id__in=replaced_ids).delete()
+        ApplicationDatabaseDocument.objects.bulk_create(document_instances)
+    documents = ApplicationDatabaseDocument.objects.filter(
+        application_id=application_id
+    ).order_by("document_name")
+    return ApplicationDatabaseDocumentSerializer(documents, many=True).data
+
+
+def create_questions(job: Job, application_id, question_count: int = 10):
+    job.set_progress(0, message="Generating questions")
+    agent = QuestionBuilderAgent(application_id)
+    _result = agent.run(question_count=question_count)
+    if not _result:
+        raise JobError("Failed to generate questions")
+    return json.loads(_result)
+
+
+def _execute_fine_tune_server_command(command: str) -> int:
+    return execute_remote_command(
+        host=str(ENV.FINE_TUNE_SERVER_HOST or ""),
+        username=str(ENV.FINE_TUNE_SERVER_USERNAME or ""),
+        password=str(ENV.FINE_TUNE_SERVER_PASSWORD or ""),
+        command=command,
+    )
+
+
+def convert_model(job: Job, command: str):
+    job.set_progress(0, message="Converting model")
+    if _execute_fine_tune_server_command(command) != 0:
+        raise JobError("Failed to convert model")
+
+
+def deployment_model(job: Job, application_id, model_name: str, command: str):
+    job.set_progress(0, message="Deploying model")
+    if _execute_fine_tune_server_command(command) != 0:
+        raise JobError("Failed to deploy model")
+
+    _application = Application.objects.get(id=application_id)
+
+    model_name = model_name if ":" in model_name else f"{model_name}:latest"
+
+    FineTuningModel.objects.create(
+        application=_application,
+        model_name=model_name,
+        description=f"The Ollama model of {_application.name}",
+    )
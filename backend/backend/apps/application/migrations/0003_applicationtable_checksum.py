@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationtable',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Checksum'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0003_applicationtable_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationdatabasedocument',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Content hash'),
+        ),
+    ]
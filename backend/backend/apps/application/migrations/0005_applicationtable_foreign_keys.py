@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0004_applicationdatabasedocument_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationtable',
+            name='foreign_keys',
+            field=models.JSONField(blank=True, default=list, verbose_name='Foreign keys'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 21:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0005_applicationtable_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationtable',
+            name='ai_comment_checksum',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='AI comment checksum'),
+        ),
+    ]
@@ -14,6 +14,7 @@ class SystemConfiguration(models.Model):
 class RAGMethod(models.TextChoices):
     EMBEDDING = "embedding", "Embedding"
     LLM = "llm", "LLM"
+    HYBRID = "hybrid", "Hybrid"
 
 
 def _get_default_agent_configuration():
@@ -29,7 +30,7 @@ class Application(AbstractApplication, BaseModel):
     database_configuration = models.JSONField(
         "Database Configuration", help_text="Database configuration information for app"
     )
-    # rag_method: embedding/llm,if not set, use llm
+    # rag_method: embedding/llm/hybrid,if not set, use llm
     agent_configuration = models.JSONField(
         "Agent Configuration",
         default=_get_default_agent_configuration,
@@ -50,6 +51,14 @@ class ApplicationTable(BaseModel):
         "Original AI comment", max_length=1024, blank=True, null=True
     )
     ai_comment = models.CharField("AI comment", max_length=1024, blank=True, null=True)
+    # Checksum of the table definition in the database when it was last synced
+    checksum = models.CharField("Checksum", max_length=64, blank=True, null=True)
+    # Checksum of the table definition the AI comments were generated for
+    ai_comment_checksum = models.CharField(
+        "AI comment checksum", max_length=64, blank=True, null=True
+    )
+    # Foreign keys of the table in the database, [{name, column, referenced_table, referenced_column}]
+    foreign_keys = models.JSONField("Foreign keys", default=list, blank=True)
 
     def __str__(self):
         return f"{self.name}"
@@ -113,6 +122,8 @@ class ApplicationDatabaseDocument(BaseModel):
     character_count = models.IntegerField(
         "Document character count", blank=True, null=True
     )
+    # SHA-256 of the uploaded content, unchanged documents are not uploaded again
+    content_hash = models.CharField("Content hash", max_length=64, blank=True, null=True)
 
 
 class FineTuningExample(BaseModel):
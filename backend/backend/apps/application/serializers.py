@@ -24,6 +24,7 @@ class ApplicationTableSerializer(BaseSerializer):
     class Meta:
         model = ApplicationTable
         fields = "__all__"
+        read_only_fields = ("checksum", "ai_comment_checksum", "foreign_keys")
 
 
 class ApplicationTableColumnSerializer(BaseSerializer):
@@ -45,6 +46,7 @@ class ApplicationDatabaseDocumentSerializer(BaseSerializer):
     class Meta:
         model = ApplicationDatabaseDocument
         fields = "__all__"
+        read_only_fields = ("content_hash",)
 
 
 class FineTuningExampleSerializer(BaseSerializer):
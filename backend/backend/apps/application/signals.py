@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.apps.chat.core.example_index import bump_examples_version
+from backend.apps.chat.core.sql_cache import bump_sql_cache_version
+from backend.utils.llm import bump_schema_version, is_schema_version_bump_batched
+
+from .core.database import engine_registry
+from .models import (
+    Application,
+    ApplicationPrompt,
+    ApplicationTable,
+    ApplicationTableColumn,
+    FineTuningExample,
+    FineTuningModel,
+)
+
+
+@receiver(post_save, sender=Application)
+def evict_application_engine_on_save(sender, instance: Application, **kwargs):
+    """
+    Dispose the pooled engine when the database configuration changes or the application is soft deleted
+    """
+    if instance.is_deleted:
+        engine_registry.evict(instance.id)
+        return
+    engine_registry.evict(instance.id, instance.database_configuration)
+
+
+@receiver(post_delete, sender=Application)
+def evict_application_engine_on_delete(sender, instance: Application, **kwargs):
+    engine_registry.evict(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ApplicationTable)
+def bump_schema_version_on_table_change(sender, instance: ApplicationTable, **kwargs):
+    bump_schema_version(instance.application_id)
+
+
+@receiver([post_save, post_delete], sender=ApplicationTableColumn)
+def bump_schema_version_on_column_change(
+    sender, instance: ApplicationTableColumn, **kwargs
+):
+    # Batched changes bump their applications once, skip the table lookup per column
+    if is_schema_version_bump_batched():
+        return
+    if ApplicationTableColumn.table.is_cached(instance):
+        application_id = instance.table.application_id
+    else:
+        application_id = (
+            ApplicationTable.objects.filter(id=instance.table_id)
+            .values_list("application_id", flat=True)
+            .first()
+        )
+    if application_id:
+        bump_schema_version(application_id)
+
+
+@receiver([post_save, post_delete], sender=ApplicationPrompt)
+@receiver([post_save, post_delete], sender=FineTuningModel)
+def bump_sql_cache_version_on_change(sender, instance, **kwargs):
+    bump_sql_cache_version(instance.application_id)
+
+
+@receiver([post_save, post_delete], sender=FineTuningExample)
+def bump_examples_version_on_change(sender, instance: FineTuningExample, **kwargs):
+    bump_examples_version(instance.application_id)
@@ -2,11 +2,15 @@ import logging
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from django.conf import settings
 from django_apscheduler import util
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 
+from backend.settings.env import ENV
+
+from .core.schema_sync import refresh_application_tables
 from .models import Application
 
 logger = logging.getLogger(__name__)
@@ -23,6 +27,26 @@ def fine_tuning_job():
         pass
 
 
+@util.close_old_connections
+def schema_probe_job():
+    """
+    Sync the tables of every application whose database schema changed
+    :return:
+    """
+    # Applications whose tables were never synced are left to the user
+    applications = Application.objects.filter(
+        is_deleted=False, is_enabled=True, tables__isnull=False
+    ).distinct()
+    for application in applications:
+        try:
+            summary = refresh_application_tables(application)
+        except Exception as e:
+            logger.warning("Schema probe failed for application %s: %s", application.id, e)
+            continue
+        if any(summary.values()):
+            logger.info("Synced schema of application %s: %s", application.id, summary)
+
+
 @util.close_old_connections
 def delete_old_job_executions(max_age=30 * 24 * 60 * 60):
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
@@ -47,6 +71,14 @@ def run_scheduler():
         replace_existing=True,
     )
     logger.info("Added job 'run_fine_tuning_job'.")
+    scheduler.add_job(
+        schema_probe_job,
+        trigger=IntervalTrigger(minutes=int(ENV.SCHEMA_PROBE_INTERVAL_MINUTES or 5)),
+        id="schema_probe_job",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'schema_probe_job'.")
     scheduler.add_job(
         delete_old_job_executions,
         trigger=CronTrigger(
@@ -1,9 +1,8 @@
 import csv
-import io
 import json
 from datetime import datetime
 
-import requests
+from asgiref.sync import async_to_sync
 from django.db import transaction
 from django.http import HttpResponse
 from rest_framework import status
@@ -13,6 +12,7 @@ from rest_framework.response import Response
 
 from backend.apps.chat.core.agents.database_query_agent import (
     DatabaseQueryAgent,
+    EQueryErrorType,
 )
 from backend.apps.chat.core.agents.sql_generator_agent import (
     SQLGeneratorAgent,
@@ -21,13 +21,18 @@ from backend.apps.chat.core.prompts import (
     question_prompt,
     sql_generator_prompt,
 )
+from backend.apps.chat.core.sql_validator import is_select
 from backend.settings.env import ENV
-from backend.utils.llm import create_application_schema, get_llm_tokens
+from backend.utils.llm import (
+    bump_schema_version,
+    create_application_ddl,
+    create_application_schema,
+)
+from backend.utils.jobs import job_queue
 from backend.utils.viewset import BaseUndeletedModelViewSet
 
-from .core.agents.column_comment_agent import Agent
-from .core.agents.question_builder_agent import Agent as QuestionBuilderAgent
-from .core.database import DatabaseExecutor
+from . import jobs
+from .core import embedding
 from .core.prompts import (
     column_comment_prompt,
     question_builder_prompt,
@@ -63,7 +68,7 @@ from .serializers import (
     FineTuningExampleSerializer,
     FineTuningModelSerializer,
 )
-from .utils import execute_remote_command, json_list_to_ddl, stream_command_output
+from .utils import stream_command_output
 
 
 class ApplicationViewSet(BaseUndeletedModelViewSet):
@@ -80,100 +85,36 @@ class ApplicationViewSet(BaseUndeletedModelViewSet):
     @action(methods=["post"], detail=True)
     def create_database_tables(self, request, pk=None):
         application = self.get_object()
-        database_executor = DatabaseExecutor(application.database_configuration)
-        tables = database_executor.create_tables()
-
-        existing_tables = {
-            table.name: table
-            for table in ApplicationTable.objects.filter(application=application)
-        }
-        existing_columns = {
-            table.id: {
-                col.name: col
-                for col in ApplicationTableColumn.objects.filter(table=table)
-            }
-            for table in existing_tables.values()
-        }
-
-        def update_or_create_table(table_data, existing_table=None):
-            """
-            Update or create an ApplicationTable object.
-            """
-            ai_comment = (
-                existing_table.ai_comment
-                if existing_table
-                else table_data.get("comment")
-            )
-            defaults = {"comment": table_data["comment"], "ai_comment": ai_comment}
-            return ApplicationTable.objects.update_or_create(
-                application=application,
-                name=table_data["table_name"],
-                defaults=defaults,
-            )[0]
-
-        def update_or_create_columns(table, table_data):
-            """
-            Update or create ApplicationTableColumn objects for a table.
-            """
-            table_cols = existing_columns.get(table.id, {})
-            column_names = set()
-
-            for column in table_data.get("columns", []):
-                column_instance = table_cols.get(column["name"])
-                column["ai_comment"] = (
-                    column_instance.ai_comment
-                    if column_instance
-                    else column.get("comment")
-                )
-                defaults = {
-                    "key": column["key"],
-                    "type": column["type"],
-                    "default": column["default"],
-                    "comment": column["comment"],
-                    "ai_comment": column["ai_comment"],
-                    "nullable": column["nullable"],
-                }
-
-                ApplicationTableColumn.objects.update_or_create(
-                    table=table, name=column["name"], defaults=defaults
-                )
-                column_names.add(column["name"])
-
-            # Delete columns that are not in the new column list
-            ApplicationTableColumn.objects.filter(table=table).exclude(
-                name__in=column_names
-            ).delete()
-
-        def cleanup_removed_tables(new_table_names):
-            """
-            Cleanup ApplicationTable objects that are no longer present in the new table list.
-            """
-            current_table_names = set(existing_tables.keys())
-            for table_name in current_table_names - new_table_names:
-                existing_tables[table_name].delete()
-
-        with transaction.atomic():
-            # Update or create tables and columns
-            for table_data in tables:
-                existing_table = existing_tables.get(table_data["table_name"])
-                table = update_or_create_table(table_data, existing_table)
-                update_or_create_columns(table, table_data)
-
-            # Delete tables that are not in the new table list
-            new_table_names = {table["table_name"] for table in tables}
-            cleanup_removed_tables(new_table_names)
+        # Full sync also overwrites local edits of tables whose definition didn't change
+        job_id = job_queue.submit(
+            "create_database_tables",
+            jobs.create_database_tables,
+            application.id,
+            full=bool(request.data.get("full")),
+        )
+        return Response({"job_id": job_id})
 
-        application_tables = ApplicationTable.objects.filter(application=application)
-        response_data = ApplicationTableSerializer(application_tables, many=True).data
-        return Response(response_data)
+    @action(methods=["post"], detail=True)
+    def generate_ai_comments(self, request, pk=None):
+        application = self.get_object()
+        # Tables that already have AI comments are skipped unless all are requested,
+        # so a failed or cancelled run can be resumed
+        job_id = job_queue.submit(
+            "generate_ai_comments",
+            jobs.generate_ai_comments,
+            application.id,
+            only_uncommented=not request.data.get("all"),
+            auto_replace=bool(request.data.get("auto_replace", True)),
+        )
+        return Response({"job_id": job_id})
 
     @action(methods=["get"], detail=True)
     def export_database_schema(self, request, pk=None):
         export_type = request.GET.get("type")
-        schema, _ = create_application_schema(application_id=pk)
         if export_type == "ddl":
-            ddl_list, _ = json_list_to_ddl(schema)
+            ddl_list, _ = create_application_ddl(application_id=pk)
             return Response(ddl_list)
+        schema, _ = create_application_schema(application_id=pk)
         return Response(schema)
 
     @action(methods=["put"], detail=True)
@@ -206,36 +147,8 @@ class ApplicationTableViewSet(BaseUndeletedModelViewSet):
     @action(methods=["get"], detail=True)
     def get_ai_comment(self, request, pk=None):
         table: ApplicationTable = self.get_object()
-        app_description = table.application.description
-        tables = [
-            item.name
-            for item in table.application.tables.filter(
-                is_deleted=False, is_enabled=True
-            )
-        ]
-        table_dict = {
-            "table": table.name,
-            "comment": table.comment,
-            "columns": [],
-        }
-        for column in table.columns.all():
-            table_dict["columns"].append(
-                {
-                    "name": column.name,
-                    "key": column.key,
-                    "type": column.type,
-                    "default": column.default,
-                    "comment": column.comment,
-                    "nullable": column.nullable,
-                }
-            )
-        table_str = json.dumps(table_dict)
-        agent = Agent()
-        _prompt = table.application.prompts.column_comment_prompt
-        _result = agent.run(table_str, app_description, tables, _prompt)
-        if _result:
-            return Response(json.loads(_result))
-        return Response({"code": 1, "msg": "Failed to generate AI comment"})
+        job_id = job_queue.submit("get_ai_comment", jobs.get_ai_comment, table.id)
+        return Response({"job_id": job_id})
 
 
 class ApplicationTableColumnViewSet(BaseUndeletedModelViewSet):
@@ -267,6 +180,12 @@ class ApplicationTableColumnViewSet(BaseUndeletedModelViewSet):
             ApplicationTableColumn.objects.bulk_update(
                 column_instance_list, ["ai_comment", "original_ai_comment"]
             )
+        for application_id in (
+            ApplicationTable.objects.filter(columns__in=column_instance_list)
+            .values_list("application_id", flat=True)
+            .distinct()
+        ):
+            bump_schema_version(application_id)
         return Response()
 
 
@@ -388,58 +307,10 @@ class ApplicationDatabaseDocumentViewSet(BaseUndeletedModelViewSet):
         app_code = self._get_app_code(application_id)
         if not app_code:
             return Response({"code": 1, "msg": "Application not found"})
-        schema, _ = create_application_schema(application_id)
-        document_instances = []
-        documents = []
-        request_payload = {"app_code": app_code}
-        for item in schema:
-            file_buffer = io.StringIO()
-            text = json.dumps(
-                item,
-                separators=(",", ":"),
-                ensure_ascii=False,
-            )
-            file_buffer.write(text)
-            file_buffer.seek(0)
-            try:
-                url = f"{ENV.EMBEDDING_SERVICE_ENDPOINT}/upload"
-                filename = f"{app_code}_db_doc_{item.get('table')}.txt"
-                files = {"file": (filename, file_buffer, "text/plain")}
-                response = requests.post(url, files=files, data=request_payload)
-                if response.status_code == 200:
-                    res_data = response.json().get("data")
-                    document = {
-                        "application_id": application_id,
-                        "document_name": res_data.get("file_name"),
-                        "document_path": res_data.get("file_path"),
-                        "content_type": res_data.get("content_type"),
-                        "document_size": res_data.get("file_size"),
-                        "character_count": len(text),
-                        "token_count": get_llm_tokens(text),
-                    }
-                    documents.append(document)
-                    document_instances.append(ApplicationDatabaseDocument(**document))
-                else:
-                    return Response({"code": 1, "msg": "Failed to create embedding"})
-            except Exception as e:
-                return Response({"code": 1, "msg": str(e)})
-            finally:
-                file_buffer.close()
-        try:
-            url = f"{ENV.EMBEDDING_SERVICE_ENDPOINT}/create_embed"
-            response = requests.post(url, json=request_payload)
-            if response.status_code != 200:
-                return Response({"code": 1, "msg": "Failed to create embedding"})
-        except Exception as e:
-            return Response({"code": 1, "msg": str(e)})
-        with transaction.atomic():
-            ApplicationDatabaseDocument.objects.filter(
-                application_id=application_id
-            ).delete()
-            ApplicationDatabaseDocument.objects.bulk_create(document_instances)
-        return Response(
-            ApplicationDatabaseDocumentSerializer(document_instances, many=True).data
+        job_id = job_queue.submit(
+            "create_embed", jobs.create_embed, application_id, app_code
         )
+        return Response({"job_id": job_id})
 
     @action(methods=["post"], detail=False)
     def retrieval_embed(self, request):
@@ -453,15 +324,10 @@ class ApplicationDatabaseDocumentViewSet(BaseUndeletedModelViewSet):
         app_code = self._get_app_code(application_id)
         if not app_code:
             return Response({"code": 1, "msg": "Application not found"})
-        url = f"{ENV.EMBEDDING_SERVICE_ENDPOINT}/retrieval_embed"
-        request_payload = {
-            "app_code": self._get_app_code(application_id),
-            "question": question,
-        }
-        response = requests.post(url, json=request_payload)
-        if response.status_code != 200:
+        try:
+            res_data = embedding.retrieval_embed(app_code, question)
+        except embedding.EmbeddingServiceError:
             return Response({"code": 1, "msg": "Failed to create embedding"})
-        res_data = response.json().get("data")
         return Response(res_data)
 
 
@@ -486,11 +352,10 @@ class FineTuningExampleViewSet(BaseUndeletedModelViewSet):
     def create_questions(self, request):
         application_id = request.data.get("application_id")
         question_count = request.data.get("question_count", 10)
-        agent = QuestionBuilderAgent(application_id)
-        _result = agent.run(question_count=question_count)
-        if _result:
-            return Response(json.loads(_result))
-        return Response({"code": 1, "msg": "Failed to generate questions"})
+        job_id = job_queue.submit(
+            "create_questions", jobs.create_questions, application_id, question_count
+        )
+        return Response({"job_id": job_id})
 
     @action(methods=["post"], detail=False)
     def create_sql(self, request):
@@ -498,18 +363,37 @@ class FineTuningExampleViewSet(BaseUndeletedModelViewSet):
         application = Application.objects.get(id=application_id)
         question = request.data.get("question")
         sql_generator_agent = SQLGeneratorAgent(application=application)
-        return Response({"sql": sql_generator_agent.run(question)})
+        return Response({"sql": async_to_sync(sql_generator_agent.run)(question)})
 
     @action(methods=["post"], detail=False)
     def execute_sql(self, request):
         application_id = request.data.get("application_id")
         question = request.data.get("question")
         sql = request.data.get("sql")
-        database_configuration = Application.objects.get(
-            id=application_id
-        ).database_configuration
+        if not is_select(sql):
+            error_msg = "Only a single SELECT statement may be executed"
+            return Response(
+                {
+                    "result": [],
+                    "result_info": None,
+                    "error": [error_msg],
+                    "errors": [
+                        {
+                            "sql": sql,
+                            "error_type": EQueryErrorType.VALIDATION.value,
+                            "message": error_msg,
+                        }
+                    ],
+                    "duration": 0,
+                }
+            )
+        application = Application.objects.get(id=application_id)
         start_time = datetime.now()
-        agent = DatabaseQueryAgent(database_configuration=database_configuration)
+        agent = DatabaseQueryAgent(
+            database_configuration=application.database_configuration,
+            application_id=application_id,
+            query_timeout=(application.agent_configuration or {}).get("query_timeout"),
+        )
         end_time = datetime.now()
         time_difference = end_time - start_time
         query_result, _, error_msgs = agent.run(question, [sql])
@@ -517,7 +401,9 @@ class FineTuningExampleViewSet(BaseUndeletedModelViewSet):
         return Response(
             {
                 "result": json.loads(query_result or "[]"),
+                "result_info": agent.result_info,
                 "error": error_msg,
+                "errors": agent.query_errors,
                 "duration": time_difference.total_seconds(),
             }
         )
@@ -621,21 +507,8 @@ def convert_model(request):
     ):
         return Response({"code": 1, "msg": "Missing required parameters"})
 
-    host = str(ENV.FINE_TUNE_SERVER_HOST or "")
-    username = str(ENV.FINE_TUNE_SERVER_USERNAME or "")
-    password = str(ENV.FINE_TUNE_SERVER_PASSWORD or "")
-
-    exit_status = execute_remote_command(
-        host=host,
-        username=username,
-        password=password,
-        command=command,
-    )
-
-    if exit_status != 0:
-        return Response({"code": 1, "msg": "Failed to convert model"})
-
-    return Response({"code": 0, "msg": "Success"})
+    job_id = job_queue.submit("convert_model", jobs.convert_model, command)
+    return Response({"job_id": job_id})
 
 
 @api_view(http_method_names=["POST"])
@@ -654,31 +527,14 @@ def deployment_model(request):
     ):
         return Response({"code": 1, "msg": "Missing required parameters"})
 
-    host = str(ENV.FINE_TUNE_SERVER_HOST or "")
-    username = str(ENV.FINE_TUNE_SERVER_USERNAME or "")
-    password = str(ENV.FINE_TUNE_SERVER_PASSWORD or "")
-
-    exit_status = execute_remote_command(
-        host=host,
-        username=username,
-        password=password,
-        command=command,
+    job_id = job_queue.submit(
+        "deployment_model",
+        jobs.deployment_model,
+        application_id,
+        model_name,
+        command,
     )
-
-    if exit_status != 0:
-        return Response({"code": 1, "msg": "Failed to deploy model"})
-
-    _application = Application.objects.get(id=application_id)
-
-    model_name = model_name if ":" in model_name else f"{model_name}:latest"
-
-    FineTuningModel.objects.create(
-        application=_application,
-        model_name=model_name,
-        description=f"The Ollama model of {_application.name}",
-    )
-
-    return Response({"code": 0, "msg": "Success"})
+    return Response({"job_id": job_id})
 
 
 class ApplicationSuggestedQuestionViewSet(BaseUndeletedModelViewSet):
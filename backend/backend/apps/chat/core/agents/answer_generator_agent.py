@@ -9,7 +9,7 @@ from backend.apps.chat.core.prompts.answer_generator_prompt import (
 )
 from backend.apps.chat.core.utils import validate_json_string
 from backend.settings.env import ENV
-from backend.utils.llm import ChatCompletionService, get_llm_tokens
+from backend.utils.llm import AsyncChatCompletionService, get_llm_tokens
 
 
 class AnswerGeneratorAgent:
@@ -25,29 +25,38 @@ class AnswerGeneratorAgent:
         self,
         user_question: str,
         query_result: str,
+        result_info: dict | None = None,
     ):
         model_name = ENV.ANSWER_GENERATOR_AGENT_MODEL
-        tokens = get_llm_tokens(query_result)
+        tokens = get_llm_tokens(query_result, approximate=True)
         query_result = json.loads(query_result)
         total_count = len(query_result)
         note = f"Note: Found {total_count} records in total."
+        if result_info and result_info.get("truncated"):
+            total_count = result_info.get("total_count_estimate") or total_count
+            note = f"Note: The query matched about {total_count} records in total, only the first {len(query_result)} records were fetched."
         if tokens > 32 * 1024:
             max_result_count = 0
             total_tokens = 0
             for row in query_result:
-                row_tokens = get_llm_tokens(json.dumps(row))
+                row_tokens = get_llm_tokens(
+                    json.dumps(row, ensure_ascii=False), approximate=True
+                )
                 if total_tokens + row_tokens > 32 * 1024:
                     break
                 total_tokens += row_tokens
                 max_result_count += 1
             query_result = query_result[:max_result_count]
-            note = f"Note: Found {total_count} records in total, only showing partial records due to context length limitations"
-        llm_messages = ChatCompletionService.set_llm_messages(
+            note = f"Note: Found {'about ' if result_info and result_info.get('truncated') else ''}{total_count} records in total, only showing partial records due to context length limitations"
+        time_window = ((result_info or {}).get("cost_guard") or {}).get("time_window")
+        if time_window:
+            note += f" The query was limited to the rows of table {time_window['table']} from the last {time_window['days']} days (by {time_window['column']}) to stay within the query cost limit, tell the user the answer only covers this period."
+        llm_messages = AsyncChatCompletionService.set_llm_messages(
             system_content=answer_generator_prompt,
             user_content=f"Question: {user_question}\nQuery results: `{query_result}`\n{note}",
         )
         tokens = get_llm_tokens(llm_messages)
-        for chunk in ChatCompletionService.create_stream_completion(
+        async for chunk in AsyncChatCompletionService.create_stream_completion(
             model=f"ollama:{model_name}",
             messages=llm_messages,
             options={
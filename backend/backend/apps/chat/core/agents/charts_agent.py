@@ -1,7 +1,7 @@
 from backend.apps.chat.core.prompts.charts_prompt import prompt as charts_prompt
 from backend.apps.chat.core.utils import validate_json_string
 from backend.settings.env import ENV
-from backend.utils.llm import ChatCompletionService, get_llm_tokens
+from backend.utils.llm import AsyncChatCompletionService, get_llm_tokens
 
 
 class ChartsAgent:
@@ -15,7 +15,7 @@ class ChartsAgent:
         self.echarts_maximum_execution_count: int = 3
         self.echarts_current_execution_count: int = 1
 
-    def run(
+    async def run(
         self,
         user_question: str,
         query_result: str,
@@ -25,12 +25,12 @@ class ChartsAgent:
             return ""
         self.user_question = user_question
         self.query_result = query_result
-        llm_messages = ChatCompletionService.set_llm_messages(
+        llm_messages = AsyncChatCompletionService.set_llm_messages(
             system_content=_charts_prompt,
             user_content=f"User Question: {self.user_question}\nQuery Data: {self.query_result}",
         )
         tokens = get_llm_tokens(llm_messages)
-        result = ChatCompletionService.create_completion(
+        result = await AsyncChatCompletionService.create_completion(
             model=f"ollama:{ENV.CHARTS_AGENT_MODEL}",
             messages=llm_messages,
             options={
@@ -1,9 +1,130 @@
+import contextlib
+import datetime
+import decimal
 import json
-from urllib.parse import quote
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enum import Enum
 
-import pandas as pd
 import sqlalchemy
-from sqlalchemy.exc import SQLAlchemyError
+
+from backend.apps.application.core.database import engine_registry
+from backend.apps.chat.core.sql_rewriter import (
+    add_limit,
+    add_time_window,
+    get_table_aliases,
+    is_streamable,
+)
+from backend.apps.chat.core.sql_validator import get_sql_validator
+from backend.settings.env import ENV
+from backend.utils.llm import create_application_schema
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RESULT_COUNT = 1000
+DEFAULT_MAX_RESULT_BYTES = 4 * 1024 * 1024
+DEFAULT_QUERY_TIMEOUT = 30
+DEFAULT_MAX_EXAMINED_ROWS = 100_000_000
+# Rows read from the server per round trip
+FETCH_BATCH_SIZE = 500
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, set):
+        return sorted(value)
+    return str(value)
+
+
+class EQueryErrorType(Enum):
+    TIMEOUT = "timeout"
+    ERROR = "error"
+    VALIDATION = "validation"
+    COST = "cost"
+
+
+class ECostGuardAction(Enum):
+    # Try to bound an over-budget query, reject it if that fails
+    REWRITE = "rewrite"
+    REJECT = "reject"
+
+
+class QueryCostError(Exception):
+    """
+    The estimated cost of a query is over the budget of the application
+    """
+
+    def __init__(self, message: str, reason: dict):
+        super().__init__(message)
+        self.reason = reason
+
+
+def get_cost_guard(agent_configuration: dict | None) -> dict | None:
+    """
+    Cost guard settings of an application
+    :param agent_configuration: max_examined_rows, 0 disables the guard,
+        cost_guard_action and cost_guard_time_window_days
+    :return: Settings, None if disabled
+    """
+    agent_configuration = agent_configuration or {}
+    max_examined_rows = agent_configuration.get("max_examined_rows")
+    if max_examined_rows is None:
+        max_examined_rows = ENV.MAX_EXAMINED_ROWS or DEFAULT_MAX_EXAMINED_ROWS
+    if int(max_examined_rows) <= 0:
+        return None
+    action = agent_configuration.get("cost_guard_action")
+    if action not in {item.value for item in ECostGuardAction}:
+        action = ECostGuardAction.REWRITE.value
+    time_window_days = agent_configuration.get("cost_guard_time_window_days")
+    return {
+        "max_examined_rows": int(max_examined_rows),
+        "action": ECostGuardAction(action),
+        "time_window_days": int(time_window_days) if time_window_days else None,
+    }
+
+
+def _estimate_result_rows(plan: list[dict]) -> float | None:
+    """
+    Estimate the row count of a query from the optimizer's row estimates
+    """
+    estimate = None
+    for row in plan:
+        # Tables joined by the top level SELECT multiply the rows
+        if str(row.get("id")) != "1" or row.get("rows") is None:
+            continue
+        rows = float(row["rows"]) * float(row.get("filtered") or 100) / 100
+        estimate = rows if estimate is None else estimate * rows
+    return estimate
+
+
+def _estimate_examined_rows(plan: list[dict]) -> float | None:
+    """
+    Estimate the rows a query reads: each table of a nested loop join is read once per
+    row joined before it, the SELECTs of subqueries and unions add up
+    """
+    estimate = None
+    joined_rows: dict = {}
+    for row in plan:
+        if row.get("rows") is None:
+            continue
+        select_id = str(row.get("id"))
+        rows = float(row["rows"])
+        previous = joined_rows.get(select_id, 1.0)
+        estimate = (estimate or 0.0) + previous * rows
+        joined_rows[select_id] = previous * rows * float(row.get("filtered") or 100) / 100
+    return estimate
+
+
+# MySQL error of a statement stopped by MAX_EXECUTION_TIME
+ER_QUERY_TIMEOUT = 3024
 
 
 class DatabaseQueryAgent:
@@ -11,17 +132,55 @@ class DatabaseQueryAgent:
     Database Query Agent
     """
 
-    def __init__(self, database_configuration: dict):
-        db_user = database_configuration.get("db_user")
-        db_password = quote(str(database_configuration.get("db_password", "")))
-        db_host = database_configuration.get("db_host")
-        db_port = database_configuration.get("db_port")
-        db_name = database_configuration.get("db_name")
-        database_uri = f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    def __init__(
+        self,
+        database_configuration: dict,
+        application_id=None,
+        query_timeout: float | None = None,
+        validate_sql: bool = False,
+        cost_guard: dict | None = None,
+    ):
+        """
+        :param database_configuration: Connection of the application database
+        :param application_id: Application
+        :param query_timeout: Seconds a query may run
+        :param validate_sql: Check queries against the application schema before running them
+        :param cost_guard: Reject or rewrite queries estimated to read too many rows,
+            see get_cost_guard
+        """
         self.user_question: str = ""
         self.sql_list: list[str] = []
         self.error_msgs: list[str] = []
-        self.engine = sqlalchemy.create_engine(database_uri)
+        # Error type and message of every failed SQL, for callers deciding how to retry
+        self.query_errors: list[dict] = []
+        # MySQL connection id of the running query, used to kill it
+        self.connection_id: int | None = None
+        # Seconds a query may run before it is stopped
+        self.query_timeout = float(
+            query_timeout or ENV.QUERY_EXECUTION_TIMEOUT or DEFAULT_QUERY_TIMEOUT
+        )
+        self.timed_out = False
+        self.cost_guard = cost_guard
+        # Row count, truncation flag and total row estimate of the last result
+        self.result_info: dict = {}
+        self.max_result_count = int(
+            ENV.MAX_RESULT_COUNT_FOR_DISPLAY_RESULT or DEFAULT_MAX_RESULT_COUNT
+        )
+        self.max_result_bytes = int(
+            ENV.MAX_RESULT_BYTES_FOR_QUERY_RESULT or DEFAULT_MAX_RESULT_BYTES
+        )
+        self.application_id = application_id
+        self.validate_sql = validate_sql and application_id is not None
+        # Queries run on a read replica, or on the primary, in READ ONLY sessions
+        self.read_router = engine_registry.get_read_router(
+            database_configuration, application_id=application_id
+        )
+        self._endpoint_lock = threading.Lock()
+        # Endpoints that failed to connect during the current run
+        self._failed_endpoints: list = []
+        # Chosen by run, choosing may health check replicas, which blocks
+        self.endpoint = None
+        self.engine = None
 
     @staticmethod
     def _sql_error_handler(e) -> str:
@@ -42,18 +201,420 @@ class DatabaseQueryAgent:
         for index, sql in enumerate(self.sql_list):
             sql_error_prompt += f"- Error SQL {index + 1}: {sql}\n- The SQL that encountered an error: {self.error_msgs[index]}\n"
         sql_error_prompt += "Please analyze the above SQL and the reasons for the execution error, and regenerate a new correct SQL."
+        if any(
+            error["error_type"]
+            in (EQueryErrorType.TIMEOUT.value, EQueryErrorType.COST.value)
+            for error in self.query_errors
+        ):
+            sql_error_prompt += " The new SQL must be much cheaper to execute: avoid cross joins and unnecessary joins, filter as early as possible on indexed columns, aggregate instead of returning raw rows, and add a LIMIT."
         return sql_error_prompt
 
+    def _get_error_type(self, e) -> EQueryErrorType:
+        if isinstance(e, QueryCostError):
+            return EQueryErrorType.COST
+        errno = getattr(getattr(e, "orig", e), "errno", None)
+        if errno == ER_QUERY_TIMEOUT or self.timed_out:
+            return EQueryErrorType.TIMEOUT
+        return EQueryErrorType.ERROR
+
+    def _kill_timed_out_query(self):
+        if self.connection_id:
+            self.timed_out = True
+            self.kill_query()
+
+    def _set_session_limits(self, connection) -> bool:
+        """
+        Limit the rows and execution time of the next SELECT on the server
+        :return: Whether the server supports MAX_EXECUTION_TIME
+        """
+        # The server stops a top level SELECT without its own LIMIT after one more
+        # row than is kept, one extra row tells that the result was cut off
+        connection.exec_driver_sql(
+            f"SET SESSION sql_select_limit = {self.max_result_count + 1}"
+        )
+        try:
+            connection.exec_driver_sql(
+                f"SET SESSION MAX_EXECUTION_TIME = {int(self.query_timeout * 1000)}"
+            )
+        except Exception as e:
+            # e.g. MariaDB, the query is still killed by the client side timer
+            logger.debug(
+                "MAX_EXECUTION_TIME is not supported: %s", self._sql_error_handler(e)
+            )
+            return False
+        return True
+
+    def _fetch_result(self, connection, sql_query) -> str:
+        """
+        Stream the rows of a query into a JSON array, stopping at the row or byte limit
+        :return: JSON records
+        """
+        max_execution_time_set = self._set_session_limits(connection)
+        # The dialect buffers whole results, rows are streamed with an unbuffered cursor
+        cursor = connection.connection.cursor(buffered=False)
+        records = []
+        result_bytes = 2
+        truncated = False
+        # Whether the server may still have rows to send after the result was cut off
+        rows_remaining = False
+        try:
+            cursor.execute(sql_query)
+            columns = [column[0] for column in cursor.description or []]
+            while not truncated:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                for index, row in enumerate(rows):
+                    record = json.dumps(
+                        dict(zip(columns, row)),
+                        ensure_ascii=False,
+                        separators=(",", ":"),
+                        default=_json_default,
+                    )
+                    result_bytes += len(record.encode("utf-8")) + 1
+                    if result_bytes > self.max_result_bytes:
+                        truncated = rows_remaining = True
+                        break
+                    if len(records) >= self.max_result_count:
+                        # Usually the extra row allowed by sql_select_limit, which is the
+                        # last one the server sends unless the query has its own LIMIT
+                        truncated = True
+                        rows_remaining = (
+                            index < len(rows) - 1 or cursor.fetchone() is not None
+                        )
+                        break
+                    records.append(record)
+        finally:
+            if rows_remaining:
+                # Unread rows would be drained on close, stop the query instead
+                self.kill_query()
+                with contextlib.suppress(Exception):
+                    cursor.close()
+                connection.invalidate()
+            else:
+                try:
+                    cursor.close()
+                    connection.exec_driver_sql("SET SESSION sql_select_limit = DEFAULT")
+                    if max_execution_time_set:
+                        connection.exec_driver_sql(
+                            "SET SESSION MAX_EXECUTION_TIME = DEFAULT"
+                        )
+                except Exception:
+                    # Never return a connection with session limits set to the pool
+                    connection.invalidate()
+        self.result_info = {
+            "row_count": len(records),
+            "truncated": truncated,
+            "total_count_estimate": len(records),
+        }
+        return f"[{','.join(records)}]"
+
+    def _connect(self):
+        """
+        Connect to the current read endpoint, failing over to another endpoint while
+        endpoints can't be reached
+        """
+        while True:
+            engine, endpoint = self.engine, self.endpoint
+            try:
+                return engine.connect()
+            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError) as e:
+                # A full pool raises sqlalchemy.exc.TimeoutError, the endpoint is still up
+                with self._endpoint_lock:
+                    if self.endpoint is not endpoint:
+                        # Another thread already failed over
+                        continue
+                    self._failed_endpoints.append(endpoint)
+                    self.read_router.mark_down(endpoint)
+                    next_endpoint = self.read_router.choose(exclude=self._failed_endpoints)
+                    if next_endpoint is None:
+                        raise
+                    logger.warning(
+                        "Failing over from read endpoint %s to %s: %s",
+                        endpoint.name,
+                        next_endpoint.name,
+                        self._sql_error_handler(e),
+                    )
+                    self.endpoint = next_endpoint
+                    self.engine = next_endpoint.engine
+
+    def _explain(self, sql_query) -> list[dict]:
+        with self._connect() as connection:
+            return [
+                dict(row)
+                for row in connection.exec_driver_sql(f"EXPLAIN {sql_query}")
+                .mappings()
+                .all()
+            ]
+
+    def _estimate_total_count(self, sql_query, plan: list[dict] | None = None) -> int | None:
+        """
+        Estimate the row count of a query from the optimizer's row estimates
+        :param plan: EXPLAIN rows of the query if known
+        """
+        if plan is None:
+            try:
+                plan = self._explain(sql_query)
+            except Exception as e:
+                logger.info("Failed to estimate row count: %s", self._sql_error_handler(e))
+                return None
+        estimate = _estimate_result_rows(plan)
+        return int(estimate) if estimate is not None else None
+
+    def _get_time_window_column(self, table_name: str) -> str | None:
+        """
+        Indexed date or time column of a table, a predicate on it avoids a full scan
+        """
+        schema, _ = create_application_schema(self.application_id)
+        for table in schema:
+            if table["table"].lower() != table_name.lower():
+                continue
+            for column in table["columns"]:
+                column_type = (column["type"] or "").lower()
+                if column["key"] and column_type.startswith(("date", "timestamp")):
+                    return column["name"]
+        return None
+
+    def _rewrite_expensive_query(self, sql_query, plan: list[dict]) -> tuple | None:
+        """
+        Bound the rows an over-budget query reads, with a LIMIT if the server can stop the
+        query early, else with a time window on the largest fully scanned table
+        :return: Rewritten query, its plan, the rewrite made and the examined rows estimate
+        """
+        max_examined_rows = self.cost_guard["max_examined_rows"]
+        if is_streamable(sql_query):
+            limit = self.max_result_count + 1
+            limited_sql = add_limit(sql_query, limit)
+            result_rows = _estimate_result_rows(plan)
+            examined_rows = _estimate_examined_rows(plan)
+            if limited_sql and result_rows and examined_rows:
+                # The server stops after the rows read for the first `limit` result rows
+                examined_rows *= min(1.0, limit / result_rows)
+                if examined_rows <= max_examined_rows:
+                    return limited_sql, plan, {"rewrite": "limit"}, examined_rows
+        time_window_days = self.cost_guard["time_window_days"]
+        if not time_window_days or self.application_id is None:
+            return None
+        aliases = get_table_aliases(sql_query)
+        scanned = sorted(
+            (
+                row
+                for row in plan
+                if str(row.get("id")) == "1"
+                and row.get("type") in ("ALL", "index")
+                and str(row.get("table") or "").lower() in aliases
+            ),
+            key=lambda row: -float(row.get("rows") or 0),
+        )
+        if not scanned:
+            return None
+        alias = str(scanned[0]["table"])
+        column = self._get_time_window_column(aliases[alias.lower()])
+        if not column:
+            return None
+        windowed_sql = add_time_window(sql_query, alias, column, time_window_days)
+        if not windowed_sql:
+            return None
+        windowed_plan = self._explain(windowed_sql)
+        examined_rows = _estimate_examined_rows(windowed_plan)
+        if examined_rows is None or examined_rows > max_examined_rows:
+            return None
+        return (
+            windowed_sql,
+            windowed_plan,
+            {
+                "rewrite": "time_window",
+                "time_window": {
+                    "table": aliases[alias.lower()],
+                    "column": column,
+                    "days": time_window_days,
+                },
+            },
+            examined_rows,
+        )
+
+    def _guard_cost(self, sql_query, plan: list[dict]) -> tuple[str, list[dict], dict | None]:
+        """
+        Check the estimated rows a query reads against the budget of the application
+        :return: Query to run, its plan and the rewrite made, if any
+        :raises QueryCostError: The query is over budget and couldn't be rewritten
+        """
+        examined_rows = _estimate_examined_rows(plan)
+        max_examined_rows = self.cost_guard["max_examined_rows"]
+        if examined_rows is None or examined_rows <= max_examined_rows:
+            return sql_query, plan, None
+        reason = {
+            "examined_rows_estimate": int(examined_rows),
+            "max_examined_rows": max_examined_rows,
+            "full_scans": [
+                str(row.get("table"))
+                for row in plan
+                if row.get("type") == "ALL" and row.get("table")
+            ],
+        }
+        if self.cost_guard["action"] == ECostGuardAction.REWRITE:
+            rewritten = self._rewrite_expensive_query(sql_query, plan)
+            if rewritten:
+                rewritten_sql, rewritten_plan, rewrite, rewritten_rows = rewritten
+                logger.info(
+                    "Rewrote a query reading about %d rows with a %s",
+                    examined_rows,
+                    rewrite["rewrite"],
+                )
+                return (
+                    rewritten_sql,
+                    rewritten_plan,
+                    {
+                        **reason,
+                        **rewrite,
+                        "original_sql": sql_query,
+                        "rewritten_examined_rows_estimate": int(rewritten_rows),
+                    },
+                )
+        message = f"The query would read about {int(examined_rows):,} rows, more than the {max_examined_rows:,} rows allowed"
+        if reason["full_scans"]:
+            message += f", it fully scans {', '.join(reason['full_scans'])}"
+        raise QueryCostError(message, reason)
+
+    def _validate(self, sql_list: list[str]) -> dict:
+        """
+        Check queries against the cached application schema, without the database
+        :return: Validation errors by index of the invalid queries
+        """
+        if not self.validate_sql:
+            return {}
+        validator = get_sql_validator(self.application_id)
+        errors = {}
+        for index, sql_query in enumerate(sql_list):
+            validation_errors = validator.validate(sql_query)
+            if validation_errors:
+                errors[index] = validation_errors
+        return errors
+
+    def _explain_candidates(self, sql_queries: dict) -> tuple[dict, dict]:
+        """
+        EXPLAIN candidate queries concurrently, a query the server can't plan would fail to run
+        :param sql_queries: Queries by index
+        :return: Plans and errors by index of the queries
+        """
+        plans = {}
+        errors = {}
+        max_workers = max(1, min(len(sql_queries), self.engine.pool.size()))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._explain, sql_query): index
+                for index, sql_query in sql_queries.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    plans[futures[future]] = future.result()
+                except Exception as e:
+                    errors[futures[future]] = e
+        return plans, errors
+
     def run(self, _user_question, sql_list):
+        """
+        Run the first query of the list that succeeds.
+        Queries failing validation never reach the database. Several candidates are then
+        checked with concurrent EXPLAINs, so candidates that can't run are skipped without
+        executing them; the rest run in order. With a cost guard, queries estimated to read
+        too many rows are rewritten to read less, or rejected.
+        Queries run in READ ONLY sessions on a read endpoint of the database, another
+        endpoint takes over if it can't be reached.
+        :return: Result JSON, the query that ran and errors, or None, None and the retry prompt
+        """
         self.user_question = _user_question
         self.sql_list = sql_list
         self.error_msgs = []
-        for sql_query in sql_list:
+        self.query_errors = []
+        self.result_info = {}
+        self._failed_endpoints = []
+        self.endpoint = self.read_router.choose()
+        self.engine = self.endpoint.engine
+        validation_errors = self._validate(sql_list)
+        candidates = {
+            index: sql_query
+            for index, sql_query in enumerate(sql_list)
+            if index not in validation_errors
+        }
+        plans, explain_errors = (
+            self._explain_candidates(candidates) if len(candidates) > 1 else ({}, {})
+        )
+        for index, sql_query in enumerate(sql_list):
+            self.timed_out = False
+            if index in validation_errors:
+                error_msg = "; ".join(
+                    error["message"] for error in validation_errors[index]
+                )
+                self.error_msgs.append(error_msg)
+                self.query_errors.append(
+                    {
+                        "sql": sql_query,
+                        "error_type": EQueryErrorType.VALIDATION.value,
+                        "message": error_msg,
+                        "errors": validation_errors[index],
+                    }
+                )
+                continue
             try:
-                df = pd.read_sql_query(sql_query, self.engine)
-                query_result = df.to_json(orient="records", force_ascii=False)
-                return json.dumps(json.loads(query_result), ensure_ascii=False, separators=(',', ':')), sql_query, self.error_msgs
+                if index in explain_errors:
+                    raise explain_errors[index]
+                plan = plans.get(index)
+                rewrite = None
+                if self.cost_guard:
+                    if plan is None:
+                        plan = self._explain(sql_query)
+                    sql_query, plan, rewrite = self._guard_cost(sql_query, plan)
+                with self._connect() as connection:
+                    self.connection_id = connection.exec_driver_sql(
+                        "SELECT CONNECTION_ID()"
+                    ).scalar()
+                    # Also bounds time spent streaming rows, which the server doesn't count
+                    timer = threading.Timer(
+                        self.query_timeout, self._kill_timed_out_query
+                    )
+                    timer.daemon = True
+                    timer.start()
+                    try:
+                        query_result = self._fetch_result(connection, sql_query)
+                    finally:
+                        timer.cancel()
+                        self.connection_id = None
+                if self.result_info["truncated"]:
+                    self.result_info["total_count_estimate"] = max(
+                        self._estimate_total_count(sql_query, plan) or 0,
+                        self.result_info["row_count"] + 1,
+                    )
+                if rewrite:
+                    self.result_info["cost_guard"] = rewrite
+                return query_result, sql_query, self.error_msgs
             except Exception as e:
+                error_type = self._get_error_type(e)
                 error_msg = self._sql_error_handler(e)
+                if error_type == EQueryErrorType.TIMEOUT:
+                    error_msg = f"The query was stopped after exceeding the {self.query_timeout:g} seconds execution time limit ({error_msg})"
                 self.error_msgs.append(error_msg)
+                query_error = {
+                    "sql": sql_query,
+                    "error_type": error_type.value,
+                    "message": error_msg,
+                }
+                if isinstance(e, QueryCostError):
+                    query_error["reason"] = e.reason
+                self.query_errors.append(query_error)
         return None, None, self._generate_execute_prompt()
+
+    def kill_query(self):
+        """
+        Kill the running query on the database server, the connection itself is kept
+        """
+        connection_id, engine = self.connection_id, self.engine
+        if not connection_id or engine is None:
+            return
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql(f"KILL QUERY {int(connection_id)}")
+        except Exception as e:
+            logger.warning(
+                "Failed to kill query %s: %s", connection_id, self._sql_error_handler(e)
+            )
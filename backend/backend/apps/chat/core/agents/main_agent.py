@@ -1,4 +1,7 @@
+import asyncio
+import contextlib
 import json
+import logging
 import time
 from enum import Enum
 
@@ -6,12 +9,19 @@ from asgiref.sync import sync_to_async
 from regex import P
 
 from backend.apps.application.models import Application
+from backend.apps.chat.core.result_cache import QueryResultCache
+from backend.apps.chat.core.sql_cache import QuestionSQLCache, get_question_similarity
 
 from .answer_generator_agent import AnswerGeneratorAgent
-from .database_query_agent import DatabaseQueryAgent
+from .database_query_agent import DatabaseQueryAgent, get_cost_guard
 from .question_agent import QuestionAgent
 from .sql_generator_agent import SQLGeneratorAgent
 
+logger = logging.getLogger(__name__)
+
+# Rewritten questions less similar than this to the user question are recalled again
+DEFAULT_RECALL_DIVERGENCE_THRESHOLD = 0.8
+
 
 class DisplayFormat(Enum):
     CHART = "chart"
@@ -41,6 +51,8 @@ class MainAgent:
         self.step_times = {}
         self.timestamp = None
         self.steps = []
+        # Kept across retries, so the schema recalled for the question is reused
+        self.sql_generator_agent: SQLGeneratorAgent | None = None
 
     def _set_step_time(self, step_name: str = ""):
         if step_name:
@@ -54,6 +66,55 @@ class MainAgent:
         self.timestamp = time.time()
         return 0
 
+    async def _start_speculative_recall(
+        self, user_question: str, error_prompt: str
+    ) -> asyncio.Task | None:
+        """
+        Start recalling the schema for the user question, so it overlaps with question rewriting
+        """
+        agent_configuration = self.application.agent_configuration or {}
+        if error_prompt or not agent_configuration.get("pipelined_recall", True):
+            return None
+        if self.sql_generator_agent is None:
+            self.sql_generator_agent = await sync_to_async(SQLGeneratorAgent)(
+                application=self.application
+            )
+        if self.sql_generator_agent.schema:
+            return None
+        return asyncio.create_task(self.sql_generator_agent.get_schema(user_question))
+
+    @staticmethod
+    async def _cancel_task(task: asyncio.Task | None):
+        if task is None or task.done():
+            return
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await task
+
+    async def _reconcile_recall(
+        self, recall_task: asyncio.Task, user_question: str, new_question: str
+    ) -> str:
+        """
+        Keep the schema recalled for the user question unless the rewritten question diverges
+        :return: reused, re_recalled or failed, the SQL generator recalls again unless reused
+        """
+        threshold = float(
+            (self.application.agent_configuration or {}).get(
+                "recall_divergence_threshold", DEFAULT_RECALL_DIVERGENCE_THRESHOLD
+            )
+        )
+        if get_question_similarity(user_question, new_question) < threshold:
+            await self._cancel_task(recall_task)
+            self.sql_generator_agent.schema = ""
+            return "re_recalled"
+        try:
+            await recall_task
+        except Exception:
+            logger.warning("Speculative schema recall failed", exc_info=True)
+            self.sql_generator_agent.schema = ""
+            return "failed"
+        return "reused"
+
     async def run_stream(self, user_question: str, error_prompt: str = ""):
         """
         :param user_question: User question for database
@@ -61,11 +122,18 @@ class MainAgent:
         :yield: answer, sql_list, valid_sql, query_result, step_times
         """
         question_agent = QuestionAgent(application=self.application)
-        sql_generator_agent = await sync_to_async(SQLGeneratorAgent)(
-            application=self.application
-        )
+        sql_cache = QuestionSQLCache(self.application)
+        result_cache = QueryResultCache(self.application)
         db_query_agent = DatabaseQueryAgent(
-            database_configuration=self.database_configuration
+            database_configuration=self.database_configuration,
+            application_id=self.application.id,
+            query_timeout=(self.application.agent_configuration or {}).get(
+                "query_timeout"
+            ),
+            validate_sql=(self.application.agent_configuration or {}).get(
+                "sql_validation", True
+            ),
+            cost_guard=get_cost_guard(self.application.agent_configuration),
         )
 
         # Step 1: QuestionAgent - Process user question
@@ -79,12 +147,18 @@ class MainAgent:
         )
         yield self.steps
 
+        recall_task = await self._start_speculative_recall(user_question, error_prompt)
+
         self._set_step_time()
 
         # Run question_agent asynchronously
-        is_compliant, new_question, language = await sync_to_async(question_agent.run)(
-            user_question
-        )
+        try:
+            is_compliant, new_question, language = await question_agent.run(
+                user_question
+            )
+        except BaseException:
+            await self._cancel_task(recall_task)
+            raise
         latency = self._set_step_time("question_agent")
 
         # Update question-agent step result
@@ -99,6 +173,7 @@ class MainAgent:
 
         # If not compliant, respond with error message and terminate the processing
         if not is_compliant:
+            await self._cancel_task(recall_task)
             answer = {
                 "summary": "Sorry, your question is not relevant to the current system. Please try another one...",
                 "chart_option": "",
@@ -121,6 +196,11 @@ class MainAgent:
             yield self.steps
             return
 
+        # Previously validated SQL of the same question skips SQL generation
+        cached_sql = None
+        if not error_prompt:
+            cached_sql = await sync_to_async(sql_cache.get)(new_question)
+
         # Step 2: SQLGeneratorAgent - Generate SQL
         self.steps.append(
             {
@@ -134,17 +214,45 @@ class MainAgent:
 
         self._set_step_time()
 
-        # Run sql_generator_agent to generate SQL statements
-        sql = await sync_to_async(sql_generator_agent.run)(
-            error_prompt or new_question,
-        )
-        sql_list = [sql]
+        schema_recall = []
+        speculative_recall = None
+        if cached_sql:
+            await self._cancel_task(recall_task)
+            sql_list = [cached_sql]
+        else:
+            if recall_task:
+                speculative_recall = await self._reconcile_recall(
+                    recall_task, user_question, new_question
+                )
+            # Run sql_generator_agent to generate SQL statements
+            if self.sql_generator_agent is None:
+                self.sql_generator_agent = await sync_to_async(SQLGeneratorAgent)(
+                    application=self.application
+                )
+            candidate_count = int(
+                (self.application.agent_configuration or {}).get(
+                    "sql_candidate_count", 1
+                )
+            )
+            if candidate_count > 1:
+                # Candidates are checked together, the first one that runs is used
+                sql_list = await self.sql_generator_agent.run_candidates(
+                    error_prompt or new_question, candidate_count
+                )
+            else:
+                sql_list = [
+                    await self.sql_generator_agent.run(error_prompt or new_question)
+                ]
+            schema_recall = self.sql_generator_agent.schema_recall
         latency = self._set_step_time("sql_generator_agent")
 
         # Update sql_generator_agent step result
         self.steps[-1]["status"] = EStepStatus.COMPLETED.value
         self.steps[-1]["result"] = sql_list
         self.steps[-1]["latency"] = latency
+        self.steps[-1]["cache_hit"] = bool(cached_sql)
+        self.steps[-1]["schema_recall"] = schema_recall
+        self.steps[-1]["speculative_recall"] = speculative_recall
         yield self.steps
 
         # Step 3: DatabaseQueryAgent - Execute SQL on database
@@ -160,17 +268,38 @@ class MainAgent:
 
         self._set_step_time()
 
-        # Query the database based on the generated SQL list
-        query_result, valid_sql, _error_prompt = await sync_to_async(
-            db_query_agent.run
-        )(new_question, sql_list)
+        # Results of the same SQL are reused while the tables it reads are unchanged
+        cached_result = await sync_to_async(result_cache.get, thread_sensitive=False)(
+            sql_list
+        )
+        self._set_step_time(
+            "db_query_cache_hit" if cached_result else "db_query_cache_miss"
+        )
+        if cached_result:
+            query_result = cached_result["query_result"]
+            valid_sql = cached_result["valid_sql"]
+            result_info = cached_result["result_info"]
+        else:
+            # Query the database based on the generated SQL list
+            try:
+                query_result, valid_sql, _error_prompt = await sync_to_async(
+                    db_query_agent.run, thread_sensitive=False
+                )(new_question, sql_list)
+            except asyncio.CancelledError:
+                # The worker thread can't be interrupted, stop the query on the server instead
+                await sync_to_async(db_query_agent.kill_query, thread_sensitive=False)()
+                raise
+            result_info = db_query_agent.result_info
         latency = self._set_step_time("db_query_agent")
 
         # Check for empty query_result
         if query_result is None:
+            if cached_sql:
+                await sync_to_async(sql_cache.delete)(new_question)
             self.current_execution_count += 1
             self.steps[-1]["status"] = EStepStatus.ERROR.value
             self.steps[-1]["result"] = _error_prompt
+            self.steps[-1]["errors"] = db_query_agent.query_errors
             # Handle retries if query result is empty
             if self.current_execution_count <= self.maximum_execution_count:
                 error_msg = (
@@ -206,10 +335,28 @@ class MainAgent:
                 yield self.steps
                 return
 
+        # A query rewritten by the cost guard is cached as generated, the rewrite depends
+        # on the plan when it runs
+        original_sql = (result_info.get("cost_guard") or {}).get(
+            "original_sql", valid_sql
+        )
+        if not cached_sql:
+            await sync_to_async(sql_cache.set)(new_question, original_sql)
+        if not cached_result:
+            await sync_to_async(result_cache.set, thread_sensitive=False)(
+                original_sql,
+                query_result,
+                valid_sql,
+                result_info,
+            )
+
         # Update db_query_agent step result
         self.steps[-1]["status"] = EStepStatus.COMPLETED.value
         self.steps[-1]["result"] = []
+        self.steps[-1]["valid_sql"] = valid_sql
+        self.steps[-1]["result_info"] = result_info
         self.steps[-1]["latency"] = latency
+        self.steps[-1]["cache_hit"] = bool(cached_result)
         yield self.steps
 
         # Step 4: AnswerGeneratorAgent - Generate natural language answer
@@ -233,6 +380,7 @@ class MainAgent:
         async for chunk in answer_generator.run(
             user_question=f"Please answer the question in {language}: {new_question}",
             query_result=query_result,
+            result_info=result_info,
         ):
             answer_text += chunk
             if "<chart></chart>" in answer_text:
@@ -253,6 +401,7 @@ class MainAgent:
         self.steps[-1]["sql_list"] = sql_list
         self.steps[-1]["valid_sql"] = valid_sql
         self.steps[-1]["query_result"] = json.loads(query_result, strict=False)
+        self.steps[-1]["result_info"] = result_info
         self.steps[-1]["step_times"] = self.step_times
         yield self.steps
         return
@@ -5,7 +5,7 @@ from backend.apps.application.models import Application
 from backend.apps.chat.core.prompts.question_prompt import prompt as question_prompt
 from backend.apps.chat.core.utils import validate_json_string
 from backend.settings.env import ENV
-from backend.utils.llm import ChatCompletionService, get_llm_tokens
+from backend.utils.llm import AsyncChatCompletionService, get_llm_tokens
 
 
 class QuestionAgent:
@@ -33,7 +33,7 @@ class QuestionAgent:
             compliant_dict.get("language", "英文"),
         )
 
-    def run(
+    async def run(
         self,
         user_question: str,
     ) -> tuple[bool, str, str]:
@@ -44,12 +44,12 @@ class QuestionAgent:
                 "name": item.name,
                 "comment": item.ai_comment or item.comment,
             }
-            for item in self.application.tables.filter(
+            async for item in self.application.tables.filter(
                 is_deleted=False,
                 is_enabled=True,
             )
         ]
-        llm_messages = ChatCompletionService.set_llm_messages(
+        llm_messages = AsyncChatCompletionService.set_llm_messages(
             system_content=question_prompt.format(
                 application_name=self.application.name,
                 application_description=self.application.description,
@@ -58,7 +58,7 @@ class QuestionAgent:
             user_content=f"User question: {user_question}",
         )
         tokens = get_llm_tokens(llm_messages)
-        result = ChatCompletionService.create_completion(
+        result = await AsyncChatCompletionService.create_completion(
             model=f"ollama:{ENV.QUESTION_AGENT_MODEL}",
             messages=llm_messages,
             options={
@@ -71,5 +71,5 @@ class QuestionAgent:
         result, _ = validate_json_string(result)
         if not result:
             self.current_execution_count += 1
-            return self.run(user_question)
+            return await self.run(user_question)
         return self.judge_question_compliant(result)
@@ -1,27 +1,54 @@
+import asyncio
 import json
+import logging
 
-import sqlparse
+from asgiref.sync import sync_to_async
 from regex import P
 
 from backend.apps.application.core.agents import schema_rag_agent
 from backend.apps.application.models import (
     Application,
     ApplicationPrompt,
-    FineTuningExample,
     FineTuningModel,
+    RAGMethod,
 )
 from backend.apps.application.utils import json_list_to_ddl
+from backend.apps.chat.core.example_index import (
+    DEFAULT_FEW_SHOT_TOKEN_BUDGET,
+    DEFAULT_FEW_SHOT_TOP_K,
+    get_example_index,
+)
 from backend.apps.chat.core.prompts.sql_generator_prompt import (
     prompt as sql_generator_prompt,
 )
+from backend.apps.chat.core.recall_cache import (
+    get_recalled_schema,
+    set_recalled_schema,
+)
+from backend.apps.chat.core.schema_index import (
+    DEFAULT_SCHEMA_TOP_K,
+    get_schema_index,
+)
+from backend.apps.chat.core.schema_recall import (
+    DEFAULT_SCHEMA_GRAPH_HOPS,
+    DEFAULT_SCHEMA_TOKEN_BUDGET,
+    DEFAULT_SCHEMA_VECTOR_WEIGHT,
+    get_schema_recall_index,
+)
 from backend.settings.env import ENV
 from backend.utils.llm import (
-    ChatCompletionService,
+    AsyncChatCompletionService,
     LLMResponseFormat,
+    create_application_ddl,
     create_application_schema,
     get_llm_tokens,
 )
 
+logger = logging.getLogger(__name__)
+
+# Sampling temperature added per SQL candidate after the first, deterministic one
+SQL_CANDIDATE_TEMPERATURE_STEP = 0.3
+
 
 class SQLGeneratorAgent:
     def __init__(
@@ -29,62 +56,114 @@ class SQLGeneratorAgent:
         application: Application,
     ):
         self.schema = ""
+        # Recalled tables with their scores, reported by hybrid recall
+        self.schema_recall: list[dict] = []
         self.application = application
         self.current_execution_count = 1
         self.maximum_execution_count = 3
         application_prompt_instance = ApplicationPrompt.objects.filter(
             application=self.application
         ).first()
+        self.schema_rag_prompt = ""
         if application_prompt_instance:
             self.sql_generator_prompt = (
                 application_prompt_instance.sql_generator_prompt or sql_generator_prompt
             )
+            self.schema_rag_prompt = application_prompt_instance.schema_rag_prompt or ""
         else:
             self.sql_generator_prompt = sql_generator_prompt
 
-    @staticmethod
-    def verify_sql_syntax(sql: str) -> bool:
-        """
-        Verify if SQL syntax is correct
-        :param sql:
-        :return:
-        """
-        try:
-            parsed = sqlparse.parse(sql)
-            for statement in parsed:
-                str(statement)
-            return True
-        except Exception as e:
-            return False
-
-    def get_schema(self, question: str):
-        schema, _ = create_application_schema(application_id=self.application.id)
+    async def get_schema(self, question: str):
         agent_configuration = self.application.agent_configuration
         if not agent_configuration.get("rag_enabled"):
             # if RAG is not enabled, use the full schema from the application
-            _, self.schema = json_list_to_ddl(schema)
+            _, self.schema = await sync_to_async(create_application_ddl)(
+                application_id=self.application.id
+            )
             return
-        else:
-            agent = schema_rag_agent.Agent(application_id=self.application.id)
-            recalled_tables = json.loads(agent.run(question))
+        schema, _ = await sync_to_async(create_application_schema)(
+            application_id=self.application.id
+        )
+        recalled = await sync_to_async(get_recalled_schema)(
+            self.application, question, self.schema_rag_prompt
+        )
+        if recalled is None:
+            recalled = {
+                "tables": await self._recall_tables(question, schema),
+                "schema_recall": self.schema_recall,
+            }
+            await sync_to_async(set_recalled_schema)(
+                self.application, question, recalled, self.schema_rag_prompt
+            )
+        self.schema_recall = recalled["schema_recall"]
         tables = []
         for item in schema:
-            if item["table"] in recalled_tables:
+            if item["table"] in recalled["tables"]:
                 tables.append(item)
         _, self.schema = json_list_to_ddl(tables)
 
-    def run(self, question: str):
-        if self.current_execution_count > self.maximum_execution_count:
-            raise Exception("Maximum execution count reached")
+    async def _recall_tables(self, question: str, schema: list[dict]) -> list[str]:
+        agent_configuration = self.application.agent_configuration
+        if agent_configuration.get("rag_method") == RAGMethod.EMBEDDING:
+            schema_index = get_schema_index(self.application.id)
+            recalled = await sync_to_async(schema_index.search)(
+                question,
+                top_k=int(
+                    agent_configuration.get("schema_top_k", DEFAULT_SCHEMA_TOP_K)
+                ),
+            )
+            # Nothing in the schema resembles the question, let the model see all of it
+            recalled_tables = [item["table"] for item in recalled or schema]
+        elif agent_configuration.get("rag_method") == RAGMethod.HYBRID:
+            recall_index = get_schema_recall_index(self.application.id)
+            self.schema_recall = await sync_to_async(recall_index.search)(
+                question,
+                top_k=int(
+                    agent_configuration.get("schema_top_k", DEFAULT_SCHEMA_TOP_K)
+                ),
+                token_budget=int(
+                    agent_configuration.get(
+                        "schema_token_budget", DEFAULT_SCHEMA_TOKEN_BUDGET
+                    )
+                ),
+                vector_weight=float(
+                    agent_configuration.get(
+                        "schema_vector_weight", DEFAULT_SCHEMA_VECTOR_WEIGHT
+                    )
+                ),
+                hops=int(
+                    agent_configuration.get("schema_graph_hops", DEFAULT_SCHEMA_GRAPH_HOPS)
+                ),
+            )
+            recalled_tables = [
+                item["table"] for item in self.schema_recall or schema
+            ]
+        else:
+            agent = await sync_to_async(schema_rag_agent.get_agent)(
+                self.application.id, self.schema_rag_prompt
+            )
+            recalled_tables = json.loads(await agent.run(question))
+        return recalled_tables
+
+    async def _get_llm_messages(self, question: str) -> list[dict]:
         if not self.schema:
-            self.get_schema(question)
+            await self.get_schema(question)
 
-        fine_tuning_examples = FineTuningExample.objects.filter(
-            application=self.application,
-            is_enabled=True,
-        ).order_by("created_at")
+        agent_configuration = self.application.agent_configuration or {}
+        example_index = get_example_index(self.application.id)
+        fine_tuning_examples = await sync_to_async(example_index.search)(
+            question,
+            top_k=int(
+                agent_configuration.get("few_shot_top_k", DEFAULT_FEW_SHOT_TOP_K)
+            ),
+            token_budget=int(
+                agent_configuration.get(
+                    "few_shot_token_budget", DEFAULT_FEW_SHOT_TOKEN_BUDGET
+                )
+            ),
+        )
 
-        llm_messages = ChatCompletionService.set_llm_messages(
+        llm_messages = AsyncChatCompletionService.set_llm_messages(
             system_content=self.sql_generator_prompt.format(
                 db=self.application.database_configuration.get("db"),
                 database_schema=self.schema,
@@ -94,36 +173,89 @@ class SQLGeneratorAgent:
 
         if fine_tuning_examples:
             examples_context = []
-            for example in fine_tuning_examples:
+            # Most relevant example last, closest to the question
+            for example in reversed(fine_tuning_examples):
                 examples_context.extend(
                     [
                         {
                             "role": "user",
-                            "content": example.question,
+                            "content": example["question"],
                         },
                         {
                             "role": "assistant",
-                            "content": example.sql,
+                            "content": example["sql"],
                         },
                     ]
                 )
             llm_messages[1:1] = examples_context
+        return llm_messages
 
-        _model = FineTuningModel.objects.filter(
+    async def _get_model_name(self) -> str:
+        _model = await FineTuningModel.objects.filter(
             application=self.application, is_enabled=True
-        ).first()
-        model_name = _model.model_name if _model else ENV.SQL_GENERATOR_AGENT_MODEL
-        tokens = get_llm_tokens(llm_messages)
-        result = ChatCompletionService.create_completion(
+        ).afirst()
+        return _model.model_name if _model else ENV.SQL_GENERATOR_AGENT_MODEL
+
+    @staticmethod
+    async def _create_sql(
+        model_name: str, llm_messages: list[dict], tokens: int, temperature: float
+    ) -> str | None:
+        result = await AsyncChatCompletionService.create_completion(
             model=f"ollama:{model_name}",
             messages=llm_messages,
             options={
                 "num_ctx": tokens + 1024,
                 "num_batch": 512,
-                "temperature": 0,
+                "temperature": temperature,
             },
         )
+        return LLMResponseFormat.extract_sql_str(result)
+
+    async def run(self, question: str):
+        if self.current_execution_count > self.maximum_execution_count:
+            raise Exception("Maximum execution count reached")
+        llm_messages = await self._get_llm_messages(question)
+        model_name = await self._get_model_name()
+        tokens = get_llm_tokens(llm_messages)
+        result = await self._create_sql(model_name, llm_messages, tokens, 0)
         if not result:
             self.current_execution_count += 1
-            return self.run(question)
-        return LLMResponseFormat.extract_sql_str(result)
+            return await self.run(question)
+        return result
+
+    async def run_candidates(self, question: str, count: int) -> list[str]:
+        """
+        Generate several SQL candidates concurrently from the same prompt.
+        The first candidate is the deterministic one of run, the others sample with rising
+        temperature and rotate over the agent_configuration sql_candidate_models if set.
+        :param question: User question
+        :param count: Number of candidates requested
+        :return: Distinct candidates, the deterministic one first
+        """
+        llm_messages = await self._get_llm_messages(question)
+        model_name = await self._get_model_name()
+        models = (self.application.agent_configuration or {}).get(
+            "sql_candidate_models"
+        ) or [model_name]
+        tokens = get_llm_tokens(llm_messages)
+        results = await asyncio.gather(
+            *[
+                self._create_sql(
+                    model_name if index == 0 else models[(index - 1) % len(models)],
+                    llm_messages,
+                    tokens,
+                    min(round(index * SQL_CANDIDATE_TEMPERATURE_STEP, 2), 1.0),
+                )
+                for index in range(count)
+            ],
+            return_exceptions=True,
+        )
+        candidates = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Failed to generate a SQL candidate: %s", result)
+            elif result and result not in candidates:
+                candidates.append(result)
+        if not candidates:
+            return [await self.run(question)]
+        return candidates
@@ -0,0 +1,112 @@
+import asyncio
+import contextlib
+import time
+from typing import AsyncIterator
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+# Cancellation signals outlive any chat stream
+CANCELLATION_TIMEOUT = 60 * 60
+# Minimum seconds between two checks of the shared cache by one stream
+CANCELLATION_POLL_INTERVAL = 0.5
+
+
+def _get_cancellation_key(task_id: str) -> str:
+    return f"chat_cancelled:{task_id}"
+
+
+class CancellationToken:
+    """
+    Cancellation signal of one chat stream
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self._checked_at = 0.0
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    async def is_cancelled(self, force: bool = False) -> bool:
+        """
+        Check the in-process signal, and the shared cache at most every CANCELLATION_POLL_INTERVAL seconds
+        :param force: Always check the shared cache
+        """
+        if self.event.is_set():
+            return True
+        now = time.monotonic()
+        if force or now - self._checked_at >= CANCELLATION_POLL_INTERVAL:
+            self._checked_at = now
+            # Not thread sensitive, so the check is not queued behind a running database query
+            if await sync_to_async(cache.get, thread_sensitive=False)(
+                _get_cancellation_key(self.task_id)
+            ):
+                self.event.set()
+        return self.event.is_set()
+
+    async def wait(self):
+        while not await self.is_cancelled():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.event.wait(), CANCELLATION_POLL_INTERVAL)
+
+
+class CancellationRegistry:
+    """
+    Cancellation signals of chat streams keyed by task id.
+    Signals are written to the shared cache so that a stream served by any worker
+    sees them, and delivered directly to streams of the current worker.
+    """
+
+    def __init__(self):
+        self._tokens: dict[str, CancellationToken] = {}
+
+    def register(self, task_id: str) -> CancellationToken:
+        token = CancellationToken(task_id)
+        self._tokens[task_id] = token
+        return token
+
+    def unregister(self, task_id: str):
+        self._tokens.pop(task_id, None)
+
+    async def cancel(self, task_id: str):
+        await cache.aset(_get_cancellation_key(task_id), True, CANCELLATION_TIMEOUT)
+        token = self._tokens.get(task_id)
+        if token:
+            token.set()
+
+
+cancellation_registry = CancellationRegistry()
+
+
+async def iterate_until_cancelled(
+    iterator: AsyncIterator, token: CancellationToken
+) -> AsyncIterator:
+    """
+    Iterate an async iterator, cancelling the in-flight step as soon as the token is cancelled.
+    The cancelled step receives asyncio.CancelledError, which aborts pending LLM requests.
+    """
+    iterator = aiter(iterator)
+    waiter = asyncio.ensure_future(token.wait())
+    try:
+        while True:
+            step = asyncio.ensure_future(anext(iterator))
+            await asyncio.wait({step, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                step.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await step
+                return
+            try:
+                value = step.result()
+            except StopAsyncIteration:
+                return
+            yield value
+    finally:
+        waiter.cancel()
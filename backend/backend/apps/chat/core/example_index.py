@@ -0,0 +1,137 @@
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from backend.apps.application.models import FineTuningExample
+from backend.utils.bm25 import BM25Index
+from backend.utils.llm import get_llm_tokens
+from backend.utils.memory_cache import LRUCache
+
+DEFAULT_FEW_SHOT_TOP_K = 5
+DEFAULT_FEW_SHOT_TOKEN_BUDGET = 2048
+# Applications whose example index is kept in each worker
+EXAMPLE_INDEX_CACHE_SIZE = 64
+
+
+def _get_examples_version_key(application_id) -> str:
+    return f"fine_tuning_examples_version:{application_id}"
+
+
+def get_examples_version(application_id) -> str:
+    key = _get_examples_version_key(application_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_examples_version(application_id):
+    """
+    Notify the example indexes of every worker that examples of an application changed
+    """
+    cache.set(_get_examples_version_key(application_id), uuid.uuid4().hex, None)
+
+
+class FineTuningExampleIndex:
+    """
+    BM25 index over the enabled fine-tuning examples of one application.
+    When the examples version changes, only examples added, updated or removed
+    since the last sync are re-read from the database.
+    """
+
+    def __init__(self, application_id):
+        self.application_id = application_id
+        self.lock = threading.Lock()
+        self.index = BM25Index()
+        self.examples: dict = {}
+        self.version = None
+        self.synced_at = None
+
+    def _get_queryset(self):
+        return FineTuningExample.objects.filter(
+            application_id=self.application_id,
+            is_enabled=True,
+            is_deleted=False,
+        )
+
+    def sync(self):
+        version = get_examples_version(self.application_id)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            queryset = self._get_queryset()
+            current_ids = set(queryset.values_list("id", flat=True))
+            for example_id in set(self.examples) - current_ids:
+                self.index.remove(example_id)
+                del self.examples[example_id]
+            if self.synced_at is None:
+                changed = queryset
+            else:
+                new_ids = current_ids - set(self.examples)
+                changed = queryset.filter(
+                    Q(id__in=new_ids) | Q(updated_at__gte=self.synced_at)
+                )
+            for example in changed.only("id", "question", "sql", "updated_at"):
+                self.index.add(example.id, example.question)
+                self.examples[example.id] = {
+                    "question": example.question,
+                    "sql": example.sql,
+                    "tokens": get_llm_tokens(example.question, approximate=True)
+                    + get_llm_tokens(example.sql, approximate=True),
+                    "updated_at": example.updated_at,
+                }
+                if not self.synced_at or example.updated_at > self.synced_at:
+                    self.synced_at = example.updated_at
+            self.version = version
+
+    def search(
+        self,
+        question: str,
+        top_k: int = DEFAULT_FEW_SHOT_TOP_K,
+        token_budget: int = DEFAULT_FEW_SHOT_TOKEN_BUDGET,
+    ) -> list[dict]:
+        """
+        Get the examples most relevant to a question
+        :param question: User question
+        :param top_k: Maximum number of examples
+        :param token_budget: Maximum tokens of all selected examples
+        :return: Examples with question and sql, most relevant first. Examples sharing no
+            term with the question fill the remaining slots, most recently updated first.
+        """
+        self.sync()
+        with self.lock:
+            matched_ids = [example_id for example_id, _ in self.index.search(question)]
+            other_ids = sorted(
+                set(self.examples) - set(matched_ids),
+                key=lambda example_id: self.examples[example_id]["updated_at"],
+                reverse=True,
+            )
+            selected = []
+            total_tokens = 0
+            for example_id in [*matched_ids, *other_ids]:
+                example = self.examples[example_id]
+                if total_tokens + example["tokens"] > token_budget:
+                    continue
+                selected.append(example)
+                total_tokens += example["tokens"]
+                if len(selected) >= top_k:
+                    break
+            return selected
+
+
+_indexes = LRUCache(maxsize=EXAMPLE_INDEX_CACHE_SIZE)
+_indexes_lock = threading.Lock()
+
+
+def get_example_index(application_id) -> FineTuningExampleIndex:
+    with _indexes_lock:
+        index = _indexes.get(str(application_id))
+        if index is None:
+            index = FineTuningExampleIndex(application_id)
+            _indexes.set(str(application_id), index)
+        return index
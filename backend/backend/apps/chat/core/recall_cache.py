@@ -0,0 +1,50 @@
+import hashlib
+import json
+
+from backend.apps.chat.core.sql_cache import normalize_question
+from backend.settings.env import ENV
+from backend.utils.llm import get_schema_version
+from backend.utils.memory_cache import LRUCache
+
+DEFAULT_SCHEMA_RECALL_CACHE_SIZE = 1024
+DEFAULT_SCHEMA_RECALL_CACHE_TTL = 60 * 60
+
+_recall_cache = LRUCache(
+    maxsize=int(ENV.SCHEMA_RECALL_CACHE_SIZE or DEFAULT_SCHEMA_RECALL_CACHE_SIZE),
+    ttl=int(ENV.SCHEMA_RECALL_CACHE_TTL or DEFAULT_SCHEMA_RECALL_CACHE_TTL),
+)
+
+
+def _get_key(application, question: str, prompt: str) -> tuple:
+    agent_configuration = application.agent_configuration or {}
+    # Any recall setting, e.g. rag_method or schema_top_k, changes the recalled tables
+    options = {
+        key: value
+        for key, value in agent_configuration.items()
+        if key.startswith(("rag_", "schema_"))
+    }
+    digest = hashlib.sha1(
+        "\n".join(
+            [
+                json.dumps(options, sort_keys=True, default=str),
+                prompt or "",
+                normalize_question(question),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    return str(application.id), get_schema_version(application.id), digest
+
+
+def get_recalled_schema(application, question: str, prompt: str = "") -> dict | None:
+    """
+    Get the tables recalled for a question before, while the schema and recall settings are unchanged
+    :param application: Application
+    :param question: User question
+    :param prompt: Schema RAG prompt of the application
+    :return: Recalled tables and their recall scores
+    """
+    return _recall_cache.get(_get_key(application, question, prompt))
+
+
+def set_recalled_schema(application, question: str, recalled: dict, prompt: str = ""):
+    _recall_cache.set(_get_key(application, question, prompt), recalled)
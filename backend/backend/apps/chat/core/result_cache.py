@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import zlib
+
+from django.core.cache import cache
+
+from backend.apps.application.core.database import DatabaseExecutor, EngineRegistry
+from backend.apps.application.models import ApplicationTable
+from backend.apps.chat.core.sql_validator import tokenize_sql
+from backend.settings.env import ENV
+from backend.utils.llm import get_schema_version
+from backend.utils.memory_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_RESULT_CACHE_TTL = 5 * 60
+# Applications whose table checksums are kept in each worker
+TABLE_CHECKSUM_CACHE_SIZE = 256
+
+# Functions whose results change between runs of the same query
+NONDETERMINISTIC_FUNCTIONS = {
+    "CONNECTION_ID",
+    "CURDATE",
+    "CURRENT_DATE",
+    "CURRENT_TIME",
+    "CURRENT_TIMESTAMP",
+    "CURRENT_USER",
+    "CURTIME",
+    "FOUND_ROWS",
+    "LAST_INSERT_ID",
+    "LOCALTIME",
+    "LOCALTIMESTAMP",
+    "NOW",
+    "RAND",
+    "ROW_COUNT",
+    "SYSDATE",
+    "UNIX_TIMESTAMP",
+    "UTC_DATE",
+    "UTC_TIME",
+    "UTC_TIMESTAMP",
+    "UUID",
+    "UUID_SHORT",
+}
+
+_table_checksums = LRUCache(maxsize=TABLE_CHECKSUM_CACHE_SIZE)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize SQL for cache lookups: whitespace, comments, trailing semicolons, keyword case
+    and quoting of names are ignored
+    """
+    tokens = tokenize_sql(sql or "")
+    if tokens is None:
+        return " ".join((sql or "").split()).rstrip(";")
+    while tokens and tokens[-1].kind == "punct" and tokens[-1].value == ";":
+        tokens.pop()
+    parts = []
+    for token in tokens:
+        if token.is_name:
+            parts.append(f"`{token.value}`")
+        elif token.kind == "word":
+            parts.append(token.upper)
+        else:
+            parts.append(token.value)
+    return " ".join(parts)
+
+
+def is_deterministic(sql: str) -> bool:
+    """
+    Whether a query returns the same rows for the same data, e.g. not relative to the
+    current time. Names like the functions are also treated as calls.
+    """
+    tokens = tokenize_sql(sql or "")
+    if tokens is None:
+        return False
+    return not any(
+        token.kind == "word" and token.upper in NONDETERMINISTIC_FUNCTIONS
+        for token in tokens
+    )
+
+
+def _get_table_checksums(application_id) -> dict:
+    """
+    Definition checksums of the tables of an application by lowercase name, recorded by the
+    last schema sync. Tables synced without a checksum fall back to the schema version.
+    """
+    schema_version = get_schema_version(application_id)
+    key = (str(application_id), schema_version)
+    checksums = _table_checksums.get(key)
+    if checksums is None:
+        checksums = {
+            name.lower(): checksum or f"schema:{schema_version}"
+            for name, checksum in ApplicationTable.objects.filter(
+                application_id=application_id
+            ).values_list("name", "checksum")
+        }
+        _table_checksums.set(key, checksums)
+    return checksums
+
+
+class QueryResultCache:
+    """
+    Per-application cache of query results by normalized SQL, stored compressed in the
+    shared cache. An entry records the checksums of the tables it read, so a schema sync
+    that changes a table only invalidates the results of that table. Data changes are
+    detected from the update times of the tables if check_updates is set, otherwise
+    entries are read until their TTL ends.
+    """
+
+    def __init__(self, application):
+        self.application_id = application.id
+        self.database_configuration = application.database_configuration
+        agent_configuration = application.agent_configuration or {}
+        ttl = agent_configuration.get("result_cache_ttl")
+        if ttl is None:
+            ttl = ENV.QUERY_RESULT_CACHE_TTL or DEFAULT_QUERY_RESULT_CACHE_TTL
+        # Seconds a result is kept, 0 disables the cache
+        self.ttl = int(ttl)
+        self.check_updates = bool(
+            agent_configuration.get("result_cache_check_updates", False)
+        )
+        # Update times of the tables read before the query ran, None if unknown
+        self._update_times: dict | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _get_key(self, sql: str) -> str:
+        # Results also depend on the database and on the row and byte limits
+        digest = hashlib.sha1(
+            "\n".join(
+                [
+                    EngineRegistry.fingerprint(self.database_configuration),
+                    str(ENV.MAX_RESULT_COUNT_FOR_DISPLAY_RESULT),
+                    str(ENV.MAX_RESULT_BYTES_FOR_QUERY_RESULT),
+                    normalize_sql(sql),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+        return f"query_result:{self.application_id}:{digest}"
+
+    @staticmethod
+    def _get_tables(sql: str, checksums: dict) -> dict:
+        """
+        Tables of the application named in a query with their checksums, a column or alias
+        named like a table only invalidates the entry more often
+        """
+        tokens = tokenize_sql(sql) or []
+        return {
+            token.value.lower(): checksums[token.value.lower()]
+            for token in tokens
+            if token.kind == "word" and token.value.lower() in checksums
+        }
+
+    def _fetch_update_times(self, table_names: set[str]) -> dict | None:
+        try:
+            update_times = DatabaseExecutor(
+                self.database_configuration, application_id=self.application_id
+            ).get_table_update_times(sorted(table_names))
+        except Exception:
+            logger.warning("Failed to read table update times", exc_info=True)
+            return None
+        return {
+            name.lower(): update_time.isoformat() if update_time else None
+            for name, update_time in update_times.items()
+        }
+
+    def get(self, sql_list: list[str]) -> dict | None:
+        """
+        Get the cached result of the first query of the list that has one
+        :return: query_result, valid_sql and result_info
+        """
+        self._update_times = None
+        sql_list = [sql for sql in sql_list if is_deterministic(sql)]
+        if not self.enabled or not sql_list:
+            return None
+        checksums = _get_table_checksums(self.application_id)
+        keys = [self._get_key(sql) for sql in sql_list]
+        entries = cache.get_many(keys)
+        if self.check_updates:
+            table_names = set()
+            for sql in sql_list:
+                table_names.update(self._get_tables(sql, checksums))
+            self._update_times = self._fetch_update_times(table_names)
+            if self._update_times is None:
+                return None
+        for key in keys:
+            if key not in entries:
+                continue
+            entry = json.loads(zlib.decompress(entries[key]))
+            tables = entry["tables"]
+            if any(checksums.get(name) != checksum for name, checksum in tables.items()):
+                cache.delete(key)
+                continue
+            if self.check_updates and any(
+                self._update_times.get(name) != entry["update_times"].get(name)
+                for name in tables
+            ):
+                cache.delete(key)
+                continue
+            return {
+                "query_result": entry["query_result"],
+                "valid_sql": entry["valid_sql"],
+                "result_info": entry["result_info"],
+            }
+        return None
+
+    def set(self, sql: str, query_result: str, valid_sql: str, result_info: dict):
+        """
+        Cache the result of a query, unless it depends on the time or random values
+        :param sql: Query as generated, the key of the entry
+        :param valid_sql: Query that ran, e.g. rewritten by the cost guard
+        """
+        if not self.enabled or query_result is None:
+            return
+        if not is_deterministic(valid_sql):
+            # Includes time windows added by the cost guard
+            return
+        if self.check_updates and self._update_times is None:
+            # Without the update times from before the query ran, a change could be missed
+            return
+        tables = self._get_tables(sql, _get_table_checksums(self.application_id))
+        entry = {
+            "tables": tables,
+            "update_times": (
+                {name: self._update_times.get(name) for name in tables}
+                if self.check_updates
+                else {}
+            ),
+            "query_result": query_result,
+            "valid_sql": valid_sql,
+            "result_info": result_info,
+        }
+        cache.set(
+            self._get_key(sql),
+            zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8")),
+            self.ttl,
+        )
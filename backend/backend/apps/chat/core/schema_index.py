@@ -0,0 +1,141 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from backend.settings.env import ENV
+from backend.utils.llm import create_application_schema, get_schema_version
+from backend.utils.vector_index import BUILD_DIR_PREFIX, VectorIndex, get_embedder
+
+DEFAULT_SCHEMA_TOP_K = 8
+# Applications whose index stays mapped in each worker
+SCHEMA_INDEX_CACHE_SIZE = 64
+# Best matching columns reported per recalled table
+SCHEMA_MATCHED_COLUMNS = 5
+# Best rows aggregated into tables per requested table, a table has a row per column
+SCHEMA_SEARCH_ROWS_PER_TABLE = 20
+# Seconds after which a build directory is left over from a worker that died
+STALE_BUILD_DIR_AGE = 60 * 60
+
+
+def get_schema_index_dir() -> str:
+    return ENV.SCHEMA_INDEX_DIR or os.path.join(settings.BASE_DIR, "data", "schema_index")
+
+
+def _get_table_text(table: dict) -> str:
+    column_names = " ".join(column["name"] for column in table["columns"])
+    return f"{table['table']} {table.get('comment') or ''} {column_names}"
+
+
+def _get_column_text(table: dict, column: dict) -> str:
+    return f"{table['table']} {column['name']} {column.get('comment') or ''}"
+
+
+class SchemaVectorIndex:
+    """
+    Vectors of the enabled tables and columns of one application, one row per table and per column.
+    The index is built on first use of a schema version and kept on disk, so other workers
+    and restarts only map the file.
+    """
+
+    def __init__(self, application_id, embedder=None):
+        self.application_id = application_id
+        self.embedder = embedder or get_embedder()
+        self.lock = threading.Lock()
+        self.index: VectorIndex | None = None
+        self.version = None
+
+    def _get_app_dir(self) -> str:
+        return os.path.join(get_schema_index_dir(), str(self.application_id))
+
+    def _build(self, path: str) -> VectorIndex:
+        schema, _ = create_application_schema(self.application_id)
+        texts, rows = [], []
+        for table in schema:
+            texts.append(_get_table_text(table))
+            rows.append([table["table"], None])
+            for column in table["columns"]:
+                texts.append(_get_column_text(table, column))
+                rows.append([table["table"], column["name"]])
+        vectors = self.embedder(texts) if texts else np.zeros((0, 1), dtype=np.float32)
+        index = VectorIndex.build(path, vectors, rows)
+        self._remove_old_indexes(path)
+        return index
+
+    def _remove_old_indexes(self, path: str):
+        """
+        Remove indexes finished before the current one, they belong to older schema versions
+        or other embedders. Directories of builds running in other workers and indexes built
+        since are kept.
+        """
+        app_dir = self._get_app_dir()
+        try:
+            built_at = os.stat(path).st_mtime
+        except OSError:
+            return
+        for name in os.listdir(app_dir):
+            other_path = os.path.join(app_dir, name)
+            try:
+                modified_at = os.stat(other_path).st_mtime
+            except OSError:
+                continue
+            if other_path == path or not os.path.isdir(other_path):
+                continue
+            if name.startswith(BUILD_DIR_PREFIX):
+                if modified_at < built_at - STALE_BUILD_DIR_AGE:
+                    shutil.rmtree(other_path, ignore_errors=True)
+            elif modified_at < built_at:
+                shutil.rmtree(other_path, ignore_errors=True)
+
+    def sync(self):
+        version = get_schema_version(self.application_id)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            path = os.path.join(self._get_app_dir(), f"{self.embedder.name}-{version}")
+            self.index = VectorIndex.load(path) or self._build(path)
+            self.version = version
+
+    def search(self, question: str, top_k: int = DEFAULT_SCHEMA_TOP_K) -> list[dict]:
+        """
+        Get the tables most similar to a question, scored by the table itself or its best column
+        :param question: User question
+        :param top_k: Maximum number of tables
+        :return: Tables with score and the best matching columns, best first,
+            no tables if nothing matches
+        """
+        self.sync()
+        index = self.index
+        query = self.embedder([question])[0]
+        tables: dict = {}
+        for (table, column), score in index.search(
+            query, top_k=top_k * SCHEMA_SEARCH_ROWS_PER_TABLE, min_score=0
+        ):
+            item = tables.setdefault(table, {"table": table, "score": score, "columns": []})
+            if column and len(item["columns"]) < SCHEMA_MATCHED_COLUMNS:
+                item["columns"].append(column)
+        # Rows come best first, so tables are already ordered by their best row
+        return list(tables.values())[:top_k]
+
+
+_indexes: OrderedDict = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_schema_index(application_id) -> SchemaVectorIndex:
+    with _indexes_lock:
+        key = str(application_id)
+        index = _indexes.get(key)
+        if index is None:
+            index = SchemaVectorIndex(application_id)
+            _indexes[key] = index
+            if len(_indexes) > SCHEMA_INDEX_CACHE_SIZE:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
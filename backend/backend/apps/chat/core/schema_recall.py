@@ -0,0 +1,268 @@
+import threading
+from collections import OrderedDict
+
+from backend.apps.application.models import ApplicationTable, ApplicationTableColumn
+from backend.apps.chat.core.schema_index import DEFAULT_SCHEMA_TOP_K, get_schema_index
+from backend.utils.bm25 import BM25Index
+from backend.utils.llm import (
+    create_application_ddl,
+    create_application_schema,
+    get_llm_tokens,
+    get_schema_version,
+)
+
+DEFAULT_SCHEMA_TOKEN_BUDGET = 4096
+DEFAULT_SCHEMA_VECTOR_WEIGHT = 0.5
+DEFAULT_SCHEMA_GRAPH_HOPS = 1
+# Score of a related table relative to the table it was reached from
+RELATED_TABLE_SCORE_DECAY = 0.5
+# Matched tables scoring below this fraction of the best table are noise, not recalled
+MIN_RELATIVE_SCORE = 0.2
+SCHEMA_RECALL_CACHE_SIZE = 64
+
+RELATION_FOREIGN_KEY = "foreign_key"
+RELATION_KEY_NAME = "key_name"
+
+
+def _get_table_text(table: dict, database_comments: dict) -> str:
+    """
+    Names, AI comments and comments in the database of a table and its columns
+    :param database_comments: Comments in the database by table name and by (table, column) name
+    """
+    parts = [
+        table["table"],
+        table.get("comment") or "",
+        database_comments.get(table["table"]) or "",
+    ]
+    for column in table["columns"]:
+        parts.extend(
+            [
+                column["name"],
+                column.get("comment") or "",
+                database_comments.get((table["table"], column["name"])) or "",
+            ]
+        )
+    return " ".join(parts)
+
+
+def _get_database_comments(application_id) -> dict:
+    """
+    Comments of the tables and columns in the database, the schema only has the AI comments
+    """
+    comments = dict(
+        ApplicationTable.objects.filter(
+            application_id=application_id, is_enabled=True
+        ).values_list("name", "comment")
+    )
+    for table_name, column_name, comment in ApplicationTableColumn.objects.filter(
+        table__application_id=application_id, table__is_enabled=True, is_enabled=True
+    ).values_list("table__name", "name", "comment"):
+        comments[(table_name, column_name)] = comment
+    return comments
+
+
+def _get_referenced_table_names(column_name: str) -> list[str]:
+    """
+    Tables a key column may refer to by its name, customer_id -> customer, customers
+    """
+    base = column_name[:-3]
+    names = [base, f"{base}s", f"{base}es"]
+    if base.endswith("y"):
+        names.append(f"{base[:-1]}ies")
+    return names
+
+
+def _build_graph(schema: list[dict], foreign_keys: dict) -> dict:
+    """
+    Relationships between tables, from declared foreign keys and from key column names
+    :param schema: Application schema
+    :param foreign_keys: Foreign keys by table name
+    :return: Related tables and relation of each table
+    """
+    graph: dict = {table["table"]: {} for table in schema}
+    # Names in foreign keys and key columns may differ in case from the table names
+    table_names = {name.lower(): name for name in graph}
+
+    def add_edge(table, other, relation):
+        other = table_names.get(other.lower())
+        if other is None or table == other:
+            return
+        # A declared foreign key wins over a guessed one
+        if graph[table].get(other) != RELATION_FOREIGN_KEY:
+            graph[table][other] = relation
+            graph[other][table] = relation
+
+    for table_name, table_foreign_keys in foreign_keys.items():
+        if table_name not in graph:
+            continue
+        for foreign_key in table_foreign_keys:
+            add_edge(table_name, foreign_key["referenced_table"], RELATION_FOREIGN_KEY)
+
+    primary_keys: dict = {}
+    for table in schema:
+        for column in table["columns"]:
+            if column["key"] == "PRI" and column["name"].lower() != "id":
+                primary_keys.setdefault(column["name"].lower(), []).append(
+                    table["table"]
+                )
+    for table in schema:
+        for column in table["columns"]:
+            name = column["name"].lower()
+            if name.endswith("_id"):
+                for other in _get_referenced_table_names(name):
+                    add_edge(table["table"], other, RELATION_KEY_NAME)
+            if column["key"] and column["key"] != "PRI":
+                # Key column sharing the name of another table's primary key
+                for other in primary_keys.get(name, []):
+                    add_edge(table["table"], other, RELATION_KEY_NAME)
+    return graph
+
+
+class SchemaRecallIndex:
+    """
+    Hybrid table recall for one application: BM25 over table and column names and comments,
+    blended with the similarity of the local schema vector index, then expanded to related
+    tables, so the tables needed to join recalled tables come along
+    """
+
+    def __init__(self, application_id):
+        self.application_id = application_id
+        self.lock = threading.Lock()
+        self.index = BM25Index()
+        self.graph: dict = {}
+        self.table_tokens: dict = {}
+        self.version = None
+
+    def sync(self):
+        version = get_schema_version(self.application_id)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            schema, _ = create_application_schema(self.application_id)
+            ddl_list, _ = create_application_ddl(self.application_id)
+            foreign_keys = dict(
+                ApplicationTable.objects.filter(
+                    application_id=self.application_id, is_enabled=True
+                ).values_list("name", "foreign_keys")
+            )
+            database_comments = _get_database_comments(self.application_id)
+            index = BM25Index()
+            for table in schema:
+                index.add(table["table"], _get_table_text(table, database_comments))
+            self.index = index
+            self.graph = _build_graph(schema, foreign_keys)
+            self.table_tokens = {
+                table["table"]: get_llm_tokens(ddl, approximate=True)
+                for table, ddl in zip(schema, ddl_list)
+            }
+            self.version = version
+
+    def search(
+        self,
+        question: str,
+        top_k: int = DEFAULT_SCHEMA_TOP_K,
+        token_budget: int = DEFAULT_SCHEMA_TOKEN_BUDGET,
+        vector_weight: float = DEFAULT_SCHEMA_VECTOR_WEIGHT,
+        hops: int = DEFAULT_SCHEMA_GRAPH_HOPS,
+    ) -> list[dict]:
+        """
+        Get the tables relevant to a question
+        :param question: User question
+        :param top_k: Maximum number of directly matched tables
+        :param token_budget: Maximum DDL tokens of all recalled tables, the best table is always kept
+        :param vector_weight: Weight of the vector score, 1 - vector_weight is the weight of BM25
+        :param hops: Relationship steps followed from matched tables
+        :return: Tables with score, bm25 and vector scores, and the table and relation
+            they were reached through, matched tables first
+        """
+        self.sync()
+        with self.lock:
+            lexical = dict(self.index.search(question))
+        vector = {
+            item["table"]: item["score"]
+            for item in get_schema_index(self.application_id).search(
+                question, top_k=top_k * 2
+            )
+        }
+        max_lexical = max(lexical.values(), default=0) or 1
+        candidates = []
+        for table in set(lexical) | set(vector):
+            bm25 = lexical.get(table, 0.0) / max_lexical
+            score = (1 - vector_weight) * bm25 + vector_weight * vector.get(table, 0.0)
+            if score > 0:
+                candidates.append(
+                    {
+                        "table": table,
+                        "score": round(score, 4),
+                        "bm25": round(bm25, 4),
+                        "vector": round(vector.get(table, 0.0), 4),
+                        "via": None,
+                    }
+                )
+        candidates.sort(key=lambda item: (-item["score"], item["table"]))
+        matched = {item["table"]: item for item in candidates}
+
+        selected: dict = {}
+        total_tokens = 0
+
+        def select(item) -> bool:
+            nonlocal total_tokens
+            tokens = self.table_tokens.get(item["table"], 0)
+            if selected and total_tokens + tokens > token_budget:
+                return False
+            selected[item["table"]] = item
+            total_tokens += tokens
+            return True
+
+        for item in candidates[:top_k]:
+            if item["score"] < candidates[0]["score"] * MIN_RELATIVE_SCORE:
+                break
+            select(item)
+        frontier = list(selected.values())
+        for _ in range(hops):
+            related: dict = {}
+            for item in frontier:
+                for other, relation in self.graph.get(item["table"], {}).items():
+                    score = round(item["score"] * RELATED_TABLE_SCORE_DECAY, 4)
+                    if other in matched:
+                        # Matched on its own below top_k, keep its better score
+                        score = max(score, matched[other]["score"])
+                    if other in selected or related.get(other, {}).get("score", -1) >= score:
+                        continue
+                    related[other] = {
+                        "table": other,
+                        "score": score,
+                        "bm25": matched.get(other, {}).get("bm25", 0.0),
+                        "vector": matched.get(other, {}).get("vector", 0.0),
+                        "via": {"table": item["table"], "relation": relation},
+                    }
+            frontier = [
+                item
+                for item in sorted(
+                    related.values(), key=lambda item: (-item["score"], item["table"])
+                )
+                if select(item)
+            ]
+            if not frontier:
+                break
+        return list(selected.values())
+
+
+_indexes: OrderedDict = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_schema_recall_index(application_id) -> SchemaRecallIndex:
+    with _indexes_lock:
+        key = str(application_id)
+        index = _indexes.get(key)
+        if index is None:
+            index = SchemaRecallIndex(application_id)
+            _indexes[key] = index
+            if len(_indexes) > SCHEMA_RECALL_CACHE_SIZE:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
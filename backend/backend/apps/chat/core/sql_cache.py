@@ -0,0 +1,142 @@
+import hashlib
+import math
+import re
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+
+from backend.utils.llm import get_schema_version
+
+SQL_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+# Maximum number of questions per application kept for similarity lookups
+SQL_CACHE_INDEX_SIZE = 500
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for cache lookups: case, whitespace and trailing punctuation are ignored
+    """
+    question = re.sub(r"\s+", " ", question or "").strip().lower()
+    return question.rstrip("?？.。!！ ")
+
+
+def _get_question_vector(question: str) -> Counter:
+    # Character trigrams work for both latin and CJK questions
+    text = f"  {question} "
+    return Counter(text[i : i + 3] for i in range(len(text) - 2))
+
+
+def _get_similarity(vector: Counter, other_vector: Counter) -> float:
+    dot = sum(count * other_vector[gram] for gram, count in vector.items())
+    if not dot:
+        return 0.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) * math.sqrt(
+        sum(v * v for v in other_vector.values())
+    )
+    return dot / norm
+
+
+def get_question_similarity(question: str, other_question: str) -> float:
+    """
+    Character trigram cosine similarity of two normalized questions, 1 if they are equal
+    """
+    question = normalize_question(question)
+    other_question = normalize_question(other_question)
+    if question == other_question:
+        return 1.0
+    return _get_similarity(
+        _get_question_vector(question), _get_question_vector(other_question)
+    )
+
+
+def _get_sql_cache_version_key(application_id) -> str:
+    return f"question_sql_version:{application_id}"
+
+
+def bump_sql_cache_version(application_id):
+    """
+    Invalidate every cached SQL of an application, e.g. when its prompts or model change
+    """
+    cache.set(_get_sql_cache_version_key(application_id), uuid.uuid4().hex, None)
+
+
+class QuestionSQLCache:
+    """
+    Per-application cache of the validated SQL for a (rewritten) question.
+    Keys include the schema version and a version bumped when prompts or the enabled
+    fine-tuning model change, so stale entries are never read.
+    """
+
+    def __init__(self, application):
+        self.application_id = application.id
+        agent_configuration = application.agent_configuration or {}
+        self.enabled = agent_configuration.get("sql_cache_enabled", True)
+        # Near-duplicate lookup is off unless a similarity threshold (0-1) is configured
+        self.similarity_threshold = agent_configuration.get(
+            "sql_cache_similarity_threshold"
+        )
+        self._namespace = None
+
+    def _get_namespace(self) -> str:
+        if self._namespace is None:
+            version_key = _get_sql_cache_version_key(self.application_id)
+            version = cache.get(version_key)
+            if version is None:
+                cache.add(version_key, uuid.uuid4().hex, None)
+                version = cache.get(version_key)
+            schema_version = get_schema_version(self.application_id)
+            self._namespace = f"{self.application_id}:{schema_version}:{version}"
+        return self._namespace
+
+    def _get_key(self, question: str) -> str:
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()
+        return f"question_sql:{self._get_namespace()}:{digest}"
+
+    def _get_index_key(self) -> str:
+        return f"question_sql_index:{self._get_namespace()}"
+
+    def get(self, question: str) -> str | None:
+        """
+        Get the cached SQL of a question, or of the most similar cached question
+        """
+        if not self.enabled:
+            return None
+        question = normalize_question(question)
+        if not question:
+            return None
+        sql = cache.get(self._get_key(question))
+        if sql or not self.similarity_threshold:
+            return sql
+        vector = _get_question_vector(question)
+        best_similarity, best_question = 0.0, None
+        for cached_question in cache.get(self._get_index_key(), []):
+            similarity = _get_similarity(
+                vector, _get_question_vector(cached_question)
+            )
+            if similarity > best_similarity:
+                best_similarity, best_question = similarity, cached_question
+        if best_question and best_similarity >= float(self.similarity_threshold):
+            return cache.get(self._get_key(best_question))
+        return None
+
+    def set(self, question: str, sql: str):
+        if not self.enabled:
+            return
+        question = normalize_question(question)
+        if not question or not sql:
+            return
+        cache.set(self._get_key(question), sql, SQL_CACHE_TIMEOUT)
+        if self.similarity_threshold:
+            index = [
+                item for item in cache.get(self._get_index_key(), []) if item != question
+            ]
+            index.append(question)
+            cache.set(
+                self._get_index_key(), index[-SQL_CACHE_INDEX_SIZE:], SQL_CACHE_TIMEOUT
+            )
+
+    def delete(self, question: str):
+        question = normalize_question(question)
+        if question:
+            cache.delete(self._get_key(question))
@@ -0,0 +1,184 @@
+from backend.apps.chat.core.sql_validator import (
+    AGGREGATE_FUNCTIONS,
+    JOIN_MODIFIERS,
+    SELECT_CLAUSES,
+    SET_OPERATORS,
+    SQLToken,
+    tokenize_sql,
+)
+
+# Clauses that end the WHERE clause of a SELECT
+WHERE_END_CLAUSES = set(SELECT_CLAUSES) - {"FROM", "WHERE"}
+
+
+def _get_top_level_tokens(sql: str) -> list[tuple[int, SQLToken]] | None:
+    """
+    Tokens outside of parentheses with their indexes, None if the SQL can't be tokenized
+    """
+    tokens = tokenize_sql(sql)
+    if tokens is None:
+        return None
+    while tokens and tokens[-1].kind == "punct" and tokens[-1].value == ";":
+        tokens.pop()
+    top_level = []
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.kind == "punct" and token.value == ")":
+            depth -= 1
+        if depth == 0:
+            top_level.append((index, token))
+        if token.kind == "punct" and token.value == "(":
+            depth += 1
+    if depth != 0:
+        return None
+    return top_level
+
+
+def _is_single_select(top_level: list[tuple[int, SQLToken]]) -> bool:
+    return bool(top_level) and top_level[0][1].upper == "SELECT" and not any(
+        token.kind == "word" and token.upper.startswith(SET_OPERATORS)
+        for _, token in top_level
+    )
+
+
+def _strip(sql: str, top_level: list[tuple[int, SQLToken]]) -> str:
+    # Trailing semicolons, comments and whitespace only, token positions stay valid
+    return sql[: top_level[-1][1].end]
+
+
+def is_streamable(sql: str) -> bool:
+    """
+    Whether the server can stop a query after its first rows: a single SELECT without
+    grouping, sorting, aggregates, window functions or subqueries that are read in full
+    """
+    top_level = _get_top_level_tokens(sql)
+    if not top_level or not _is_single_select(top_level):
+        return False
+    tokens = tokenize_sql(sql)
+    for index, token in enumerate(tokens):
+        if token.kind != "word":
+            continue
+        if token.upper in ("SELECT", "WITH") and index > 0:
+            return False
+    for index, token in top_level:
+        if token.kind != "word":
+            continue
+        if token.upper in (
+            "GROUP BY",
+            "ORDER BY",
+            "HAVING",
+            "WINDOW",
+            "DISTINCT",
+            "DISTINCTROW",
+            "OVER",
+        ):
+            return False
+        if token.upper in AGGREGATE_FUNCTIONS and index + 1 < len(tokens):
+            following = tokens[index + 1]
+            if following.kind == "punct" and following.value == "(":
+                return False
+    return True
+
+
+def add_limit(sql: str, limit: int) -> str | None:
+    """
+    Limit the rows of a query, a smaller LIMIT of the query is kept
+    :return: Rewritten SQL, None if it can't be rewritten
+    """
+    top_level = _get_top_level_tokens(sql)
+    if not top_level or not _is_single_select(top_level):
+        return None
+    sql = _strip(sql, top_level)
+    for position, (_, token) in enumerate(top_level):
+        if token.upper in ("INTO", "FOR", "FOR UPDATE", "LOCK", "LOCK IN SHARE MODE"):
+            return None
+        if token.upper != "LIMIT":
+            continue
+        numbers = [item for _, item in top_level[position + 1 :] if item.kind == "number"]
+        if not numbers:
+            return None
+        # LIMIT count, LIMIT offset, count or LIMIT count OFFSET offset
+        after_comma = any(item.value == "," for _, item in top_level[position + 1 :])
+        count = numbers[1] if after_comma and len(numbers) > 1 else numbers[0]
+        if not count.value.isdigit():
+            return None
+        if int(count.value) <= limit:
+            return sql
+        return f"{sql[: count.start]}{limit}{sql[count.end :]}"
+    return f"{sql} LIMIT {limit}"
+
+
+def get_table_aliases(sql: str) -> dict[str, str]:
+    """
+    Tables of the FROM clause of the outermost SELECT
+    :return: Table names by lowercase alias, or by name for tables without alias
+    """
+    top_level = _get_top_level_tokens(sql)
+    if not top_level or not _is_single_select(top_level):
+        return {}
+    aliases = {}
+    in_from = False
+    expect_table = False
+    for position, (_, token) in enumerate(top_level):
+        if token.kind == "word" and token.upper in SELECT_CLAUSES:
+            in_from = token.upper == "FROM"
+            expect_table = in_from
+            continue
+        if not in_from:
+            continue
+        if token.kind == "punct" and token.value == ",":
+            expect_table = True
+        elif token.kind == "word" and (
+            token.upper.endswith("JOIN") or token.upper in JOIN_MODIFIERS
+        ):
+            expect_table = True
+        elif expect_table and token.kind == "word":
+            expect_table = False
+            following = [item for _, item in top_level[position + 1 : position + 4]]
+            name = token.value
+            if following[:1] and following[0].value == ".":
+                # Table of another database
+                continue
+            alias = name
+            if following[:1] and following[0].upper == "AS":
+                following = following[1:]
+            if following[:1] and following[0].kind == "word" and following[0].is_name:
+                alias = following[0].value
+            aliases[alias.lower()] = name
+        elif expect_table:
+            expect_table = False
+    return aliases
+
+
+def add_time_window(sql: str, qualifier: str, column: str, days: int) -> str | None:
+    """
+    Only read the rows of the last days of a table of the outermost SELECT
+    :param qualifier: Alias or name of the table in the query
+    :param column: Date or time column of the table
+    :param days: Days of rows kept
+    :return: Rewritten SQL, None if it can't be rewritten
+    """
+    top_level = _get_top_level_tokens(sql)
+    if not top_level or not _is_single_select(top_level):
+        return None
+    sql = _strip(sql, top_level)
+    predicate = f"`{qualifier}`.`{column}` >= NOW() - INTERVAL {int(days)} DAY"
+    where = None
+    # End of the last token before the clauses after WHERE, comments after it are dropped
+    # so that they can't comment out the predicate
+    condition_end = end = len(sql)
+    for position, (_, token) in enumerate(top_level):
+        if token.kind != "word":
+            continue
+        if token.upper == "WHERE":
+            where = token
+        elif token.upper in WHERE_END_CLAUSES:
+            end = token.start
+            condition_end = top_level[position - 1][1].end
+            break
+    if where is None:
+        if not any(token.upper == "FROM" for _, token in top_level):
+            return None
+        return f"{sql[:condition_end]} WHERE {predicate} {sql[end:]}".rstrip()
+    condition = sql[where.end : condition_end].strip()
+    return f"{sql[: where.end]} {predicate} AND ({condition}) {sql[end:]}".rstrip()
@@ -0,0 +1,1058 @@
+import difflib
+import re
+from enum import Enum
+
+from sqlparse.keywords import KEYWORDS, KEYWORDS_COMMON, KEYWORDS_MYSQL
+
+from backend.utils.llm import create_application_schema, get_schema_version
+from backend.utils.memory_cache import LRUCache
+
+SQL_VALIDATOR_CACHE_SIZE = 64
+# Columns listed in an unknown column error, so the model can pick the right one
+MAX_SUGGESTED_COLUMNS = 30
+
+AGGREGATE_FUNCTIONS = {
+    "AVG",
+    "BIT_AND",
+    "BIT_OR",
+    "BIT_XOR",
+    "COUNT",
+    "GROUP_CONCAT",
+    "JSON_ARRAYAGG",
+    "JSON_OBJECTAGG",
+    "MAX",
+    "MIN",
+    "STD",
+    "STDDEV",
+    "STDDEV_POP",
+    "STDDEV_SAMP",
+    "SUM",
+    "VAR_POP",
+    "VAR_SAMP",
+    "VARIANCE",
+}
+# Functions whose arguments may be nonaggregated columns, without aggregating the query
+GROUP_BY_EXEMPT_FUNCTIONS = {"ANY_VALUE"}
+SELECT_CLAUSES = {
+    "FROM": "from clause",
+    "WHERE": "where clause",
+    "GROUP BY": "group statement",
+    "HAVING": "having clause",
+    "WINDOW": "window clause",
+    "ORDER BY": "order clause",
+    "LIMIT": "limit clause",
+    "INTO": "into clause",
+    "FOR": "for clause",
+    "FOR UPDATE": "for clause",
+    "LOCK": "lock clause",
+    "LOCK IN SHARE MODE": "lock clause",
+}
+SELECT_MODIFIERS = {
+    "ALL",
+    "DISTINCT",
+    "DISTINCTROW",
+    "HIGH_PRIORITY",
+    "STRAIGHT_JOIN",
+    "SQL_SMALL_RESULT",
+    "SQL_BIG_RESULT",
+    "SQL_BUFFER_RESULT",
+    "SQL_NO_CACHE",
+    "SQL_CALC_FOUND_ROWS",
+}
+JOIN_MODIFIERS = {"INNER", "CROSS", "LEFT", "RIGHT", "OUTER", "NATURAL", "FULL"}
+INDEX_HINTS = {"USE", "IGNORE", "FORCE"}
+# The word after these is a name of something else than a column, e.g. CONVERT(x USING utf8mb4)
+NON_COLUMN_PREFIXES = {
+    "AS",
+    "USING",
+    "COLLATE",
+    "SET",
+    "CHARSET",
+    "CHARACTER SET",
+    # Named windows, OVER w
+    "OVER",
+}
+SET_OPERATORS = ("UNION", "INTERSECT", "EXCEPT")
+# Statements and clauses that write or lock, INSERT() and REPLACE() are also functions
+WRITE_KEYWORDS = {
+    "INSERT",
+    "UPDATE",
+    "DELETE",
+    "REPLACE",
+    "INTO",
+    "FOR UPDATE",
+    "LOCK IN SHARE MODE",
+}
+# MySQL keywords missing from the keywords of sqlparse
+NAME_KEYWORDS = {
+    "AGAINST",
+    "ASC",
+    "CURDATE",
+    "DATETIME",
+    "DAY_HOUR",
+    "DAY_MICROSECOND",
+    "DAY_MINUTE",
+    "DAY_SECOND",
+    "DESC",
+    "DOUBLE",
+    "DUAL",
+    "EXPANSION",
+    "FOLLOWING",
+    "HOUR_MICROSECOND",
+    "HOUR_MINUTE",
+    "HOUR_SECOND",
+    "JSON",
+    "LOCKED",
+    "MEMBER",
+    "MICROSECOND",
+    "MINUTE_MICROSECOND",
+    "MINUTE_SECOND",
+    "NULLS",
+    "OVER",
+    "PARTITION",
+    "PRECEDING",
+    "QUERY",
+    "RANGE",
+    "REGEXP",
+    "RLIKE",
+    "SECOND_MICROSECOND",
+    "SEPARATOR",
+    "SKIP",
+    "SOUNDS",
+    "TIME",
+    "UNBOUNDED",
+    "UTC_DATE",
+    "UTC_TIME",
+    "UTC_TIMESTAMP",
+    "WINDOW",
+    "XOR",
+    "YEAR_MONTH",
+}
+# Reserved words of MySQL 8.0, other keywords may be used as names without quotes
+RESERVED_WORDS = set(
+    """
+    ACCESSIBLE ADD ALL ALTER ANALYZE AND AS ASC ASENSITIVE BEFORE BETWEEN BIGINT BINARY
+    BLOB BOTH BY CALL CASCADE CASE CHANGE CHAR CHARACTER CHECK COLLATE COLUMN CONDITION
+    CONSTRAINT CONTINUE CONVERT CREATE CROSS CUBE CUME_DIST CURRENT_DATE CURRENT_TIME
+    CURRENT_TIMESTAMP CURRENT_USER CURSOR DATABASE DATABASES DAY_HOUR DAY_MICROSECOND
+    DAY_MINUTE DAY_SECOND DEC DECIMAL DECLARE DEFAULT DELAYED DELETE DENSE_RANK DESC
+    DESCRIBE DETERMINISTIC DISTINCT DISTINCTROW DIV DOUBLE DROP DUAL EACH ELSE ELSEIF
+    EMPTY ENCLOSED ESCAPED EXCEPT EXISTS EXIT EXPLAIN FALSE FETCH FIRST_VALUE FLOAT
+    FLOAT4 FLOAT8 FOR FORCE FOREIGN FROM FULLTEXT FUNCTION GENERATED GET GRANT GROUP
+    GROUPING GROUPS HAVING HIGH_PRIORITY HOUR_MICROSECOND HOUR_MINUTE HOUR_SECOND IF
+    IGNORE IN INDEX INFILE INNER INOUT INSENSITIVE INSERT INT INT1 INT2 INT3 INT4 INT8
+    INTEGER INTERSECT INTERVAL INTO IO_AFTER_GTIDS IO_BEFORE_GTIDS IS ITERATE JOIN
+    JSON_TABLE KEY KEYS KILL LAG LAST_VALUE LATERAL LEAD LEADING LEAVE LEFT LIKE LIMIT
+    LINEAR LINES LOAD LOCALTIME LOCALTIMESTAMP LOCK LONG LONGBLOB LONGTEXT LOOP
+    LOW_PRIORITY MASTER_BIND MASTER_SSL_VERIFY_SERVER_CERT MATCH MAXVALUE MEDIUMBLOB
+    MEDIUMINT MEDIUMTEXT MIDDLEINT MINUTE_MICROSECOND MINUTE_SECOND MOD MODIFIES NATURAL
+    NOT NO_WRITE_TO_BINLOG NTH_VALUE NTILE NULL NUMERIC OF ON OPTIMIZE OPTIMIZER_COSTS
+    OPTION OPTIONALLY OR ORDER OUT OUTER OUTFILE OVER PARTITION PERCENT_RANK PRECISION
+    PRIMARY PROCEDURE PURGE RANGE RANK READ READS READ_WRITE REAL RECURSIVE REFERENCES
+    REGEXP RELEASE RENAME REPEAT REPLACE REQUIRE RESIGNAL RESTRICT RETURN REVOKE RIGHT
+    RLIKE ROW ROWS ROW_NUMBER SCHEMA SCHEMAS SECOND_MICROSECOND SELECT SENSITIVE
+    SEPARATOR SET SHOW SIGNAL SMALLINT SPATIAL SPECIFIC SQL SQLEXCEPTION SQLSTATE
+    SQLWARNING SQL_BIG_RESULT SQL_CALC_FOUND_ROWS SQL_SMALL_RESULT SSL STARTING STORED
+    STRAIGHT_JOIN SYSTEM TABLE TERMINATED THEN TINYBLOB TINYINT TINYTEXT TO TRAILING
+    TRIGGER TRUE UNDO UNION UNIQUE UNLOCK UNSIGNED UPDATE USAGE USE USING UTC_DATE
+    UTC_TIME UTC_TIMESTAMP VALUES VARBINARY VARCHAR VARCHARACTER VARYING VIRTUAL WHEN
+    WHERE WHILE WINDOW WITH WRITE XOR YEAR_MONTH ZEROFILL
+    """.split()
+)
+INTERVAL_UNITS = {
+    "MICROSECOND",
+    "SECOND",
+    "MINUTE",
+    "HOUR",
+    "DAY",
+    "WEEK",
+    "MONTH",
+    "QUARTER",
+    "YEAR",
+}
+
+
+class ESQLValidationErrorType(Enum):
+    SYNTAX = "syntax"
+    NOT_SELECT = "not_select"
+    UNKNOWN_TABLE = "unknown_table"
+    UNKNOWN_COLUMN = "unknown_column"
+    AMBIGUOUS_COLUMN = "ambiguous_column"
+    ONLY_FULL_GROUP_BY = "only_full_group_by"
+
+
+class SQLToken:
+    __slots__ = ("kind", "value", "upper", "is_name", "start", "end")
+
+    def __init__(
+        self, kind: str, value: str, is_name: bool = False, span: tuple = (0, 0)
+    ):
+        self.kind = kind
+        self.value = value
+        self.upper = " ".join(value.upper().split())
+        # Identifiers, as opposed to words the lexer knows as keywords or built-ins
+        self.is_name = is_name
+        # Position of the token in the SQL
+        self.start, self.end = span
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/)
+    |(?P<quoted>`(?:[^`]|``)*`)
+    |(?P<string>[nbx]?'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    |(?P<number>0x[0-9a-f]+|(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)
+    |(?P<keyword>(?:GROUP|ORDER|PARTITION)\s+BY|UNION\s+(?:ALL|DISTINCT)|WITH\s+ROLLUP
+        |CHARACTER\s+SET|FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE
+        |(?:NATURAL\s+)?(?:(?:LEFT|RIGHT|FULL)\s+(?:OUTER\s+)?|INNER\s+|CROSS\s+)?JOIN)\b
+    |(?P<word>(?:[^\W\d]|[$@])[\w$@]*)
+    |(?P<punct>[(),.;])
+    |(?P<wildcard>\*)
+    |(?P<op>[-+/%=<>!|&^~:?]+)
+    |(?P<error>.)
+    """,
+    re.X | re.S | re.I,
+)
+_KEYWORDS = {*KEYWORDS_COMMON, *KEYWORDS_MYSQL, *KEYWORDS, *NAME_KEYWORDS}
+
+
+def tokenize_sql(sql: str) -> list[SQLToken] | None:
+    """
+    Split SQL into tokens, None if a string or quoted name isn't terminated
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "space":
+            continue
+        if kind == "error":
+            return None
+        span = match.span()
+        if kind == "quoted":
+            value = value[1:-1].replace("``", "`")
+            tokens.append(SQLToken("word", value, is_name=True, span=span))
+        elif kind == "keyword":
+            tokens.append(SQLToken("word", value, span=span))
+        elif kind == "word":
+            is_name = value.upper() not in _KEYWORDS
+            tokens.append(SQLToken("word", value, is_name=is_name, span=span))
+        else:
+            tokens.append(SQLToken(kind, value, span=span))
+    return tokens
+
+
+def is_select(sql: str) -> bool:
+    """
+    Whether SQL is a single SELECT statement that neither writes nor locks rows, without
+    checking it against a schema
+    """
+    tokens = tokenize_sql(sql or "")
+    if tokens is None:
+        return False
+    while tokens and tokens[-1].kind == "punct" and tokens[-1].value == ";":
+        tokens.pop()
+    first = next((token for token in tokens if token.value != "("), None)
+    if first is None or first.upper not in ("SELECT", "WITH"):
+        return False
+    for index, token in enumerate(tokens):
+        if token.kind == "punct" and token.value == ";":
+            return False
+        if (
+            token.kind == "word"
+            and not token.is_name
+            and token.upper in WRITE_KEYWORDS
+            and not (
+                index + 1 < len(tokens)
+                and tokens[index + 1].kind == "punct"
+                and tokens[index + 1].value == "("
+            )
+        ):
+            return False
+    return True
+
+
+def _normalize(name: str) -> str:
+    return name.lower()
+
+
+class _Source:
+    def __init__(self, name: str, table: dict | None):
+        self.name = name
+        # Catalog table, None for derived tables, CTEs and tables of other databases
+        self.table = table
+
+
+class _Scope:
+    def __init__(self, outer: "_Scope | None" = None):
+        self.outer = outer
+        self.sources: dict[str, _Source] = {}
+        self.ctes: set[str] = set()
+        self.aliases: set[str] = set()
+        # Names defined in the WINDOW clause
+        self.windows: set[str] = set()
+        # Columns of NATURAL and USING joins may be used unqualified in every joined table
+        self.has_using = False
+
+    @property
+    def has_unknown_source(self) -> bool:
+        return any(source.table is None for source in self.sources.values())
+
+    def is_cte(self, name: str) -> bool:
+        scope = self
+        while scope:
+            if name in scope.ctes:
+                return True
+            scope = scope.outer
+        return False
+
+
+class _Ref:
+    __slots__ = ("qualifier", "name", "aggregated", "alias")
+
+    def __init__(self, qualifier, name, aggregated, alias):
+        self.qualifier = qualifier
+        self.name = name
+        self.aggregated = aggregated
+        # Source the column was resolved to in the local scope
+        self.alias = alias
+
+    @property
+    def text(self) -> str:
+        return f"{self.qualifier}.{self.name}" if self.qualifier else self.name
+
+
+class _Parser:
+    def __init__(self, validator: "SQLValidator", tokens: list[SQLToken], match: dict):
+        self.validator = validator
+        self.tokens = tokens
+        self.match = match
+        self.errors: list[dict] = []
+
+    def error(self, error_type: ESQLValidationErrorType, message: str):
+        error = {"error_type": error_type.value, "message": message}
+        if error not in self.errors:
+            self.errors.append(error)
+
+    def is_word(self, index: int, *values: str) -> bool:
+        if index >= len(self.tokens) or self.tokens[index].kind != "word":
+            return False
+        return not values or self.tokens[index].upper in values
+
+    def is_punct(self, index: int, value: str) -> bool:
+        return (
+            index < len(self.tokens)
+            and self.tokens[index].kind == "punct"
+            and self.tokens[index].value == value
+        )
+
+    def starts_query(self, index: int) -> bool:
+        return self.is_word(index, "SELECT", "WITH") or (
+            self.is_punct(index, "(") and self.starts_query(index + 1)
+        )
+
+    def split(self, start: int, end: int, is_separator) -> list[tuple[int, int]]:
+        """
+        Split a token range at top level tokens, parentheses are skipped
+        """
+        parts = []
+        part_start = start
+        index = start
+        while index < end:
+            if is_separator(index):
+                parts.append((part_start, index))
+                part_start = index + 1
+            elif self.is_punct(index, "("):
+                index = self.match[index]
+            index += 1
+        parts.append((part_start, end))
+        return parts
+
+    def parse_query(self, start: int, end: int, outer: _Scope | None):
+        scope = _Scope(outer)
+        index = start
+        if self.is_word(index, "WITH"):
+            index += 1
+            recursive = self.is_word(index, "RECURSIVE")
+            if recursive:
+                index += 1
+            while index < end and self.is_word(index):
+                name = _normalize(self.tokens[index].value)
+                index += 1
+                if self.is_punct(index, "("):
+                    index = self.match[index] + 1
+                if not self.is_word(index, "AS") or not self.is_punct(index + 1, "("):
+                    self.error(
+                        ESQLValidationErrorType.SYNTAX,
+                        f"Invalid common table expression '{name}'",
+                    )
+                    return
+                body_end = self.match[index + 1]
+                if recursive:
+                    scope.ctes.add(name)
+                self.parse_query(index + 2, body_end, scope)
+                scope.ctes.add(name)
+                index = body_end + 1
+                if not self.is_punct(index, ","):
+                    break
+                index += 1
+        parts = self.split(
+            index,
+            end,
+            lambda i: self.is_word(i) and self.tokens[i].upper.startswith(SET_OPERATORS),
+        )
+        for part_start, part_end in parts:
+            if self.is_punct(part_start, "("):
+                # Clauses after a parenthesized query apply to the whole query
+                self.parse_query(part_start + 1, self.match[part_start], scope)
+            elif self.is_word(part_start, "SELECT"):
+                self.parse_select(part_start, part_end, scope)
+            else:
+                self.error(
+                    ESQLValidationErrorType.SYNTAX,
+                    "Expected a SELECT statement",
+                )
+
+    def parse_select(self, start: int, end: int, outer: _Scope):
+        scope = _Scope(outer)
+        clauses = {"SELECT": (start + 1, end)}
+        current = "SELECT"
+        index = start + 1
+        while index < end:
+            token = self.tokens[index]
+            if token.kind == "word" and token.upper in SELECT_CLAUSES:
+                clauses[current] = (clauses[current][0], index)
+                current = token.upper
+                clauses[current] = (index + 1, end)
+            elif self.is_punct(index, "("):
+                index = self.match[index]
+            index += 1
+
+        conditions: list[tuple[int, int]] = []
+        if "FROM" in clauses:
+            self.parse_from(*clauses["FROM"], scope, conditions)
+        windows = []
+        if "WINDOW" in clauses:
+            for window_start, window_end in self.split(
+                *clauses["WINDOW"], lambda i: self.is_punct(i, ",")
+            ):
+                if self.is_word(window_start):
+                    scope.windows.add(_normalize(self.tokens[window_start].value))
+                windows.append((window_start + 1, window_end))
+
+        select_start, select_end = clauses["SELECT"]
+        while select_start < select_end and self.is_word(select_start, *SELECT_MODIFIERS):
+            select_start += 1
+        items = []
+        item_aliases = []
+        for item_start, item_end in self.split(
+            select_start, select_end, lambda i: self.is_punct(i, ",")
+        ):
+            expression_end, alias = self.get_select_alias(item_start, item_end)
+            if alias:
+                scope.aliases.add(alias)
+            items.append((item_start, expression_end))
+            item_aliases.append(alias)
+
+        item_refs = []
+        has_aggregate = False
+        for item_start, item_end in items:
+            refs: list[_Ref] = []
+            has_aggregate |= self.walk(
+                item_start, item_end, scope, "field list", refs, aliases=False
+            )
+            item_refs.append(refs)
+        for condition_start, condition_end in conditions:
+            self.walk(condition_start, condition_end, scope, "on clause", [], aliases=False)
+        if "WHERE" in clauses:
+            self.walk(*clauses["WHERE"], scope, "where clause", [], aliases=False)
+        group_refs = []
+        group_items = []
+        if "GROUP BY" in clauses:
+            group_start, group_end = clauses["GROUP BY"]
+            for item_start, item_end in self.split(
+                group_start, group_end, lambda i: self.is_punct(i, ",")
+            ):
+                while item_end > item_start and self.is_word(
+                    item_end - 1, "ASC", "DESC", "ROLLUP", "WITH", "WITH ROLLUP"
+                ):
+                    item_end -= 1
+                refs = []
+                self.walk(item_start, item_end, scope, "group statement", refs)
+                group_items.append((item_start, item_end))
+                group_refs.append(refs)
+        for clause in ("HAVING", "ORDER BY"):
+            if clause in clauses:
+                has_aggregate |= self.walk(
+                    *clauses[clause], scope, SELECT_CLAUSES[clause], []
+                )
+        for window_start, window_end in windows:
+            self.walk(window_start, window_end, scope, "window clause", [], aliases=False)
+
+        if "GROUP BY" in clauses or has_aggregate:
+            self.check_group_by(
+                scope,
+                items,
+                item_aliases,
+                item_refs,
+                group_items,
+                group_refs,
+                conditions,
+                clauses,
+            )
+
+    def get_select_alias(self, start: int, end: int) -> tuple[int, str | None]:
+        """
+        :return: End of the expression of a select item, and its alias
+        """
+        if end - start < 2:
+            return end, None
+        last = self.tokens[end - 1]
+        if self.is_word(end - 2, "AS") and last.kind in ("word", "string"):
+            return end - 2, _normalize(last.value.strip("'\""))
+        previous = self.tokens[end - 2]
+        if (
+            last.kind == "word"
+            and self.is_unreserved(end - 1)
+            # Ends CASE, and units end INTERVAL expressions, INTERVAL 1 DAY
+            and last.upper != "END"
+            and not (last.upper in INTERVAL_UNITS and self.has_interval(start, end - 1))
+            and (
+                previous.kind in ("string", "number")
+                or (
+                    previous.kind == "word"
+                    and (
+                        self.is_unreserved(end - 2)
+                        or previous.upper in ("NULL", "TRUE", "FALSE")
+                    )
+                )
+                or (previous.kind == "punct" and previous.value == ")")
+            )
+        ):
+            return end - 1, _normalize(last.value)
+        return end, None
+
+    def is_unreserved(self, index: int) -> bool:
+        """
+        Whether a word may be a name without quotes, such as the keywords year or type
+        """
+        token = self.tokens[index]
+        return token.is_name or token.upper not in RESERVED_WORDS
+
+    def has_interval(self, start: int, end: int) -> bool:
+        index = start
+        while index < end:
+            if self.is_word(index, "INTERVAL"):
+                return True
+            if self.is_punct(index, "("):
+                index = self.match[index]
+            index += 1
+        return False
+
+    def parse_from(self, start: int, end: int, scope: _Scope, conditions: list):
+        index = start
+        while index < end:
+            token = self.tokens[index]
+            if token.kind == "punct" and token.value == ",":
+                index += 1
+            elif token.kind == "word" and (
+                token.upper.endswith("JOIN") or token.upper in JOIN_MODIFIERS
+            ):
+                if token.upper.startswith("NATURAL"):
+                    scope.has_using = True
+                index += 1
+            elif self.is_word(index, "ON"):
+                condition_end = index + 1
+                while condition_end < end and not (
+                    self.is_punct(condition_end, ",")
+                    or (
+                        self.is_word(condition_end)
+                        and (
+                            self.tokens[condition_end].upper.endswith("JOIN")
+                            or self.tokens[condition_end].upper in JOIN_MODIFIERS
+                        )
+                        # LEFT() and RIGHT() functions
+                        and not self.is_punct(condition_end + 1, "(")
+                    )
+                ):
+                    if self.is_punct(condition_end, "("):
+                        condition_end = self.match[condition_end]
+                    condition_end += 1
+                conditions.append((index + 1, condition_end))
+                index = condition_end
+            elif self.is_word(index, "USING"):
+                scope.has_using = True
+                index += 1
+                if self.is_punct(index, "("):
+                    index = self.match[index] + 1
+            elif self.is_punct(index, "("):
+                close = self.match[index]
+                if self.starts_query(index + 1):
+                    self.parse_query(index + 1, close, scope.outer)
+                    index = self.add_source(close + 1, end, scope, None, None)
+                else:
+                    # Parenthesized joins
+                    self.parse_from(index + 1, close, scope, conditions)
+                    index = close + 1
+            elif token.kind == "word":
+                index = self.parse_table(index, end, scope)
+            else:
+                index += 1
+
+    def parse_table(self, index: int, end: int, scope: _Scope) -> int:
+        parts = [self.tokens[index].value]
+        index += 1
+        while self.is_punct(index, ".") and self.is_word(index + 1):
+            parts.append(self.tokens[index + 1].value)
+            index += 2
+        if self.is_punct(index, "("):
+            # Table function such as JSON_TABLE
+            return self.add_source(self.match[index] + 1, end, scope, parts[-1], None)
+        name = _normalize(parts[-1])
+        table = None
+        if len(parts) == 1 and name != "dual" and not scope.is_cte(name):
+            table = self.validator.tables.get(name)
+            if table is None:
+                message = f"Table '{parts[-1]}' doesn't exist"
+                suggestions = difflib.get_close_matches(
+                    name, self.validator.tables.keys(), n=3
+                )
+                if suggestions:
+                    message += f", did you mean {', '.join(suggestions)}?"
+                self.error(ESQLValidationErrorType.UNKNOWN_TABLE, message)
+        return self.add_source(index, end, scope, parts[-1], table)
+
+    def add_source(
+        self, index: int, end: int, scope: _Scope, name: str | None, table: dict | None
+    ) -> int:
+        """
+        Register a table of the FROM clause under its alias
+        :return: Index after the alias and index hints
+        """
+        if self.is_word(index, "PARTITION") and self.is_punct(index + 1, "("):
+            index = self.match[index + 1] + 1
+        if self.is_word(index, "AS"):
+            index += 1
+        if index < end and self.tokens[index].kind == "word" and (
+            self.tokens[index].is_name
+            or self.tokens[index].upper
+            not in {"ON", "USING", "NATURAL", *JOIN_MODIFIERS, *INDEX_HINTS}
+            and not self.tokens[index].upper.endswith("JOIN")
+        ):
+            name = self.tokens[index].value
+            index += 1
+            if self.is_punct(index, "("):
+                # Column names of a derived table
+                index = self.match[index] + 1
+        while self.is_word(index, *INDEX_HINTS):
+            index += 1
+            while index < end and not self.is_punct(index, "("):
+                index += 1
+            if index < end:
+                index = self.match[index] + 1
+        if name:
+            scope.sources[_normalize(name)] = _Source(name, table)
+        return index
+
+    def resolve(self, scope: _Scope, qualifier: str | None, name: str, clause: str, aliases: bool):
+        """
+        Find the table of a column reference, reporting unknown and ambiguous columns
+        :return: Whether the column was found, and its source if in the local scope
+        """
+        column = _normalize(name)
+        local = True
+        current = scope
+        while current:
+            if qualifier:
+                source = current.sources.get(_normalize(qualifier))
+                if source:
+                    if (
+                        source.table is not None
+                        and column != "*"
+                        and column not in source.table["columns"]
+                    ):
+                        self.unknown_column(f"{qualifier}.{name}", clause, source.table)
+                    return _normalize(qualifier) if local else None
+            else:
+                matched = [
+                    alias
+                    for alias, source in current.sources.items()
+                    if source.table is not None and column in source.table["columns"]
+                ]
+                if len(matched) > 1 and not current.has_using and not (
+                    aliases and column in current.aliases
+                ):
+                    self.error(
+                        ESQLValidationErrorType.AMBIGUOUS_COLUMN,
+                        f"Column '{name}' in {clause} is ambiguous",
+                    )
+                if matched:
+                    return matched[0] if local and len(matched) == 1 else None
+                if current.has_unknown_source or (
+                    (aliases or not local) and column in current.aliases
+                ):
+                    return None
+            current = current.outer
+            local = False
+        if qualifier or self.validator.tables:
+            self.unknown_column(
+                f"{qualifier}.{name}" if qualifier else name,
+                clause,
+                scope.sources[next(iter(scope.sources))].table
+                if len(scope.sources) == 1
+                else None,
+            )
+        return None
+
+    def unknown_column(self, name: str, clause: str, table: dict | None):
+        message = f"Unknown column '{name}' in '{clause}'"
+        if table:
+            columns = list(table["columns"].values())
+            message += f", table '{table['name']}' has columns: {', '.join(columns[:MAX_SUGGESTED_COLUMNS])}"
+            if len(columns) > MAX_SUGGESTED_COLUMNS:
+                message += ", ..."
+        self.error(ESQLValidationErrorType.UNKNOWN_COLUMN, message)
+
+    def walk(
+        self,
+        start: int,
+        end: int,
+        scope: _Scope,
+        clause: str,
+        refs: list[_Ref],
+        aggregated: bool = False,
+        aliases: bool = True,
+    ) -> bool:
+        """
+        Check the column references of an expression
+        :param refs: Column references outside of subqueries are added to it
+        :param aggregated: Whether the expression is an argument of an aggregate function
+        :param aliases: Whether select aliases may be referenced
+        :return: Whether the expression calls an aggregate function
+        """
+        has_aggregate = False
+        index = start
+        while index < end:
+            token = self.tokens[index]
+            if token.kind == "punct" and token.value == "(":
+                close = self.match[index]
+                if self.starts_query(index + 1):
+                    self.parse_query(index + 1, close, scope)
+                else:
+                    has_aggregate |= self.walk(
+                        index + 1, close, scope, clause, refs, aggregated, aliases
+                    )
+                index = close + 1
+                continue
+            if token.kind != "word" or token.value.startswith("@"):
+                # Literals, operators and variables
+                index += 1
+                continue
+            if index > start and self.is_word(index - 1, *NON_COLUMN_PREFIXES):
+                index += 1
+                continue
+            if self.is_punct(index + 1, "("):
+                close = self.match[index + 1]
+                if self.starts_query(index + 2):
+                    # IN, EXISTS, ANY and ALL subqueries
+                    self.parse_query(index + 2, close, scope)
+                    index = close + 1
+                    continue
+                is_window = self.is_word(close + 1, "OVER")
+                is_aggregate = token.upper in AGGREGATE_FUNCTIONS and not is_window
+                is_exempt = token.upper in GROUP_BY_EXEMPT_FUNCTIONS
+                has_aggregate |= is_aggregate | self.walk(
+                    index + 2,
+                    close,
+                    scope,
+                    clause,
+                    refs,
+                    aggregated or is_aggregate or is_exempt,
+                    aliases,
+                )
+                index = close + 1
+                continue
+            if self.is_punct(index + 1, "."):
+                parts = [token.value]
+                index += 1
+                while self.is_punct(index, ".") and index + 1 < end:
+                    parts.append(self.tokens[index + 1].value)
+                    index += 2
+                qualifier, name = parts[-2], parts[-1]
+                alias = self.resolve(scope, qualifier, name, clause, aliases)
+                refs.append(_Ref(qualifier, name, aggregated, alias))
+                continue
+            index += 1
+            if not token.is_name:
+                # Keywords may only be columns when they are one, e.g. `year`
+                continue
+            if (
+                index - 1 == start
+                and self.is_punct(index - 2, "(")
+                and _normalize(token.value) in scope.windows
+            ):
+                # Window specification based on a named window, OVER (w ORDER BY x)
+                continue
+            if token.value.startswith("_") and index < end and self.tokens[index].kind == "string":
+                # Character set introducer, _utf8mb4'text'
+                continue
+            alias = self.resolve(scope, None, token.value, clause, aliases)
+            refs.append(_Ref(None, token.value, aggregated, alias))
+        return has_aggregate
+
+    def get_text(self, start: int, end: int) -> str:
+        return " ".join(
+            token.value if token.kind == "string" else _normalize(token.value)
+            for token in self.tokens[start:end]
+        )
+
+    def get_equalities(self, start: int, end: int, scope: _Scope) -> list[tuple]:
+        """
+        Column = column and column = constant conditions joined by AND
+        """
+        equalities = []
+        for part_start, part_end in self.split(
+            start, end, lambda i: self.is_word(i, "AND")
+        ):
+            while (
+                part_end - part_start > 2
+                and self.is_punct(part_start, "(")
+                and self.match[part_start] == part_end - 1
+            ):
+                part_start, part_end = part_start + 1, part_end - 1
+            sides = self.split(
+                part_start,
+                part_end,
+                lambda i: self.tokens[i].kind == "op" and self.tokens[i].value in ("=", "<=>"),
+            )
+            if len(sides) == 2:
+                equalities.append(tuple(self.get_operand(*side, scope) for side in sides))
+        return equalities
+
+    def get_operand(self, start: int, end: int, scope: _Scope):
+        """
+        :return: (alias, column) of a column, "constant" for a literal, None otherwise
+        """
+        if end - start == 1 and self.tokens[start].kind in ("string", "number"):
+            return "constant"
+        refs: list[_Ref] = []
+        if end - start in (1, 3):
+            validator_errors = len(self.errors)
+            self.walk(start, end, scope, "", refs)
+            del self.errors[validator_errors:]
+        if len(refs) == 1 and refs[0].alias:
+            return refs[0].alias, _normalize(refs[0].name)
+        return None
+
+    def is_column(self, start: int, end: int) -> bool:
+        if end - start == 1:
+            return self.is_word(start)
+        return (
+            end - start == 3
+            and self.is_word(start)
+            and self.is_punct(start + 1, ".")
+            and self.is_word(start + 2)
+        )
+
+    def check_group_by(
+        self,
+        scope: _Scope,
+        items: list[tuple],
+        item_aliases: list,
+        item_refs: list[list[_Ref]],
+        group_items: list[tuple],
+        group_refs: list[list[_Ref]],
+        conditions: list[tuple],
+        clauses: dict,
+    ):
+        """
+        Reject nonaggregated columns that MySQL's ONLY_FULL_GROUP_BY mode rejects, columns
+        are allowed when grouped or functionally dependent on grouped columns through
+        primary or unique keys and equalities of the WHERE and ON clauses
+        """
+        item_texts = [self.get_text(*item) for item in items]
+        group_texts = set()
+        determined: set = set()
+        # Grouped columns of unknown table, any column of the name is taken as grouped
+        grouped_names = set()
+        for (group_start, group_end), refs in zip(group_items, group_refs):
+            text = self.get_text(group_start, group_end)
+            group_texts.add(text)
+            grouped = [((group_start, group_end), refs)]
+            position = None
+            if group_end - group_start == 1 and self.tokens[group_start].kind == "number":
+                position = int(self.tokens[group_start].value) - 1
+            elif text in item_aliases:
+                position = item_aliases.index(text)
+            if position is not None and 0 <= position < len(items):
+                group_texts.add(item_texts[position])
+                grouped.append((items[position], item_refs[position]))
+            for (start, end), column_refs in grouped:
+                if self.is_column(start, end) and len(column_refs) == 1:
+                    if column_refs[0].alias:
+                        determined.add(
+                            (column_refs[0].alias, _normalize(column_refs[0].name))
+                        )
+                    else:
+                        grouped_names.add(_normalize(column_refs[0].name))
+
+        equalities = []
+        for condition in conditions + ([clauses["WHERE"]] if "WHERE" in clauses else []):
+            equalities.extend(self.get_equalities(*condition, scope))
+        determined_sources = set()
+        changed = True
+        while changed:
+            changed = False
+            for left, right in equalities:
+                for column, other in ((left, right), (right, left)):
+                    if (
+                        isinstance(column, tuple)
+                        and column not in determined
+                        and (
+                            other == "constant"
+                            or other in determined
+                            or (isinstance(other, tuple) and other[0] in determined_sources)
+                        )
+                    ):
+                        determined.add(column)
+                        changed = True
+            for alias, source in scope.sources.items():
+                if alias in determined_sources or source.table is None:
+                    continue
+                if any(
+                    key and all((alias, column) in determined for column in key)
+                    for key in source.table["keys"]
+                ):
+                    determined_sources.add(alias)
+                    changed = True
+
+        for position, (text, refs) in enumerate(zip(item_texts, item_refs), 1):
+            if text in group_texts:
+                continue
+            for ref in refs:
+                column = _normalize(ref.name)
+                if (
+                    ref.aggregated
+                    or column == "*"
+                    # Columns of outer queries are constant, others couldn't be resolved
+                    or ref.alias is None
+                    or column in grouped_names
+                    or ref.alias in determined_sources
+                    or (ref.alias, column) in determined
+                ):
+                    continue
+                if not group_items:
+                    message = f"In aggregated query without GROUP BY, expression #{position} of SELECT list contains nonaggregated column '{ref.text}'; this is incompatible with sql_mode=only_full_group_by"
+                else:
+                    message = f"Expression #{position} of SELECT list is not in GROUP BY clause and contains nonaggregated column '{ref.text}' which is not functionally dependent on columns in GROUP BY clause; this is incompatible with sql_mode=only_full_group_by"
+                self.error(ESQLValidationErrorType.ONLY_FULL_GROUP_BY, message)
+                break
+
+
+class SQLValidator:
+    """
+    Static checks of generated SQL against the application schema, catching invalid SQL
+    without a round trip to the database. Checks are conservative: SQL is only rejected
+    for errors MySQL would certainly raise, constructs it can't follow are accepted.
+    """
+
+    def __init__(self, schema: list[dict]):
+        """
+        :param schema: Application schema, see create_application_schema
+        """
+        self.tables: dict[str, dict] = {}
+        for table in schema:
+            columns = {_normalize(column["name"]): column["name"] for column in table["columns"]}
+            primary_key = tuple(
+                _normalize(column["name"])
+                for column in table["columns"]
+                if column["key"] == "PRI"
+            )
+            unique_keys = [
+                (_normalize(column["name"]),)
+                for column in table["columns"]
+                if column["key"] == "UNI" and not column["nullable"]
+            ]
+            self.tables[_normalize(table["table"])] = {
+                "name": table["table"],
+                "columns": columns,
+                "keys": [primary_key, *unique_keys],
+            }
+
+    def validate(self, sql: str) -> list[dict]:
+        """
+        Check a query
+        :param sql: SQL query
+        :return: Errors with error_type and message, empty if no error was found
+        """
+        if not self.tables:
+            return []
+        tokens = tokenize_sql(sql)
+        if tokens is None:
+            return [
+                {
+                    "error_type": ESQLValidationErrorType.SYNTAX.value,
+                    "message": "Unterminated string or quoted identifier",
+                }
+            ]
+        while tokens and tokens[-1].kind == "punct" and tokens[-1].value == ";":
+            tokens.pop()
+        if not tokens:
+            return [
+                {
+                    "error_type": ESQLValidationErrorType.SYNTAX.value,
+                    "message": "Empty query",
+                }
+            ]
+        match = {}
+        stack = []
+        for index, token in enumerate(tokens):
+            if token.kind != "punct":
+                continue
+            if token.value == "(":
+                stack.append(index)
+            elif token.value == ")":
+                if not stack:
+                    stack = [None]
+                    break
+                match[stack.pop()] = index
+            elif token.value == ";" and not stack:
+                return [
+                    {
+                        "error_type": ESQLValidationErrorType.NOT_SELECT.value,
+                        "message": "Only a single SELECT statement may be executed",
+                    }
+                ]
+        if stack:
+            return [
+                {
+                    "error_type": ESQLValidationErrorType.SYNTAX.value,
+                    "message": "Unbalanced parentheses",
+                }
+            ]
+        parser = _Parser(self, tokens, match)
+        if not parser.starts_query(0):
+            return [
+                {
+                    "error_type": ESQLValidationErrorType.NOT_SELECT.value,
+                    "message": "Only SELECT statements may be executed",
+                }
+            ]
+        parser.parse_query(0, len(tokens), None)
+        return parser.errors
+
+
+_validators = LRUCache(maxsize=SQL_VALIDATOR_CACHE_SIZE)
+
+
+def get_sql_validator(application_id) -> SQLValidator:
+    """
+    Get the validator of an application, rebuilt when its schema changes
+    """
+    key = (str(application_id), get_schema_version(application_id))
+    validator = _validators.get(key)
+    if validator is None:
+        schema, _ = create_application_schema(application_id)
+        validator = SQLValidator(schema)
+        _validators.set(key, validator)
+    return validator
@@ -0,0 +1,161 @@
+import json
+import os
+from enum import Enum
+
+from djangorestframework_camel_case.util import camelize
+
+from .agents.main_agent import EStepStatus
+
+# Version of the delta event protocol, sent with every delta event
+SSE_PROTOCOL_VERSION = 2
+
+
+class EStreamMode(Enum):
+    # Resend all steps on every update, the protocol of existing clients
+    SNAPSHOT = "snapshot"
+    # Send step transitions and answer deltas, then one final snapshot
+    DELTA = "delta"
+
+
+class EStreamEvent(Enum):
+    STEP_STARTED = "step_started"
+    STEP_COMPLETED = "step_completed"
+    ANSWER_DELTA = "answer_delta"
+    SNAPSHOT = "snapshot"
+
+
+def format_sse(data, event: str = "") -> str:
+    """
+    Format a Server-Sent Event
+    :param data: JSON serializable payload
+    :param event: Event type, the default "message" event if empty
+    :return:
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def serialize_step(step: dict) -> dict:
+    """
+    Camelize a step for the client, the query result is never streamed
+    """
+    data = camelize(step)
+    if data.get("queryResult"):
+        data["queryResult"] = []
+    return data
+
+
+class SnapshotStreamEncoder:
+    """
+    Encode every update as the full list of steps
+    """
+
+    def encode(self, steps: list[dict]) -> list[str]:
+        return self.encode_snapshot(steps)
+
+    def encode_snapshot(self, steps: list[dict], status: str = "") -> list[str]:
+        data = camelize(steps)
+        if data and data[-1].get("queryResult"):
+            data[-1]["queryResult"] = []
+        if data and status:
+            data[-1]["status"] = status
+        return [format_sse(data)]
+
+    def encode_end(self, steps: list[dict]) -> list[str]:
+        # The last update already carried the final state
+        return []
+
+
+class DeltaStreamEncoder:
+    """
+    Encode updates as step transitions and answer text deltas.
+    Answer deltas carry the offset they apply at, the client truncates the summary
+    to that offset before appending, which covers the rare non-append rewrite.
+    """
+
+    def __init__(self):
+        self.step_statuses: list[str] = []
+        self.summaries: dict[int, str] = {}
+        self.display_modes: dict[int, str] = {}
+
+    @staticmethod
+    def _event(event: EStreamEvent, **data) -> str:
+        return format_sse(
+            {"version": SSE_PROTOCOL_VERSION, "type": event.value, **data},
+            event.value,
+        )
+
+    def _remember_answer(self, index: int, step: dict):
+        result = step.get("result")
+        if isinstance(result, dict) and "summary" in result:
+            self.summaries[index] = result.get("summary") or ""
+            self.display_modes[index] = result.get("display_mode")
+
+    def _encode_answer_delta(self, index: int, step: dict) -> str | None:
+        result = step.get("result")
+        if not isinstance(result, dict) or "summary" not in result:
+            return None
+        summary = result.get("summary") or ""
+        display_mode = result.get("display_mode")
+        sent = self.summaries.get(index, "")
+        if summary == sent and display_mode == self.display_modes.get(index):
+            return None
+        if summary.startswith(sent):
+            offset = len(sent)
+        else:
+            offset = len(os.path.commonprefix([sent, summary]))
+        self.summaries[index] = summary
+        self.display_modes[index] = display_mode
+        return self._event(
+            EStreamEvent.ANSWER_DELTA,
+            index=index,
+            offset=offset,
+            delta=summary[offset:],
+            displayMode=display_mode,
+        )
+
+    def encode(self, steps: list[dict]) -> list[str]:
+        events = []
+        for index, step in enumerate(steps):
+            status = step.get("status")
+            if index >= len(self.step_statuses):
+                self.step_statuses.append(status)
+                self._remember_answer(index, step)
+                event = (
+                    EStreamEvent.STEP_STARTED
+                    if status == EStepStatus.IN_PROGRESS.value
+                    else EStreamEvent.STEP_COMPLETED
+                )
+                events.append(
+                    self._event(event, index=index, step=serialize_step(step))
+                )
+            elif status != self.step_statuses[index]:
+                self.step_statuses[index] = status
+                self._remember_answer(index, step)
+                events.append(
+                    self._event(
+                        EStreamEvent.STEP_COMPLETED,
+                        index=index,
+                        step=serialize_step(step),
+                    )
+                )
+            elif status == EStepStatus.IN_PROGRESS.value:
+                event = self._encode_answer_delta(index, step)
+                if event:
+                    events.append(event)
+        return events
+
+    def encode_snapshot(self, steps: list[dict], status: str = "") -> list[str]:
+        data = [serialize_step(step) for step in steps]
+        if data and status:
+            data[-1]["status"] = status
+        return [self._event(EStreamEvent.SNAPSHOT, steps=data)]
+
+    def encode_end(self, steps: list[dict]) -> list[str]:
+        return self.encode_snapshot(steps)
+
+
+def get_stream_encoder(stream_mode: str | None):
+    if stream_mode == EStreamMode.SNAPSHOT.value:
+        return SnapshotStreamEncoder()
+    return DeltaStreamEncoder()
@@ -1,3 +1,97 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from backend.apps.chat.core.sql_validator import SQLValidator
+
+
+def _column(name, key=""):
+    return {
+        "name": name,
+        "key": key,
+        "type": "int",
+        "default": None,
+        "comment": "",
+        "nullable": True,
+    }
+
+
+SCHEMA = [
+    {
+        "table": "orders",
+        "comment": "",
+        "columns": [
+            _column("order_id", "PRI"),
+            _column("customer_id", "MUL"),
+            _column("status"),
+            _column("amount"),
+            _column("created_at"),
+            _column("订单号"),
+        ],
+    },
+    {
+        "table": "customers",
+        "comment": "",
+        "columns": [_column("customer_id", "PRI"), _column("name"), _column("city")],
+    },
+]
+
+ACCEPTED = [
+    "SELECT c.name, SUM(o.amount) total FROM orders o JOIN customers c ON o.customer_id = c.customer_id GROUP BY o.customer_id",
+    "SELECT DATE_FORMAT(created_at, '%Y-%m') AS month, SUM(amount) FROM orders GROUP BY month",
+    "SELECT COUNT(*) FROM orders WHERE created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)",
+    "SELECT name FROM customers WHERE customer_id IN (SELECT customer_id FROM orders WHERE amount > 100)",
+    "WITH t AS (SELECT customer_id, SUM(amount) s FROM orders GROUP BY customer_id) SELECT c.name, t.s FROM t JOIN customers c ON c.customer_id = t.customer_id",
+    "SELECT customer_id, RANK() OVER (PARTITION BY customer_id ORDER BY amount DESC) r FROM orders",
+    "SELECT c.city, COUNT(*) AS n FROM customers c GROUP BY c.city HAVING n > 1 ORDER BY n DESC",
+    "SELECT name FROM customers UNION ALL SELECT city FROM customers ORDER BY name",
+    # Aliases without AS that are unreserved keywords
+    "SELECT YEAR(created_at) year, COUNT(*) FROM orders GROUP BY year",
+    "SELECT status type, COUNT(*) FROM orders GROUP BY type",
+    "SELECT SUBSTRING_INDEX(name, ' ', 1) first, COUNT(*) FROM customers GROUP BY first",
+    "SELECT DATE(created_at) date, SUM(amount) FROM orders GROUP BY date ORDER BY date",
+    "SELECT DATE_ADD(created_at, INTERVAL 1 DAY) day, COUNT(*) FROM orders GROUP BY day",
+    "SELECT created_at + INTERVAL 1 DAY FROM orders",
+    "SELECT CASE WHEN amount > 10 THEN 'big' ELSE 'small' END FROM orders",
+    # Non-ASCII names
+    "SELECT name AS 客户名称 FROM customers",
+    "SELECT 订单号 FROM orders",
+    # ANY_VALUE() arguments need not be grouped
+    "SELECT status, ANY_VALUE(amount) FROM orders GROUP BY status",
+    "SELECT ANY_VALUE(amount), status FROM orders",
+    # Named windows
+    "SELECT order_id, ROW_NUMBER() OVER w AS n FROM orders WINDOW w AS (PARTITION BY customer_id ORDER BY amount)",
+    "SELECT SUM(amount) OVER (w ORDER BY created_at) FROM orders WINDOW w AS (PARTITION BY customer_id)",
+    # National, hexadecimal and bit strings
+    "SELECT name FROM customers WHERE city = N'abc'",
+    "SELECT name FROM customers WHERE city = x'4D' OR city = b'01'",
+]
+
+REJECTED = [
+    "SELECT * FROM order_items",
+    "SELECT nme FROM customers",
+    "SELECT customer_id FROM orders o JOIN customers c ON o.customer_id = c.customer_id",
+    "SELECT name, COUNT(*) FROM customers",
+    "SELECT city, name, COUNT(*) FROM customers GROUP BY city",
+    "SELECT status, amount FROM orders GROUP BY status",
+    "DELETE FROM customers",
+    "SELECT 1; DROP TABLE customers",
+    "SELECT name FROM customers WHERE (city = 'x'",
+    "SELECT name FROM customers WHERE city = 'x",
+    "SELECT amount * 2 AS dbl FROM orders WHERE dbl > 3",
+    "SELECT 客户名称 FROM customers",
+    "SELECT order_id, ROW_NUMBER() OVER w FROM orders WINDOW w AS (PARTITION BY nme)",
+]
+
+
+class SQLValidatorTests(SimpleTestCase):
+    def setUp(self):
+        self.validator = SQLValidator(SCHEMA)
+
+    def test_accepted(self):
+        for sql in ACCEPTED:
+            with self.subTest(sql=sql):
+                self.assertEqual(self.validator.validate(sql), [])
+
+    def test_rejected(self):
+        for sql in REJECTED:
+            with self.subTest(sql=sql):
+                self.assertNotEqual(self.validator.validate(sql), [])
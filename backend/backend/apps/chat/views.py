@@ -5,7 +5,6 @@ from adrf.decorators import api_view
 from asgiref.sync import sync_to_async
 from django.db import transaction
 from django.http import StreamingHttpResponse
-from djangorestframework_camel_case.util import camelize
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -17,6 +16,8 @@ from backend.utils.viewset import BaseUndeletedModelViewSet
 
 from .core.agents.charts_agent import ChartsAgent
 from .core.agents.main_agent import DisplayFormat, EStepStatus, MainAgent
+from .core.cancellation import cancellation_registry, iterate_until_cancelled
+from .core.stream import get_stream_encoder
 from .filters import MessageFilter
 from .models import Message
 from .serializers import MessageDetailSerializer, MessageSerializer
@@ -86,6 +87,8 @@ async def chat_stream(request):
     question = request.data.get("question")
     application_id = request.data.get("application_id")
     task_id = request.data.get("task_id")
+    # "snapshot" resends all steps on every update, for clients of the previous protocol
+    stream_mode = request.data.get("stream_mode")
 
     if not question:
         return get_error_response("Question is required", status.HTTP_400_BAD_REQUEST)
@@ -129,6 +132,7 @@ async def chat_stream(request):
         task_id,
     )
     main_agent = MainAgent(application=application)
+    encoder = get_stream_encoder(stream_mode)
 
     async def generator():
         """
@@ -136,23 +140,28 @@ async def chat_stream(request):
         """
         _steps = []
         optimized_question = question
+        cancellation_token = cancellation_registry.register(message.task_id)
         try:
-            async for steps in main_agent.run_stream(context_question):
+            # A cancellation aborts the running agent step, including its LLM request and SQL query
+            async for steps in iterate_until_cancelled(
+                main_agent.run_stream(context_question), cancellation_token
+            ):
                 _steps = steps
                 for step in _steps:
                     step["id"] = str(message.id)
                     step["taskId"] = task_id
                     if step["step"] == "question_agent":
                         optimized_question = step["result"].get("new_question", "")
-                res_data = camelize(_steps)
-                if res_data[-1].get("queryResult"):
-                    res_data[-1]["queryResult"] = []
-                _message = await Message.objects.aget(id=message.id)
-                if _message.is_cancelled:
-                    res_data[-1]["status"] = EStepStatus.CANCELLED.value
-                    yield f"data: {json.dumps(res_data)}\n\n"
-                    return
-                yield f"data: {json.dumps(res_data)}\n\n"
+                for event in encoder.encode(_steps):
+                    yield event
+            if cancellation_token.cancelled:
+                for event in encoder.encode_snapshot(
+                    _steps, status=EStepStatus.CANCELLED.value
+                ):
+                    yield event
+                return
+            for event in encoder.encode_end(_steps):
+                yield event
 
         except Exception as exc:
             latest_step = _steps[-1]
@@ -164,11 +173,12 @@ async def chat_stream(request):
                 "display_mode": DisplayFormat.TEXT.value,
             }
             latest_step["error_msg"] = str(exc)
-            yield f"data: {json.dumps(camelize(_steps))}\n\n"
+            for event in encoder.encode_snapshot(_steps):
+                yield event
 
         finally:
-            _message = await Message.objects.aget(id=message.id)
-            if _message.is_cancelled:
+            cancellation_registry.unregister(message.task_id)
+            if await cancellation_token.is_cancelled(force=True):
                 return
             # Record message completion at the end
             latest_step = _steps[-1]
@@ -201,7 +211,7 @@ async def generate_chart(request):
     query_result_str = json.dumps(
         query_result, ensure_ascii=False, separators=(",", ":")
     )
-    tokens = get_llm_tokens(query_result_str)
+    tokens = get_llm_tokens(query_result_str, approximate=True)
 
     if tokens > 32 * 1024 and len(query_result) > 0:
         query_result = query_result[: min(20, len(query_result))]
@@ -210,7 +220,7 @@ async def generate_chart(request):
         )
 
     user_question = f"**User question**: {message.optimized_question or message.question}\n **The language for generating charts is**: {language}"
-    option_string = await sync_to_async(charts_agent.run)(
+    option_string = await charts_agent.run(
         user_question=user_question,
         query_result=query_result_str,
     )
@@ -240,6 +250,7 @@ async def cancel_chat(request):
         task_id=task_id,
     ).afirst()
     if message:
+        await cancellation_registry.cancel(message.task_id)
         message.is_cancelled = True
         message.received_sql_list = []
         message.valid_sql = ""
@@ -1,3 +1,28 @@
-from django.shortcuts import render
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
-# Create your views here.
+from backend.utils.jobs import job_queue
+
+
+class JobViewSet(viewsets.ViewSet):
+    """
+    Background Job View
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def retrieve(self, request, pk=None):
+        state = job_queue.get(pk)
+        if state is None:
+            return Response(
+                {"code": 1, "msg": "Job not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(state)
+
+    @action(methods=["post"], detail=True)
+    def cancel(self, request, pk=None):
+        if not job_queue.cancel(pk):
+            return Response({"code": 1, "msg": "Job is not running"})
+        return Response(job_queue.get(pk))
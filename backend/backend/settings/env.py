@@ -18,10 +18,21 @@ class ENV:
     REDIS_HOST = os.getenv("REDIS_HOST")
     REDIS_PORT = os.getenv("REDIS_PORT")
 
+    # Application database connection pool settings
+    APPLICATION_DATABASE_POOL_SIZE = os.getenv("APPLICATION_DATABASE_POOL_SIZE")
+    APPLICATION_DATABASE_POOL_MAX_OVERFLOW = os.getenv(
+        "APPLICATION_DATABASE_POOL_MAX_OVERFLOW"
+    )
+    APPLICATION_DATABASE_POOL_TIMEOUT = os.getenv("APPLICATION_DATABASE_POOL_TIMEOUT")
+    APPLICATION_DATABASE_POOL_RECYCLE = os.getenv("APPLICATION_DATABASE_POOL_RECYCLE")
+    # Seconds between health checks of read replicas
+    REPLICA_HEALTH_CHECK_INTERVAL = os.getenv("REPLICA_HEALTH_CHECK_INTERVAL")
+
     # Ollama settings
     OLLAMA_API_URL = os.getenv("OLLAMA_API_URL")
     OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
     OLLAMA_API_KEY = os.getenv("OLLAMA_API_KEY")
+    OLLAMA_MAX_CONNECTIONS = os.getenv("OLLAMA_MAX_CONNECTIONS")
 
     # Fine-tuning related models
     COLUMN_COMMENT_AGENT_MODEL = os.getenv("COLUMN_COMMENT_AGENT_MODEL")
@@ -46,9 +57,33 @@ class ENV:
 
     # Embedding service
     EMBEDDING_SERVICE_ENDPOINT = os.getenv("EMBEDDING_SERVICE_ENDPOINT")
+    # Concurrent document uploads to the embedding service
+    EMBEDDING_UPLOAD_CONCURRENCY = os.getenv("EMBEDDING_UPLOAD_CONCURRENCY")
+
+    # Local schema vector index, SCHEMA_EMBEDDER is the import path of an embedding callable
+    SCHEMA_INDEX_DIR = os.getenv("SCHEMA_INDEX_DIR")
+    SCHEMA_EMBEDDER = os.getenv("SCHEMA_EMBEDDER")
+    # Recalled tables per question kept in each worker, and their seconds to live
+    SCHEMA_RECALL_CACHE_SIZE = os.getenv("SCHEMA_RECALL_CACHE_SIZE")
+    SCHEMA_RECALL_CACHE_TTL = os.getenv("SCHEMA_RECALL_CACHE_TTL")
 
     # Query result settings
     MAX_TOKENS_FOR_QUERY_RESULT = os.getenv("MAX_TOKENS_FOR_QUERY_RESULT")
     MAX_RESULT_COUNT_FOR_DISPLAY_RESULT = os.getenv(
         "MAX_RESULT_COUNT_FOR_DISPLAY_RESULT"
     )
+    MAX_RESULT_BYTES_FOR_QUERY_RESULT = os.getenv("MAX_RESULT_BYTES_FOR_QUERY_RESULT")
+    QUERY_EXECUTION_TIMEOUT = os.getenv("QUERY_EXECUTION_TIMEOUT")
+    # Rows a generated query may read by its EXPLAIN estimate, 0 disables the check
+    MAX_EXAMINED_ROWS = os.getenv("MAX_EXAMINED_ROWS")
+    # Default seconds a query result is cached, 0 disables the cache
+    QUERY_RESULT_CACHE_TTL = os.getenv("QUERY_RESULT_CACHE_TTL")
+
+    # Minutes between checks of application databases for schema changes
+    SCHEMA_PROBE_INTERVAL_MINUTES = os.getenv("SCHEMA_PROBE_INTERVAL_MINUTES")
+
+    # Background jobs run concurrently per worker process
+    JOB_MAX_WORKERS = os.getenv("JOB_MAX_WORKERS")
+
+    # Concurrent LLM requests when generating AI comments of a whole application
+    AI_COMMENT_CONCURRENCY = os.getenv("AI_COMMENT_CONCURRENCY")
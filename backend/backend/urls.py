@@ -12,6 +12,7 @@ from rest_framework.routers import DefaultRouter
 from backend.apps.application import views as application_views
 from backend.apps.authentication import views as authentication_views
 from backend.apps.chat import views as chat_views
+from backend.apps.core import views as core_views
 
 
 class NoSlashRouter(DefaultRouter):
@@ -50,6 +51,7 @@ router.register(
     basename="fine_tuning_model",
 )
 router.register(r"message", chat_views.MessageViewSet, basename="message")
+router.register(r"job", core_views.JobViewSet, basename="job")
 router.register(
     r"application-suggested-questions",
     application_views.ApplicationSuggestedQuestionViewSet,
@@ -0,0 +1,91 @@
+import math
+import re
+from collections import Counter
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[一-鿿]+")
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into search terms.
+    Latin words are split on non-alphanumerics (so snake_case names become words),
+    CJK runs, which have no word boundaries, become characters and character bigrams.
+    """
+    terms = []
+    for word in _WORD_PATTERN.findall((text or "").lower()):
+        if _CJK_PATTERN.match(word):
+            terms.extend(word)
+            terms.extend(word[i : i + 2] for i in range(len(word) - 1))
+        else:
+            terms.append(word)
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 index supporting incremental adds and removals
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, dict] = {}
+        self.doc_terms: dict = {}
+        self.doc_lengths: dict = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def add(self, doc_id, text: str):
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = list(terms)
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, text: str, top_k: int | None = None) -> list[tuple]:
+        """
+        Score documents against a query
+        :param text: Query text
+        :param top_k: Maximum number of results, all matching documents if None
+        :return: (doc_id, score) pairs, best first
+        """
+        if not self.doc_lengths:
+            return []
+        doc_count = len(self.doc_lengths)
+        average_length = self.total_length / doc_count or 1
+        scores: dict = {}
+        for term in set(tokenize(text)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, count in docs.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self.doc_lengths[doc_id] / average_length
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (
+                    self.k1 + 1
+                ) / (count + norm)
+        results = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return results[:top_k] if top_k else results
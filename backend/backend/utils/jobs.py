@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+
+from backend.settings.env import ENV
+
+logger = logging.getLogger(__name__)
+
+# Job states outlive the job by a day, so clients can still read the result
+JOB_TIMEOUT = 24 * 60 * 60
+# Minimum seconds between two checks of the shared cache for cancellation
+JOB_CANCEL_POLL_INTERVAL = 1.0
+# Seconds between heartbeats of the queued and running jobs of a process
+JOB_HEARTBEAT_INTERVAL = 10
+# A queued or running job without a heartbeat for this long was lost with its process
+JOB_HEARTBEAT_TIMEOUT = 60
+
+
+class EJobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobError(Exception):
+    """
+    Expected failure of a job, the message is shown to the user
+    """
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _get_job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _get_job_cancelled_key(job_id: str) -> str:
+    return f"job_cancelled:{job_id}"
+
+
+def _get_job_heartbeat_key(job_id: str) -> str:
+    return f"job_heartbeat:{job_id}"
+
+
+class Job:
+    """
+    Handle of a running job, passed to the job function to report progress and check cancellation.
+    A job without id runs inline and reports nothing.
+    """
+
+    def __init__(self, job_id: str | None = None, name: str = ""):
+        self.id = job_id
+        self.state = {
+            "id": job_id,
+            "name": name,
+            "status": EJobStatus.PENDING.value,
+            "progress": {"current": 0, "total": None, "message": ""},
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def save(self):
+        if self.id:
+            cache.set(_get_job_key(self.id), self.state, JOB_TIMEOUT)
+
+    def set_progress(self, current: int, total: int | None = None, message: str = ""):
+        """
+        Report progress and stop the job if it was cancelled
+        :param current: Finished units of work
+        :param total: Total units of work, None if unknown
+        :param message: What the job is doing
+        """
+        self.state["progress"] = {
+            "current": current,
+            "total": total,
+            "message": message,
+        }
+        self.save()
+        self.check_cancelled()
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled or not self.id:
+            return self._cancelled
+        now = time.monotonic()
+        if now - self._checked_at >= JOB_CANCEL_POLL_INTERVAL:
+            self._checked_at = now
+            self._cancelled = bool(cache.get(_get_job_cancelled_key(self.id)))
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+
+
+class JobQueue:
+    """
+    Runs long operations on a bounded thread pool, off the request workers.
+    Job states and cancellation signals live in the shared cache, so any worker
+    can report or cancel a job, but a job runs in the process that accepted it.
+    The process sends heartbeats of its unfinished jobs, a job whose heartbeat stops,
+    e.g. after a restart, is reported as failed.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        # Ids of the queued and running jobs of this process
+        self._active_job_ids: set[str] = set()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="job"
+                )
+                threading.Thread(
+                    target=self._send_heartbeats, name="job-heartbeat", daemon=True
+                ).start()
+            return self._executor
+
+    @staticmethod
+    def _send_heartbeat(job_ids):
+        cache.set_many(
+            {_get_job_heartbeat_key(job_id): time.time() for job_id in job_ids},
+            JOB_HEARTBEAT_TIMEOUT,
+        )
+
+    def _send_heartbeats(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+            with self._lock:
+                job_ids = list(self._active_job_ids)
+            if not job_ids:
+                continue
+            try:
+                self._send_heartbeat(job_ids)
+            except Exception:
+                logger.warning("Failed to send job heartbeats", exc_info=True)
+
+    def submit(self, name: str, func, *args, **kwargs) -> str:
+        """
+        Queue a job
+        :param name: Operation name, reported with the job state
+        :param func: Called as func(job, *args, **kwargs), returns the job result
+        :return: Job id
+        """
+        job = Job(uuid.uuid4().hex, name)
+        job.save()
+        executor = self._get_executor()
+        with self._lock:
+            self._active_job_ids.add(job.id)
+        self._send_heartbeat([job.id])
+        executor.submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, func, args, kwargs):
+        close_old_connections()
+        try:
+            job.check_cancelled()
+            job.state["status"] = EJobStatus.RUNNING.value
+            job.state["started_at"] = time.time()
+            job.save()
+            job.state["result"] = func(job, *args, **kwargs)
+            job.state["status"] = EJobStatus.SUCCEEDED.value
+        except JobCancelled:
+            job.state["status"] = EJobStatus.CANCELLED.value
+        except JobError as e:
+            job.state["status"] = EJobStatus.FAILED.value
+            job.state["error"] = str(e)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.state["name"])
+            job.state["status"] = EJobStatus.FAILED.value
+            job.state["error"] = str(e)
+        finally:
+            job.state["finished_at"] = time.time()
+            job.save()
+            with self._lock:
+                self._active_job_ids.discard(job.id)
+            # Pool threads are long-lived, don't keep their database connections open
+            connections.close_all()
+
+    @staticmethod
+    def get(job_id: str) -> dict | None:
+        state = cache.get(_get_job_key(job_id))
+        if state is None:
+            return None
+        if state["status"] in (
+            EJobStatus.PENDING.value,
+            EJobStatus.RUNNING.value,
+        ) and not cache.get(_get_job_heartbeat_key(job_id)):
+            state = {
+                **state,
+                "status": EJobStatus.FAILED.value,
+                "error": "The job was interrupted, please run it again",
+                "finished_at": time.time(),
+            }
+            cache.set(_get_job_key(job_id), state, JOB_TIMEOUT)
+        return {
+            **state,
+            "cancel_requested": bool(cache.get(_get_job_cancelled_key(job_id))),
+        }
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Request cancellation, a running job stops at its next progress report
+        :return: False if the job doesn't exist or already finished
+        """
+        state = self.get(job_id)
+        if not state or state["status"] not in (
+            EJobStatus.PENDING.value,
+            EJobStatus.RUNNING.value,
+        ):
+            return False
+        cache.set(_get_job_cancelled_key(job_id), True, JOB_TIMEOUT)
+        return True
+
+
+job_queue = JobQueue(int(ENV.JOB_MAX_WORKERS or 4))
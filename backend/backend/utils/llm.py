@@ -1,11 +1,23 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
 import json
 import re
-from typing import Generator, Iterator, Optional
+import uuid
+import weakref
+from typing import AsyncIterator, Generator, Iterator, Optional
 
 import aisuite as ai
+import httpx
 import tiktoken
+from aisuite.provider import LLMError
+from django.core.cache import cache
+from django.db.models import Prefetch
 
-from backend.apps.application.models import ApplicationTable
+from backend.apps.application.models import ApplicationTable, ApplicationTableColumn
+from backend.apps.application.utils import json_list_to_ddl
+from backend.settings.env import ENV
 
 client = ai.Client()
 client.configure(
@@ -17,14 +29,53 @@ client.configure(
 )
 
 
-def get_llm_tokens(messages: str | list[dict]):
-    encoding = tiktoken.encoding_for_model("gpt-4o")
+# Only texts up to this length are kept in the token count cache
+TOKEN_COUNT_CACHE_MAX_TEXT_LENGTH = 256 * 1024
+# Tokens used by the role and separators of each chat message
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+@functools.cache
+def get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+@functools.lru_cache(maxsize=256)
+def _get_cached_text_tokens(text: str) -> int:
+    return len(get_encoding().encode_ordinary(text))
+
+
+def get_text_tokens(text: str, approximate: bool = False) -> int:
+    """
+    Count the tokens of a text
+    :param text: Text to count
+    :param approximate: Estimate from the UTF-8 length instead of encoding, never undercounts by much
+    :return: Token count
+    """
+    if not text:
+        return 0
+    if approximate:
+        # ~4 bytes per token for latin text, ~3 bytes (one char) per token for CJK
+        return -(-len(text.encode("utf-8")) // 3)
+    if len(text) <= TOKEN_COUNT_CACHE_MAX_TEXT_LENGTH:
+        return _get_cached_text_tokens(text)
+    return len(get_encoding().encode_ordinary(text))
+
+
+def get_llm_tokens(messages: str | list[dict], approximate: bool = False) -> int:
+    """
+    Count the tokens of a text or a list of chat messages
+    :param messages: Text or chat messages
+    :param approximate: Use the cheap estimator, for budget decisions that don't need exact counts
+    :return: Token count
+    """
     if isinstance(messages, list):
-        text = json.dumps(messages, separators=(",", ":"), ensure_ascii=False)
-    else:
-        text = messages
-    tokens = encoding.encode(text)
-    return len(tokens)
+        return sum(
+            get_text_tokens(str(message.get("content") or ""), approximate)
+            + MESSAGE_TOKEN_OVERHEAD
+            for message in messages
+        )
+    return get_text_tokens(messages, approximate)
 
 
 class LLMResponseFormat:
@@ -86,11 +137,73 @@ class LLMResponseFormat:
         return None, error_msg
 
 
-def create_application_schema(application_id) -> tuple[list[dict], str]:
+SCHEMA_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _get_schema_version_key(application_id) -> str:
+    return f"application_schema_version:{application_id}"
+
+
+def get_schema_version(application_id) -> str:
+    """
+    Get the schema version of an application, it changes whenever its tables or columns change
+    """
+    key = _get_schema_version_key(application_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+# Applications whose schema version is bumped when the current batch ends
+_batched_schema_version_bumps: contextvars.ContextVar[set | None] = (
+    contextvars.ContextVar("batched_schema_version_bumps", default=None)
+)
+
+
+def bump_schema_version(application_id):
+    """
+    Invalidate every cached schema of an application
+    """
+    batched = _batched_schema_version_bumps.get()
+    if batched is not None:
+        batched.add(str(application_id))
+        return
+    cache.set(_get_schema_version_key(application_id), uuid.uuid4().hex, None)
+
+
+def is_schema_version_bump_batched() -> bool:
+    return _batched_schema_version_bumps.get() is not None
+
+
+@contextlib.contextmanager
+def batch_schema_version_bump(*application_ids):
+    """
+    Bump schema versions once when the block ends instead of on every change inside it
+    :param application_ids: Applications changed inside the block
+    """
+    batched = {str(application_id) for application_id in application_ids}
+    token = _batched_schema_version_bumps.set(batched)
+    try:
+        yield
+    finally:
+        _batched_schema_version_bumps.reset(token)
+        for application_id in batched:
+            bump_schema_version(application_id)
+
+
+def _build_application_schema(application_id) -> list[dict]:
     table_instances = ApplicationTable.objects.filter(
         application_id=application_id, is_enabled=True
-    ).prefetch_related("columns")
-    schema = [
+    ).prefetch_related(
+        Prefetch(
+            "columns",
+            queryset=ApplicationTableColumn.objects.filter(is_enabled=True),
+            to_attr="enabled_columns",
+        )
+    )
+    return [
         {
             "table": table.name,
             "comment": table.ai_comment,
@@ -103,12 +216,37 @@ def create_application_schema(application_id) -> tuple[list[dict], str]:
                     "comment": col.ai_comment,
                     "nullable": col.nullable,
                 }
-                for col in table.columns.filter(is_enabled=True)  # type: ignore
+                for col in table.enabled_columns  # type: ignore
             ],
         }
         for table in table_instances
     ]
-    return schema, json.dumps(schema, separators=(",", ":"), ensure_ascii=False)
+
+
+def _get_application_schema_cache(application_id) -> dict:
+    key = f"application_schema:{application_id}:{get_schema_version(application_id)}"
+    schema_cache = cache.get(key)
+    if schema_cache is None:
+        schema = _build_application_schema(application_id)
+        ddl_list, ddl_str = json_list_to_ddl(schema)
+        schema_cache = {
+            "schema": schema,
+            "schema_str": json.dumps(schema, separators=(",", ":"), ensure_ascii=False),
+            "ddl_list": ddl_list,
+            "ddl_str": ddl_str,
+        }
+        cache.set(key, schema_cache, SCHEMA_CACHE_TIMEOUT)
+    return schema_cache
+
+
+def create_application_schema(application_id) -> tuple[list[dict], str]:
+    schema_cache = _get_application_schema_cache(application_id)
+    return schema_cache["schema"], schema_cache["schema_str"]
+
+
+def create_application_ddl(application_id) -> tuple[list[str], str]:
+    schema_cache = _get_application_schema_cache(application_id)
+    return schema_cache["ddl_list"], schema_cache["ddl_str"]
 
 
 class ChatCompletionService:
@@ -158,3 +296,108 @@ class ChatCompletionService:
         for chunk in response:
             if chunk.choices[0].delta.content is not None:
                 yield chunk.choices[0].delta.content
+
+
+class AsyncChatCompletionService:
+    """
+    Asyncio-native chat completion service for Ollama.
+    All requests running on the same event loop share one keep-alive connection pool.
+    """
+
+    _CHAT_COMPLETION_ENDPOINT = "/api/chat"
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    set_llm_messages = ChatCompletionService.set_llm_messages
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        """
+        Get the shared HTTP client of the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None or client.is_closed:
+            max_connections = int(ENV.OLLAMA_MAX_CONNECTIONS or 100)
+            base_url = (
+                ENV.OLLAMA_API_URL or ENV.OLLAMA_BASE_URL or "http://localhost:11434"
+            )
+            client = httpx.AsyncClient(
+                base_url=base_url.rstrip("/"),
+                timeout=httpx.Timeout(600, connect=10),
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=60,
+                ),
+            )
+            cls._clients[loop] = client
+        return client
+
+    @staticmethod
+    def _get_payload(
+        model: str,
+        messages: list[dict[str, str]],
+        stream: bool,
+        **kwargs,
+    ) -> dict:
+        # Models are addressed as "<provider>:<model>", e.g. "ollama:qwen2.5:latest"
+        provider, _, model_name = model.partition(":")
+        return {
+            "model": model_name if provider == "ollama" else model,
+            "messages": messages,
+            "stream": stream,
+            **kwargs,
+        }
+
+    @classmethod
+    async def create_completion(
+        cls,
+        model: str,
+        messages: list[dict[str, str]],
+        **kwargs,
+    ) -> str:
+        try:
+            response = await cls.get_client().post(
+                cls._CHAT_COMPLETION_ENDPOINT,
+                json=cls._get_payload(model, messages, stream=False, **kwargs),
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise LLMError(f"Ollama request failed: {e}")
+        data = response.json()
+        if data.get("error"):
+            raise LLMError(f"Ollama request failed: {data['error']}")
+        return data["message"]["content"]
+
+    @classmethod
+    async def create_stream_completion(
+        cls,
+        model: str,
+        messages: list[dict[str, str]],
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        try:
+            async with cls.get_client().stream(
+                "POST",
+                cls._CHAT_COMPLETION_ENDPOINT,
+                json=cls._get_payload(model, messages, stream=True, **kwargs),
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        # Failures after the response started, e.g. the model crashed
+                        raise LLMError(f"Ollama request failed: {chunk['error']}")
+                    content = chunk.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    if chunk.get("done"):
+                        break
+        except httpx.HTTPError as e:
+            raise LLMError(f"Ollama request failed: {e}")
@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import zlib
+from collections import Counter
+
+import numpy as np
+from django.utils.module_loading import import_string
+
+from backend.settings.env import ENV
+from backend.utils.bm25 import tokenize
+
+DEFAULT_HASHING_DIMENSION = 1024
+
+_VECTORS_FILE = "vectors.npy"
+_META_FILE = "meta.json"
+# Prefix of the directories indexes are written to before they are renamed into place
+BUILD_DIR_PREFIX = ".build-"
+
+
+class HashingEmbedder:
+    """
+    Offline embedder hashing words and character trigrams into a fixed number of signed buckets.
+    It needs no model, so vectors only capture lexical overlap, including partial
+    word matches such as "order" and "orders".
+    """
+
+    def __init__(self, dimension: int = DEFAULT_HASHING_DIMENSION):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _get_features(self, text: str) -> Counter:
+        features: Counter = Counter()
+        for term in tokenize(text):
+            features[term] += 1.0
+            if len(term) > 3 and term.isascii():
+                padded = f"#{term}#"
+                for i in range(len(padded) - 2):
+                    features[padded[i : i + 3]] += 0.5
+        return features
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._get_features(text).items():
+                # crc32 is stable across processes, unlike hash()
+                digest = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dimension] += sign * (1 + math.log(weight))
+        return vectors
+
+
+def get_embedder():
+    """
+    Get the embedder of local vector indexes. SCHEMA_EMBEDDER may point to any callable,
+    or class creating one, that turns a list of texts into a 2D array; a `name`
+    attribute identifies its vectors, indexes built by another embedder are rebuilt.
+    """
+    if not ENV.SCHEMA_EMBEDDER:
+        return HashingEmbedder()
+    embedder = import_string(ENV.SCHEMA_EMBEDDER)
+    if isinstance(embedder, type):
+        embedder = embedder()
+    if not getattr(embedder, "name", None):
+        embedder.name = ENV.SCHEMA_EMBEDDER
+    return embedder
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """
+    Matrix of unit vectors with per-row metadata, stored as a .npy file and memory-mapped
+    on load, so the operating system shares and pages it across worker processes
+    """
+
+    def __init__(self, vectors: np.ndarray, rows: list):
+        self.vectors = vectors
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, path: str, vectors: np.ndarray, rows: list) -> "VectorIndex":
+        """
+        Write an index to a directory, replacing it atomically so readers never see a partial index
+        :param path: Index directory
+        :param vectors: One vector per row
+        :param rows: JSON serializable metadata of each row
+        """
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        temp_path = tempfile.mkdtemp(dir=parent, prefix=BUILD_DIR_PREFIX)
+        try:
+            np.save(os.path.join(temp_path, _VECTORS_FILE), _normalize(vectors))
+            with open(os.path.join(temp_path, _META_FILE), "w") as f:
+                json.dump({"rows": rows}, f, ensure_ascii=False)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Built concurrently by another worker, its index is the same
+                pass
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex | None":
+        try:
+            with open(os.path.join(path, _META_FILE)) as f:
+                rows = json.load(f)["rows"]
+            vectors = np.load(os.path.join(path, _VECTORS_FILE), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(vectors, rows)
+
+    def search(
+        self, vector: np.ndarray, top_k: int | None = None, min_score: float = -1.0
+    ) -> list[tuple]:
+        """
+        Rows most similar to a vector by cosine similarity
+        :param vector: Query vector
+        :param top_k: Maximum number of results, all rows if None
+        :param min_score: Only rows scoring above it
+        :return: (row, score) pairs, best first
+        """
+        if not self.rows:
+            return []
+        scores = self.vectors @ _normalize(vector).reshape(-1)
+        indexes = np.flatnonzero(scores > min_score)
+        if top_k and top_k < len(indexes):
+            indexes = indexes[np.argpartition(-scores[indexes], top_k - 1)[:top_k]]
+        indexes = indexes[np.argsort(-scores[indexes], kind="stable")]
+        return [(self.rows[i], float(scores[i])) for i in indexes]
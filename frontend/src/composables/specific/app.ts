@@ -31,6 +31,7 @@ import {
   enableDisableRagApi,
   executeSqlApi,
   exportFineTuningExampleApi,
+  generateAppAICommentsApi,
   getAppApi,
   getAppDatabaseDocumentApi,
   getAppDatabasesApi,
@@ -147,6 +148,7 @@ export const useDataStructure = () => {
   const loadingGetDataStructure = ref(false)
   const loadingGetTableColumns = ref(false)
   const loadingGetAppTableAIComment = ref(false)
+  const loadingGenerateAppAIComments = ref(false)
   const loadingCreateAppDatabaseDocument = ref(false)
 
   const _formatDataStructureTree = (data: IAppTable[]) => {
@@ -175,7 +177,7 @@ export const useDataStructure = () => {
       loadingCreateDataStructure.value = false
     })
     if (code === 0) {
-      _formatDataStructureTree(data)
+      _formatDataStructureTree(data.tables)
     }
   }
 
@@ -200,6 +202,16 @@ export const useDataStructure = () => {
     }
   }
 
+  const generateAppAIComments = async (applicationId: number | string, autoReplace: boolean) => {
+    loadingGenerateAppAIComments.value = true
+    const { code, data } = await generateAppAICommentsApi(applicationId, { autoReplace }).finally(() => {
+      loadingGenerateAppAIComments.value = false
+    })
+    if (code === 0) {
+      return data
+    }
+  }
+
   const updateAppTable = async (tableId: string, payload: Partial<IAppTable>) => {
     await updateAppTableApi(tableId, payload)
   }
@@ -233,9 +245,11 @@ export const useDataStructure = () => {
     loadingGetDataStructure,
     loadingGetTableColumns,
     loadingGetAppTableAIComment,
+    loadingGenerateAppAIComments,
     loadingCreateAppDatabaseDocument,
     dataStructureTree,
     getAppTableAIComment,
+    generateAppAIComments,
     dataStructureTreeCache,
     appDatabaseSchema,
     tableColumns,
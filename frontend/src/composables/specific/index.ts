@@ -13,7 +13,7 @@ import {
   getMessageApi,
   getMyMessagesApi,
 } from '@/services/apis/chat'
-import type { IMessage, IStep } from '@/types/chat'
+import type { IAnswer, IMessage, IStep } from '@/types/chat'
 import { EStepNames } from '@/types/chat'
 import { EDisplayMode } from '@/constants'
 import { useUserStore } from '@/store'
@@ -114,16 +114,22 @@ export const useMessage = ({ isPendingResponse = ref<boolean>(false) } = {}) =>
       payload: JSON.stringify(payload),
       method: 'POST',
     })
-    const handler = async (e: Record<string, any>) => {
-      const stepData = JSON.parse(e?.data ?? '[]')
-      newMessage.steps = stepData
+    const steps: IStep[] = []
+    let isFinalHandled = false
+    const handler = async (stepData: IStep[]) => {
+      newMessage.steps = [...stepData]
       const latestStep = stepData[stepData.length - 1]
+      if (!latestStep)
+        return
       newMessage.id = latestStep.id
       newMessage.taskId = latestStep.taskId
       if (latestStep?.step === EStepNames.ANSWER_GENERATOR_AGENT) {
-        newMessage.answer = latestStep.result
+        newMessage.answer = latestStep.result as IAnswer
       }
       if (latestStep?.isFinalCompleted) {
+        if (isFinalHandled)
+          return
+        isFinalHandled = true
         newMessage.answer = latestStep.answer
         newMessage.isPendingResponse = false
         isPendingResponse.value = false
@@ -145,7 +151,35 @@ export const useMessage = ({ isPendingResponse = ref<boolean>(false) } = {}) =>
       }
       emitter.emit(EEventNames.NEW_MESSAGE, newMessage)
     }
-    source.addEventListener('message', handler)
+    // Steps started or completed, the whole step is sent
+    const stepHandler = (e: Record<string, any>) => {
+      const data = JSON.parse(e?.data ?? '{}')
+      steps[data.index] = data.step
+      handler(steps)
+    }
+    // Only the new answer text is sent, applied at the given offset
+    const answerDeltaHandler = (e: Record<string, any>) => {
+      const data = JSON.parse(e?.data ?? '{}')
+      const step = steps[data.index]
+      if (!step)
+        return
+      const result = step.result as Record<string, any>
+      step.result = {
+        ...result,
+        summary: (result.summary ?? '').slice(0, data.offset) + data.delta,
+        displayMode: data.displayMode,
+      }
+      handler(steps)
+    }
+    const snapshotHandler = (e: Record<string, any>) => {
+      const data = JSON.parse(e?.data ?? '{}')
+      steps.splice(0, steps.length, ...(data.steps ?? []))
+      handler(steps)
+    }
+    source.addEventListener('step_started', stepHandler)
+    source.addEventListener('step_completed', stepHandler)
+    source.addEventListener('answer_delta', answerDeltaHandler)
+    source.addEventListener('snapshot', snapshotHandler)
     source.addEventListener('close', () => {
       isPendingResponse.value = false
     })
@@ -107,6 +107,7 @@ export default {
     sqlPreview: 'SQL Preview',
     errorMessage: 'Error Message',
     optimizedQuestion: 'Optimized Question',
+    timeWindowNotice: 'To stay within the query cost limit, only rows of {table} from the last {days} days were queried',
   },
   application: {
     createApp: 'Create Application',
@@ -121,6 +122,9 @@ export default {
     dbName: 'Database Name',
     dbUser: 'Database User',
     dbPassword: 'Database Password',
+    readReplicas: 'Read Replicas',
+    replicaWeight: 'Weight',
+    addReadReplica: 'Add Read Replica',
     saveSuccess: 'Application data saved successfully',
     nameRequired: 'Please input application name',
     descRequired: 'Please input application description',
@@ -218,6 +222,10 @@ export default {
     updateConfirmTitle: 'Update Confirmation',
     updateConfirmContent: 'This operation will retrieve the database table structure again and update the generated AI dataset. Do you want to continue?',
     updateStructureSuccess: 'Data structure updated successfully',
+    generateAIComments: 'Generate AI Comments for All Tables',
+    generateAICommentsConfirmContent: 'AI comments will be generated for every enabled table that has no AI comment yet. Do you want to continue?',
+    generateAICommentsSuccess: 'AI comments generated for {count} tables',
+    generateAICommentsFailed: 'Failed to generate AI comments for: {tables}',
     databaseTableDocument: 'Database Table Documentation',
     characters: 'characters',
     retrievalDocument: 'Retrieval Document',
@@ -107,6 +107,7 @@ export default {
     sqlPreview: 'SQL 预览',
     errorMessage: '错误信息',
     optimizedQuestion: '优化后的问题',
+    timeWindowNotice: '为控制查询开销，仅查询了 {table} 最近 {days} 天的数据',
   },
   application: {
     createApp: '创建应用',
@@ -121,6 +122,9 @@ export default {
     dbName: '数据库名称',
     dbUser: '数据库用户',
     dbPassword: '数据库密码',
+    readReplicas: '只读副本',
+    replicaWeight: '权重',
+    addReadReplica: '添加只读副本',
     saveSuccess: '应用数据保存成功',
     nameRequired: '请输入应用名称',
     descRequired: '请输入应用描述',
@@ -220,6 +224,10 @@ export default {
     updateConfirmTitle: '更新确认',
     updateConfirmContent: '当前操作将重新读取数据库的表结构，并对已经生成的AI数据集进行更新，是否继续？',
     updateStructureSuccess: '数据结构更新成功',
+    generateAIComments: '批量生成AI注释',
+    generateAICommentsConfirmContent: '将为所有尚未生成AI注释的已启用表生成AI注释，是否继续？',
+    generateAICommentsSuccess: '已为{count}张表生成AI注释',
+    generateAICommentsFailed: '以下表的AI注释生成失败：{tables}',
     databaseTableDocument: '数据库表文档',
     characters: '个字符',
     retrievalDocument: '检索文档',
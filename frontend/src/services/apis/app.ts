@@ -1,5 +1,6 @@
 import type { AxiosResponse } from 'axios'
 import request from '../request'
+import { waitForJob } from './job'
 import type { IAppPrompt, IAppTable, IModel, ITableColumn } from '@/types/app'
 
 interface IParams {
@@ -44,7 +45,7 @@ export const deleteAppApi = async (applicationId: number | string) => {
 // 创建App的数据表
 export const createAppTablesApi = async (applicationId: number | string) => {
   const res: AxiosResponse = await request.post(`/app/${applicationId}/create_database_tables`)
-  return res.data
+  return waitForJob(res.data)
 }
 
 // 获取App的数据库表
@@ -72,7 +73,16 @@ export const updateAppTableApi = async (tableId: string, payload: Partial<IAppTa
 // 获取AI生成的表及字段的注释
 export const getAppTableAICommentApi = async (tableId: string) => {
   const res: AxiosResponse = await request.get(`/app_table/${tableId}/get_ai_comment`)
-  return res.data
+  return waitForJob(res.data)
+}
+
+// 批量生成App所有表及字段的AI注释
+export const generateAppAICommentsApi = async (
+  applicationId: number | string,
+  payload: { all?: boolean, autoReplace?: boolean } = {},
+) => {
+  const res: AxiosResponse = await request.post(`/app/${applicationId}/generate_ai_comments`, { ...payload })
+  return waitForJob(res.data)
 }
 
 // 更新字段
@@ -112,7 +122,7 @@ export const getAppDatabaseDocumentApi = async (applicationId: string | number)
 // 创建App数据的embedding文档
 export const createAppDatabaseDocumentApi = async (applicationId: string | number) => {
   const res: AxiosResponse = await request.post('/app_document/create_embed', { applicationId })
-  return res.data
+  return waitForJob(res.data)
 }
 
 // 检索文档
@@ -135,7 +145,7 @@ export const createFineTuningQuestionsApi = async (payload: {
   questionCount: number
 }) => {
   const res: AxiosResponse = await request.post('/fine_tuning_example/create_questions', payload)
-  return res.data
+  return waitForJob(res.data)
 }
 
 // 批量删除微调用的问题示例
@@ -229,13 +239,13 @@ export const getModelsApi = async (applicationId: number | string) => {
 // 转换模型
 export const convertModelApi = async (payload: Record<string, any>) => {
   const res: AxiosResponse = await request.post('/convert_model', payload)
-  return res.data
+  return waitForJob(res.data)
 }
 
 // 部署模型
 export const deploymentModelApi = async (payload: Record<string, any>) => {
   const res: AxiosResponse = await request.post('/deployment_model', payload)
-  return res.data
+  return waitForJob(res.data)
 }
 
 // 更新部署模型
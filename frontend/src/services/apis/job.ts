@@ -0,0 +1,52 @@
+import type { AxiosResponse } from 'axios'
+import { message as showMessage } from 'ant-design-vue'
+import request from '../request'
+import type { IJob } from '@/types/app'
+
+const JOB_POLL_INTERVAL = 1000
+// 最长等待时间，超过后停止轮询
+const JOB_MAX_WAIT = 2 * 60 * 60 * 1000
+
+// 获取后台任务状态
+export const getJobApi = async (jobId: string) => {
+  const res: AxiosResponse = await request.get(`/job/${jobId}`)
+  return res.data
+}
+
+// 取消后台任务
+export const cancelJobApi = async (jobId: string) => {
+  const res: AxiosResponse = await request.post(`/job/${jobId}/cancel`)
+  return res.data
+}
+
+// 等待后台任务完成，返回与同步接口相同的 { code, data, msg }
+export const waitForJob = async (
+  response: { code: number, data: any, msg?: string },
+  onProgress?: (job: IJob) => void,
+) => {
+  if (response.code !== 0 || !response.data?.jobId) {
+    return response
+  }
+  const jobId: string = response.data.jobId
+  const deadline = Date.now() + JOB_MAX_WAIT
+  while (Date.now() < deadline) {
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL))
+    const { code, data, msg } = await getJobApi(jobId)
+    if (code !== 0) {
+      return { code, data: null, msg }
+    }
+    const job = data as IJob
+    onProgress?.(job)
+    if (job.status === 'succeeded') {
+      return { code: 0, data: job.result, msg: 'success' }
+    }
+    if (job.status === 'failed' || job.status === 'cancelled') {
+      const error = job.error || `Job ${job.status}`
+      showMessage.error(error)
+      return { code: 1, data: null, msg: error }
+    }
+  }
+  const error = `Job ${jobId} did not finish in time`
+  showMessage.error(error)
+  return { code: 1, data: null, msg: error }
+}
@@ -74,6 +74,7 @@ export interface IDatabaseDocument {
   contentType: string
   token_count?: number
   character_count?: number
+  contentHash?: string
 }
 
 export interface IModel {
@@ -91,3 +92,17 @@ export interface IAppSuggestedQuestion {
   createdAt?: string
   updatedAt?: string
 }
+
+export interface IJob {
+  id: string
+  name: string
+  status: 'pending' | 'running' | 'succeeded' | 'failed' | 'cancelled'
+  progress: {
+    current: number
+    total: number | null
+    message: string
+  }
+  result: any
+  error: string | null
+  cancelRequested: boolean
+}
@@ -30,6 +30,7 @@ export interface IStep {
   sqlList?: string[]
   validSql?: string
   queryResult?: Record<string, any>[]
+  resultInfo?: Record<string, any>
   stepTimes?: Record<string, number>
 }
 